@@ -29,4 +29,80 @@ class Config:
     SQLALCHEMY_DATABASE_URI = f"{DB_TYPE}+{DB_DRIVER}://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
-    ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv'}
\ No newline at end of file
+    ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv'}
+    MAX_VIDEO_UPLOAD_BYTES = int(getenv('MAX_VIDEO_UPLOAD_BYTES', 4 * 1024 ** 3))
+
+    # Attendance materialization
+    ATTENDANCE_WINDOW_DAYS = int(getenv('ATTENDANCE_WINDOW_DAYS', 6))
+    ATTENDANCE_MATERIALIZE_TTL = int(getenv('ATTENDANCE_MATERIALIZE_TTL', 300))  # seconds
+
+    # Background video transcoding
+    TRANSCODE_WORKERS = int(getenv('TRANSCODE_WORKERS', 2))
+    TRANSCODE_QUEUE_SIZE = int(getenv('TRANSCODE_QUEUE_SIZE', 20))
+    TRANSCODE_TIMEOUT = int(getenv('TRANSCODE_TIMEOUT', 3600))  # seconds per job
+    TRANSCODE_JOB_HISTORY = int(getenv('TRANSCODE_JOB_HISTORY', 500))
+    TRANSCODE_MAX_CONCURRENT = int(getenv('TRANSCODE_MAX_CONCURRENT', 2))  # ffmpeg processes across all callers
+    TRANSCODE_THREADS = int(getenv('TRANSCODE_THREADS', 2))  # encoder threads per job
+    TRANSCODE_PROFILE = getenv('TRANSCODE_PROFILE', 'balanced')
+    TRANSCODE_PROFILES = {
+        'fast': {'preset': 'veryfast', 'crf': 28, 'max_height': 720, 'audio_bitrate': '96k'},
+        'balanced': {'preset': 'medium', 'crf': 23, 'max_height': 720, 'audio_bitrate': '128k'},
+        'archive': {'preset': 'slow', 'crf': 20, 'max_height': 1080, 'audio_bitrate': '128k'},
+        'retention': {'preset': 'slow', 'crf': 30, 'max_height': 480, 'audio_bitrate': '64k'},
+    }
+
+    # PDF rendering
+    PDF_BACKEND = getenv('PDF_BACKEND', 'wkhtmltopdf')  # or 'weasyprint'
+    PDF_WORKERS = int(getenv('PDF_WORKERS', 2))  # documents rendered at once
+    PDF_QUEUE_SIZE = int(getenv('PDF_QUEUE_SIZE', 20))  # documents waiting before requests are rejected
+    PDF_TIMEOUT = int(getenv('PDF_TIMEOUT', 60))  # seconds per document
+    PDF_REQUEST_TIMEOUT = int(getenv('PDF_REQUEST_TIMEOUT', 25))  # seconds a request waits for its document; keep below the HTTP worker timeout
+    WKHTMLTOPDF_PATH = getenv('WKHTMLTOPDF_PATH', 'wkhtmltopdf')
+    WKHTMLTOPDF_OPTIONS = {'encoding': 'UTF-8', 'quiet': ''}
+    PDF_CACHE_DIR = getenv('PDF_CACHE_DIR', os.path.join(os.getcwd(), 'cache', 'pdf'))  # empty disables the cache
+    PDF_CACHE_MAX_BYTES = int(getenv('PDF_CACHE_MAX_BYTES', 256 * 1024 ** 2))
+    PAYROLL_FOLDER = getenv('PAYROLL_FOLDER', os.path.join(os.getcwd(), 'payroll'))  # month-end invoice archives
+
+    # Sales dashboard
+    SALES_RECORDS_PER_PAGE = int(getenv('SALES_RECORDS_PER_PAGE', 50))
+    STUDENT_INDEX_SYNC_INTERVAL = int(getenv('STUDENT_INDEX_SYNC_INTERVAL', 30))  # seconds between picking up other processes' changes
+    STUDENT_INDEX_MIN_SIMILARITY = float(getenv('STUDENT_INDEX_MIN_SIMILARITY', 0.3))  # trigram similarity for typo matches
+
+    # Fee receipts
+    ACADEMIC_YEAR_START_MONTH = int(getenv('ACADEMIC_YEAR_START_MONTH', 4))  # April; picks the fee schedule year
+    FEE_SCHEDULE_SYNC_INTERVAL = int(getenv('FEE_SCHEDULE_SYNC_INTERVAL', 60))  # seconds between checks for edits by other processes
+
+    # Multi-month analytics API
+    ANALYTICS_CACHE_TTL = int(getenv('ANALYTICS_CACHE_TTL', 300))  # seconds, 0 disables the cache
+    ANALYTICS_CACHE_ENTRIES = int(getenv('ANALYTICS_CACHE_ENTRIES', 256))
+    ANALYTICS_MAX_MONTHS = int(getenv('ANALYTICS_MAX_MONTHS', 60))
+    COLUMNAR_CLOCK_SKEW = int(getenv('COLUMNAR_CLOCK_SKEW', 60))  # seconds of updated_at drift tolerated between app servers
+
+    # Recording playback: '' streams from Python, 'nginx' uses X-Accel-Redirect,
+    # 'sendfile' uses X-Sendfile (Apache/lighttpd)
+    RECORDING_SENDFILE = getenv('RECORDING_SENDFILE', '')
+    RECORDING_ACCEL_PREFIX = getenv('RECORDING_ACCEL_PREFIX', '/protected-uploads/')
+    RECORDING_CACHE_MAX_AGE = int(getenv('RECORDING_CACHE_MAX_AGE', 3600))
+
+    # Derivatives produced after a lecture is marked: a poster frame, a preview
+    # strip and HLS renditions, stored next to the MP4
+    RECORDING_DERIVATIVES = {
+        'enabled': getenv('RECORDING_DERIVATIVES', 'false') == 'true',
+        'poster_offset': 30,  # seconds, capped at half the video
+        'poster_width': 640,
+        'preview_frames': 10,
+        'preview_width': 160,
+        'hls_segment_seconds': 6,
+        'hls_renditions': [
+            {'name': '360p', 'height': 360, 'video_bitrate': '500k', 'audio_bitrate': '64k'},
+            {'name': '540p', 'height': 540, 'video_bitrate': '1200k', 'audio_bitrate': '96k'},
+        ],
+    }
+
+    # Recording retention, applied by `flask apply-retention`. Deletion is
+    # permanent, so it stays off unless RECORDING_DELETE_AFTER_DAYS is set
+    RECORDING_RETENTION = {
+        'reencode_after_days': int(getenv('RECORDING_REENCODE_AFTER_DAYS', 180)),
+        'reencode_profile': getenv('RECORDING_REENCODE_PROFILE', 'retention'),
+        'delete_after_days': int(getenv('RECORDING_DELETE_AFTER_DAYS')) if getenv('RECORDING_DELETE_AFTER_DAYS') else None,
+    }
\ No newline at end of file
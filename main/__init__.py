@@ -4,7 +4,7 @@ from config import Config
 from main.logger import getLogger
 from main.extensions import db, migrate
 
-def create_app():
+def create_app(config=Config):
     app = Flask(__name__)
 
     @app.errorhandler(404)
@@ -12,12 +12,32 @@ def create_app():
         return render_template("404_page_not_found.html"), 404
     
     # Load configuration
-    app.config.from_object(Config)
+    app.config.from_object(config)
 
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
 
+    # Initialize background workers
+    from .transcode import transcode_queue
+    transcode_queue.init_app(app)
+    from .pdf import pdf_renderer
+    pdf_renderer.init_app(app)
+
+    # Keep derived tables in step with attendance
+    from . import snapshots
+    snapshots.init_app(app)
+    from . import rollups
+    rollups.init_app(app)
+    from .analytics import analytics_cache
+    analytics_cache.init_app(app)
+    from .columnar import attendance_columns
+    attendance_columns.init_app(app)
+    from .student_index import student_index
+    student_index.init_app(app)
+    from .fees import fee_schedules
+    fee_schedules.init_app(app)
+
     # Register Blueprints
     from .routes.index import index_bp
     from .routes.auth import auth_bp
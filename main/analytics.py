@@ -0,0 +1,434 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+from sqlalchemy import and_, case, event, func, or_, select, union_all
+
+from main.extensions import db
+from main.logger import event_logger
+from main.models import Attendance, Timetable, Teacher, TeacherMonthRollup, SalesMonthRollup, Sales
+
+# ── main/analytics.py ────────────────────────────────────────────────────────────
+
+
+COUNTERS = ('total_classes', 'proxy_classes', 'regular_classes', 'absent_classes', 'held_classes')
+
+
+def teacher_lectures(start: date = None, end: date = None):
+    """
+    Attendance rows in [start, end) attributed to each teacher they concern:
+    once for the assigned teacher and once more for a different proxy teacher.
+    Open bounds cover all history.
+    """
+    def in_period(query):
+        if start:
+            query = query.where(Attendance.date >= start)
+        if end:
+            query = query.where(Attendance.date < end)
+        return query
+
+    assigned = (
+        select(
+            Timetable.teacher_id.label('teacher_id'),
+            Timetable.teacher_id.label('assigned_id'),
+            Attendance.proxy_id,
+            func.coalesce(Attendance.is_proxy, False).label('is_proxy'),
+            func.coalesce(Attendance.is_present, False).label('is_present'),
+            Timetable.subject,
+            Timetable.grade,
+            Timetable.day_of_week
+        )
+        .join(Timetable, Timetable.id == Attendance.timetable_id)
+    )
+    proxied = (
+        select(
+            Attendance.proxy_id.label('teacher_id'),
+            Timetable.teacher_id.label('assigned_id'),
+            Attendance.proxy_id,
+            func.coalesce(Attendance.is_proxy, False).label('is_proxy'),
+            func.coalesce(Attendance.is_present, False).label('is_present'),
+            Timetable.subject,
+            Timetable.grade,
+            Timetable.day_of_week
+        )
+        .join(Timetable, Timetable.id == Attendance.timetable_id)
+        .where(
+            Attendance.proxy_id.isnot(None),
+            Attendance.proxy_id != Timetable.teacher_id
+        )
+    )
+    return union_all(in_period(assigned), in_period(proxied)).subquery('teacher_lectures')
+
+
+def _count_if(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+
+def lecture_counts(lectures) -> list:
+    """
+    Labelled aggregate columns for COUNTERS over a `teacher_lectures` subquery.
+    A lecture counts as held by a teacher when it is marked present and the
+    teacher either held it as proxy or is the assigned teacher and no proxy
+    was recorded.
+    """
+    c = lectures.c
+    is_proxy = c.is_proxy == True
+    held_as_proxy = and_(is_proxy, c.proxy_id == c.teacher_id)
+    held_as_assigned = and_(~is_proxy, c.assigned_id == c.teacher_id)
+    return [
+        func.count().label('total_classes'),
+        _count_if(held_as_proxy).label('proxy_classes'),
+        _count_if(held_as_assigned).label('regular_classes'),
+        _count_if(and_(c.assigned_id == c.teacher_id, is_proxy, or_(c.proxy_id.is_(None), c.proxy_id != c.teacher_id))).label('absent_classes'),
+        _count_if(and_(c.is_present == True, or_(held_as_proxy, held_as_assigned))).label('held_classes'),
+    ]
+
+
+def _empty_distributions():
+    return {}, {}, {i: 0 for i in range(7)}
+
+
+def teacher_entries(teachers: list[Teacher], totals: dict, distributions: dict) -> list[dict]:
+    """Shapes per-teacher counters and held-lecture distributions for the analytics page."""
+    analytics = []
+    for teacher in teachers:
+        counts = totals.get(teacher.id, {})
+        total_classes = int(counts.get('total_classes') or 0)
+        held_classes = int(counts.get('held_classes') or 0)
+        subjects, grades, days = distributions.get(teacher.id, _empty_distributions())
+        attendance_rate = (held_classes / total_classes * 100) if total_classes > 0 else 0
+        analytics.append({
+            'id': teacher.id,
+            'name': teacher.name,
+            'email': teacher.email,
+            'total_classes': total_classes,
+            'proxy_classes': int(counts.get('proxy_classes') or 0),
+            'regular_classes': int(counts.get('regular_classes') or 0),
+            'absent_classes': int(counts.get('absent_classes') or 0),
+            'monthly_earnings': teacher.pay_per_lecture * held_classes,
+            'attendance_rate': round(attendance_rate, 2),
+            'subject_distribution': subjects,
+            'grade_distribution': grades,
+            'day_distribution': days,
+            'pay_per_lecture': teacher.pay_per_lecture
+        })
+    return analytics
+
+
+def add_distribution(distributions: dict, teacher_id: int, subject: str, grade: str, day_of_week: int, lectures: int) -> None:
+    if not lectures:
+        return
+    subjects, grades, days = distributions.setdefault(teacher_id, _empty_distributions())
+    subjects[subject] = subjects.get(subject, 0) + lectures
+    grades[grade] = grades.get(grade, 0) + lectures
+    days[day_of_week] += lectures
+
+
+def teacher_month_analytics(start: date, end: date, teachers: list[Teacher]) -> list[dict]:
+    """
+    Computes the teacher analytics page metrics for every teacher in a fixed
+    number of grouped queries, whatever the number of teachers or lectures.
+
+    See `lecture_counts` for when a lecture counts as held.
+
+    Args:
+        start (date): First day of the period.
+        end (date): Day after the last day of the period.
+        teachers (list[Teacher]): Teachers to report on, in display order.
+
+    Returns:
+        list[dict]: One entry per teacher with counts, earnings, distributions
+        and attendance rate.
+    """
+    lectures = teacher_lectures(start, end)
+    c = lectures.c
+    held = and_(
+        c.is_present == True,
+        or_(and_(c.is_proxy == True, c.proxy_id == c.teacher_id), and_(c.is_proxy == False, c.assigned_id == c.teacher_id))
+    )
+
+    teacher_ids = [teacher.id for teacher in teachers]
+    totals = {
+        row.teacher_id: row._mapping
+        for row in db.session.execute(
+            select(c.teacher_id, *lecture_counts(lectures))
+            .where(c.teacher_id.in_(teacher_ids))
+            .group_by(c.teacher_id)
+        ).all()
+    }
+
+    # Held lectures per subject, grade and weekday; the three distributions are summed from this
+    distributions = {}
+    for row in db.session.execute(
+        select(c.teacher_id, c.subject, c.grade, c.day_of_week, func.count().label('lectures'))
+        .where(c.teacher_id.in_(teacher_ids), held)
+        .group_by(c.teacher_id, c.subject, c.grade, c.day_of_week)
+        .order_by(c.teacher_id, c.subject, c.grade, c.day_of_week)
+    ).all():
+        add_distribution(distributions, row.teacher_id, row.subject, row.grade, row.day_of_week, row.lectures)
+
+    return teacher_entries(teachers, totals, distributions)
+
+
+def teacher_rollup_analytics(start: date, end: date, teachers: list[Teacher]) -> list[dict]:
+    """
+    Same metrics as `teacher_month_analytics`, read from the pre-aggregated
+    TeacherMonthRollup rows instead of scanning attendance.
+
+    Args:
+        start (date): First day of the first month.
+        end (date): First day of the month after the period.
+        teachers (list[Teacher]): Teachers to report on, in display order.
+
+    Returns:
+        list[dict]: One entry per teacher, as for `teacher_month_analytics`.
+    """
+    teacher_ids = [teacher.id for teacher in teachers]
+    totals, distributions = {}, {}
+    for row in db.session.execute(
+        select(
+            TeacherMonthRollup.teacher_id,
+            TeacherMonthRollup.subject,
+            TeacherMonthRollup.grade,
+            TeacherMonthRollup.day_of_week,
+            *(func.sum(getattr(TeacherMonthRollup, name)).label(name) for name in COUNTERS)
+        )
+        .where(
+            TeacherMonthRollup.month >= start,
+            TeacherMonthRollup.month < end,
+            TeacherMonthRollup.teacher_id.in_(teacher_ids)
+        )
+        .group_by(TeacherMonthRollup.teacher_id, TeacherMonthRollup.subject, TeacherMonthRollup.grade, TeacherMonthRollup.day_of_week)
+        .order_by(TeacherMonthRollup.teacher_id, TeacherMonthRollup.subject, TeacherMonthRollup.grade, TeacherMonthRollup.day_of_week)
+    ).all():
+        counts = totals.setdefault(row.teacher_id, dict.fromkeys(COUNTERS, 0))
+        for name in COUNTERS:
+            counts[name] += int(getattr(row, name) or 0)
+        add_distribution(distributions, row.teacher_id, row.subject, row.grade, row.day_of_week, int(row.held_classes or 0))
+
+    return teacher_entries(teachers, totals, distributions)
+
+
+def sales_rollup_totals(start: date, end: date, sales_ids: list[int]) -> dict[int, dict]:
+    """
+    Invoice count and amount collected per sales person over whole months,
+    read from SalesMonthRollup.
+
+    Args:
+        start (date): First day of the first month.
+        end (date): First day of the month after the period.
+        sales_ids (list[int]): Sales people to include.
+
+    Returns:
+        dict[int, dict]: `invoices` and `total_amount` per sales id; missing ids had none.
+    """
+    return {
+        row.sales_id: {'invoices': int(row.invoices or 0), 'total_amount': row.total_amount or 0.0}
+        for row in db.session.execute(
+            select(
+                SalesMonthRollup.sales_id,
+                func.sum(SalesMonthRollup.invoices).label('invoices'),
+                func.sum(SalesMonthRollup.total_amount).label('total_amount')
+            )
+            .where(SalesMonthRollup.month >= start, SalesMonthRollup.month < end, SalesMonthRollup.sales_id.in_(sales_ids))
+            .group_by(SalesMonthRollup.sales_id)
+        ).all()
+    }
+
+
+def _month_keys(start: date, end: date) -> list[date]:
+    months = []
+    month = start.replace(day=1)
+    while month < end:
+        months.append(month)
+        month = date(month.year + 1, 1, 1) if month.month == 12 else date(month.year, month.month + 1, 1)
+    return months
+
+
+def _rate(part: int, whole: int) -> float:
+    return round(part / whole * 100, 2) if whole else 0
+
+
+def teacher_series(start: date, end: date, teacher_ids: list[int] = None) -> dict:
+    """
+    Monthly teacher metrics over [start, end) from one grouped query on the
+    rollups. Months without lectures are zero-filled so every series has the
+    same length.
+
+    Args:
+        start (date): First day of the first month.
+        end (date): First day of the month after the period.
+        teacher_ids (list[int], optional): Only these teachers. Defaults to all active teachers.
+
+    Returns:
+        dict: `months` as YYYY-MM labels and one `series` list per teacher.
+    """
+    months = _month_keys(start, end)
+    teachers = Teacher.query.filter(Teacher.id.in_(teacher_ids)) if teacher_ids else Teacher.query.filter_by(is_active=True)
+    teachers = teachers.order_by(Teacher.name).all()
+
+    counts = {}
+    for row in db.session.execute(
+        select(
+            TeacherMonthRollup.teacher_id,
+            TeacherMonthRollup.month,
+            *(func.sum(getattr(TeacherMonthRollup, name)).label(name) for name in COUNTERS)
+        )
+        .where(
+            TeacherMonthRollup.month >= start,
+            TeacherMonthRollup.month < end,
+            TeacherMonthRollup.teacher_id.in_([teacher.id for teacher in teachers])
+        )
+        .group_by(TeacherMonthRollup.teacher_id, TeacherMonthRollup.month)
+    ).all():
+        counts[(row.teacher_id, row.month)] = {name: int(getattr(row, name) or 0) for name in COUNTERS}
+
+    empty = dict.fromkeys(COUNTERS, 0)
+    result = []
+    for teacher in teachers:
+        series = []
+        for month in months:
+            point = counts.get((teacher.id, month), empty)
+            series.append(dict(
+                point,
+                month=f'{month:%Y-%m}',
+                earnings=teacher.pay_per_lecture * point['held_classes'],
+                attendance_rate=_rate(point['held_classes'], point['total_classes'])
+            ))
+        result.append({
+            'id': teacher.id,
+            'name': teacher.name,
+            'email': teacher.email,
+            'pay_per_lecture': teacher.pay_per_lecture,
+            'series': series
+        })
+    return {'months': [f'{month:%Y-%m}' for month in months], 'teachers': result}
+
+
+def sales_series(start: date, end: date, sales_ids: list[int] = None) -> dict:
+    """
+    Monthly invoice counts, amounts collected and commission per sales person
+    over [start, end), from one grouped query on the rollups.
+
+    Args:
+        start (date): First day of the first month.
+        end (date): First day of the month after the period.
+        sales_ids (list[int], optional): Only these sales people. Defaults to all active ones.
+
+    Returns:
+        dict: `months` as YYYY-MM labels and one `series` list per sales person.
+    """
+    months = _month_keys(start, end)
+    sales_people = Sales.query.filter(Sales.id.in_(sales_ids)) if sales_ids else Sales.query.filter_by(is_active=True)
+    sales_people = sales_people.order_by(Sales.name).all()
+
+    totals = {
+        (row.sales_id, row.month): row
+        for row in db.session.execute(
+            select(SalesMonthRollup.sales_id, SalesMonthRollup.month, SalesMonthRollup.invoices, SalesMonthRollup.total_amount)
+            .where(
+                SalesMonthRollup.month >= start,
+                SalesMonthRollup.month < end,
+                SalesMonthRollup.sales_id.in_([person.id for person in sales_people])
+            )
+        ).all()
+    }
+
+    result = []
+    for person in sales_people:
+        series = []
+        for month in months:
+            row = totals.get((person.id, month))
+            amount = row.total_amount if row else 0.0
+            series.append({
+                'month': f'{month:%Y-%m}',
+                'invoices': row.invoices if row else 0,
+                'total_amount': amount,
+                'commission': amount * 0.10  # 10% commission, as on the analytics page
+            })
+        result.append({'id': person.id, 'name': person.name, 'email': person.email, 'series': series})
+    return {'months': [f'{month:%Y-%m}' for month in months], 'sales': result}
+
+
+class AnalyticsCache:
+    """
+    In-process TTL cache for analytics API results, keyed on (kind, range,
+    filters). Entries are dropped early when a committed transaction changes
+    the rollups of a month inside their range; main.rollups records those
+    months in `session.info['analytics_months']`. Each process keeps its own
+    cache, so changes made by other processes show up within the TTL.
+    """
+
+    def __init__(self):
+        self.ttl = 0
+        self.max_entries = 0
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires, start, end, value)
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.ttl = app.config.get('ANALYTICS_CACHE_TTL', 300)
+        self.max_entries = app.config.get('ANALYTICS_CACHE_ENTRIES', 256)
+        if not event.contains(db.session, 'after_commit', self._invalidate_committed):
+            event.listen(db.session, 'after_commit', self._invalidate_committed)
+            event.listen(db.session, 'after_rollback', self._discard_months)
+
+    def get_or_compute(self, key: tuple, start: date, end: date, compute):
+        """Returns the cached result for `key`, or computes and stores it."""
+        if self.ttl <= 0:
+            return compute()
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[3]
+            self.misses += 1
+            generation = self._generation
+
+        value = compute()
+        with self._lock:
+            # Skip storing if an invalidation ran while computing, the result may predate it
+            if self._generation == generation:
+                self._entries[key] = (now + self.ttl, start, end, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, months=None) -> int:
+        """Drops entries whose range covers any of `months`, or every entry when none are given."""
+        with self._lock:
+            self._generation += 1
+            if months is None:
+                stale = list(self._entries)
+            else:
+                stale = [
+                    key for key, (_, start, end, _) in self._entries.items()
+                    if any(start <= month < end for month in months)
+                ]
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            event_logger.info(f"Invalidated {len(stale)} analytics cache entries")
+        return len(stale)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'ttl': self.ttl}
+
+    def _invalidate_committed(self, session):
+        months = session.info.pop('analytics_months', None)
+        if months:
+            self.invalidate(months)
+
+    def _discard_months(self, session):
+        session.info.pop('analytics_months', None)
+
+
+analytics_cache = AnalyticsCache()
@@ -0,0 +1,240 @@
+import time as _time
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.orm import contains_eager, joinedload
+
+from main.extensions import db
+from main.logger import event_logger, error_logger
+from main.models import Timetable, Attendance, Teacher
+from main.rollups import add_materialized_lectures
+
+# ── main/attendance.py ───────────────────────────────────────────────────────────
+
+# Dates already materialized by this process, mapped to the time they were done.
+_materialized: dict[date, float] = {}
+
+
+def util_date_window(days: int, end: date = None) -> list[date]:
+    """
+    Returns the list of dates ending at `end` (inclusive) going back `days` days.
+
+    Args:
+        days (int): Number of days in the window.
+        end (date, optional): Last day of the window. Defaults to today.
+
+    Returns:
+        list[date]: Dates in descending order, newest first.
+    """
+    end = end or datetime.now().date()
+    return [end - timedelta(days=i) for i in range(days)]
+
+
+def _insert_ignore_duplicates(rows: list[dict]) -> None:
+    """
+    Inserts attendance rows in a single statement, skipping rows that already
+    exist for the same (timetable_id, date).
+    """
+    table = Attendance.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table)
+        # No-op update keeps the existing row untouched on a duplicate key
+        stmt = stmt.on_duplicate_key_update(timetable_id=stmt.inserted.timetable_id)
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        stmt = pg_insert(table).on_conflict_do_nothing(index_elements=['timetable_id', 'date'])
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        stmt = sqlite_insert(table).on_conflict_do_nothing(index_elements=['timetable_id', 'date'])
+    else:
+        # Generic fallback: filter out existing pairs with one read query
+        dates = {row['date'] for row in rows}
+        existing = set(
+            db.session.query(Attendance.timetable_id, Attendance.date)
+            .filter(Attendance.date.in_(dates))
+            .all()
+        )
+        rows = [row for row in rows if (row['timetable_id'], row['date']) not in existing]
+        if not rows:
+            return
+        stmt = insert(table)
+
+    db.session.execute(stmt, rows)
+
+
+def materialize_attendance(dates: list[date]) -> int:
+    """
+    Expands timetable templates into attendance rows for the given dates.
+
+    All missing (timetable_id, date) rows are created with one read of the
+    timetable and one bulk insert, and existing rows are left untouched, so
+    the call is safe to repeat. The bulk insert bypasses the session flush
+    events, so the analytics rollups are adjusted here for the new rows.
+
+    Args:
+        dates (list[date]): Dates to materialize.
+
+    Returns:
+        int: Number of attendance rows created.
+    """
+    if not dates:
+        return 0
+
+    weekdays = {d.weekday() for d in dates}
+    try:
+        # Locking the templates serializes concurrent runs over the same
+        # weekdays, so the rows found missing below are the rows this run inserts
+        templates = (
+            db.session.query(Timetable.id, Timetable.teacher_id, Timetable.subject, Timetable.grade, Timetable.day_of_week)
+            .filter(Timetable.day_of_week.in_(weekdays))
+            .with_for_update()
+            .all()
+        )
+        existing = set(
+            db.session.query(Attendance.timetable_id, Attendance.date)
+            .filter(Attendance.date.in_(dates))
+            .with_for_update(read=True)
+            .all()
+        )
+
+        by_day = {}
+        for template in templates:
+            by_day.setdefault(template.day_of_week, []).append(template)
+        missing = [
+            (template, d)
+            for d in dates
+            for template in by_day.get(d.weekday(), [])
+            if (template.id, d) not in existing
+        ]
+        if not missing:
+            db.session.commit()
+            return 0
+
+        now = datetime.utcnow()
+        _insert_ignore_duplicates([
+            {
+                'timetable_id': template.id,
+                'date': d,
+                'is_present': False,
+                'is_proxy': False,
+                'created_at': now,
+                'updated_at': now,
+            }
+            for template, d in missing
+        ])
+        add_materialized_lectures(db.session, missing)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        error_logger.error(f"Attendance materialization failed: {e}", exc_info=True)
+        raise
+
+    event_logger.info(f"Materialized attendance for {len(dates)} dates ({len(missing)} new rows)")
+    return len(missing)
+
+
+def ensure_attendance(dates: list[date]) -> None:
+    """
+    Lazily materializes attendance for dates this process has not covered
+    within `ATTENDANCE_MATERIALIZE_TTL` seconds. Used by views so that most
+    page loads skip the insert entirely.
+    """
+    ttl = current_app.config.get('ATTENDANCE_MATERIALIZE_TTL', 300)
+    now = _time.monotonic()
+    stale = [d for d in dates if now - _materialized.get(d, float('-inf')) > ttl]
+    if not stale:
+        return
+
+    materialize_attendance(stale)
+    for d in stale:
+        _materialized[d] = now
+
+
+def mark_present(attendance: Attendance, teacher: Teacher) -> bool:
+    """
+    Marks a lecture as held by `teacher`, recording a proxy when the teacher
+    is not the one assigned in the timetable. Does not commit.
+
+    Args:
+        attendance (Attendance): The lecture being marked.
+        teacher (Teacher): The teacher who held the lecture.
+
+    Returns:
+        bool: True if the lecture was marked as a proxy.
+    """
+    is_proxy = (attendance.timetable.teacher_id != teacher.id)
+    attendance.is_present = True
+    if is_proxy:
+        attendance.is_proxy = True
+        attendance.proxy_id = teacher.id
+        # Mark original teacher as absent
+        original_attendance = Attendance.query.filter_by(
+            timetable_id=attendance.timetable_id,
+            date=attendance.date,
+            proxy_id=None
+        ).first()
+        if original_attendance:
+            original_attendance.is_present = False
+            db.session.add(original_attendance)
+    return is_proxy
+
+
+def invalidate_materialized() -> None:
+    """Forgets which dates were materialized, e.g. after the timetable changes."""
+    _materialized.clear()
+
+
+def pending_lectures(dates: list[date], teacher_id: int = None, grade: str = None,
+                     limit: int = None, offset: int = 0) -> list[dict]:
+    """
+    Returns the unmarked lectures for the given dates, ordered by date and
+    start time. The timetable, assigned teacher and proxy teacher are loaded
+    in the same query, so the number of queries does not grow with the
+    number of lectures.
+
+    Args:
+        dates (list[date]): Dates to look at.
+        teacher_id (int, optional): Only lectures assigned to this teacher.
+        grade (str, optional): Only lectures for this grade.
+        limit (int, optional): Maximum number of lectures to return.
+        offset (int, optional): Number of lectures to skip.
+
+    Returns:
+        list[dict]: One entry per lecture with its timetable details.
+    """
+    query = (
+        Attendance.query
+        .join(Attendance.timetable)
+        .options(
+            contains_eager(Attendance.timetable).joinedload(Timetable.assigned_teacher),
+            joinedload(Attendance.proxy_teacher)
+        )
+        .filter(Attendance.date.in_(dates), Attendance.is_present == False)
+    )
+    if teacher_id:
+        query = query.filter(Timetable.teacher_id == teacher_id)
+    if grade:
+        query = query.filter(Timetable.grade == grade)
+
+    query = query.order_by(Attendance.date, Timetable.start_time, Attendance.id).offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+
+    return [
+        {
+            'id': attendance.id,
+            'subject': attendance.timetable.subject,
+            'grade': attendance.timetable.grade,
+            'start_time': attendance.timetable.start_time,
+            'teacher_name': attendance.timetable.assigned_teacher.name,
+            'date': attendance.date,
+            'is_present': attendance.is_present,
+            'is_proxy': attendance.is_proxy,
+            'proxy_name': attendance.proxy_teacher.name if attendance.proxy_teacher else None
+        }
+        for attendance in query.all()
+    ]
@@ -0,0 +1,274 @@
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+
+from main.analytics import COUNTERS, add_distribution, teacher_entries
+from main.extensions import db
+from main.logger import event_logger
+from main.models import Attendance, Timetable, Teacher
+
+# ── main/columnar.py ─────────────────────────────────────────────────────────────
+
+# Attendance joined with the timetable, held as one NumPy array per column
+# and sorted by date. Strings are dictionary-encoded and a missing proxy is
+# stored as -1, so a row takes 23 bytes. The arrays stay in memory between
+# requests; a refresh only re-reads the dates whose rows changed since, and
+# builds new arrays that replace the old ones in a single assignment, so
+# readers never see a half-loaded set.
+
+COLUMNS = {
+    'date': np.int32,  # date.toordinal()
+    'assigned_id': np.int32,
+    'proxy_id': np.int32,
+    'subject': np.int32,
+    'grade': np.int32,
+    'day_of_week': np.int8,
+    'is_present': np.bool_,
+    'is_proxy': np.bool_,
+}
+NO_PROXY = -1
+
+
+class AttendanceColumns:
+    """
+    Columnar copy of attendance for reporting over long date ranges.
+
+    `refresh()` detects changes through the indexed `updated_at` column, so
+    writes from other processes and Core bulk inserts are picked up too:
+    rows from the earliest changed date onwards are dropped and re-read.
+    Deleted rows are caught by comparing row counts, and any timetable edit
+    triggers a full reload since it changes the encoded subject or grade.
+    """
+
+    def __init__(self, clock_skew: int = 60, chunk_size: int = 50000):
+        self.clock_skew = timedelta(seconds=clock_skew)
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._columns = self._empty()
+        self._stamp = None  # newest attendance updated_at seen by the last load
+        self._timetable_stamp = None
+        self.loaded = False
+
+    @staticmethod
+    def _empty() -> dict:
+        return {
+            'arrays': {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()},
+            'subjects': [],
+            'grades': [],
+        }
+
+    @property
+    def arrays(self) -> dict:
+        return self._columns['arrays']
+
+    @property
+    def subjects(self) -> list[str]:
+        return self._columns['subjects']
+
+    @property
+    def grades(self) -> list[str]:
+        return self._columns['grades']
+
+    def init_app(self, app):
+        self.clock_skew = timedelta(seconds=app.config.get('COLUMNAR_CLOCK_SKEW', 60))
+
+    def __len__(self) -> int:
+        return len(self.arrays['date'])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays.values())
+
+    @staticmethod
+    def _encode(kind: str, labels: list[str], codes: dict, values) -> np.ndarray:
+        out = np.empty(len(values), dtype=COLUMNS[kind])
+        for i, value in enumerate(values):
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(labels)
+                labels.append(value)
+            out[i] = code
+        return out
+
+    def _load(self, session, base: dict, since: date = None) -> tuple[dict, int]:
+        """
+        Reads every row dated `since` or later, in date order, into new columns
+        that start with `base`. Neither `base` nor the current columns change.
+        """
+        query = (
+            select(
+                Attendance.date,
+                Timetable.teacher_id,
+                func.coalesce(Attendance.proxy_id, NO_PROXY),
+                Timetable.subject,
+                Timetable.grade,
+                Timetable.day_of_week,
+                func.coalesce(Attendance.is_present, False),
+                func.coalesce(Attendance.is_proxy, False)
+            )
+            .join(Timetable, Timetable.id == Attendance.timetable_id)
+            .order_by(Attendance.date, Attendance.id)
+            .execution_options(yield_per=self.chunk_size)
+        )
+        if since is not None:
+            query = query.where(Attendance.date >= since)
+
+        subjects, grades = list(base['subjects']), list(base['grades'])
+        subject_codes = {label: code for code, label in enumerate(subjects)}
+        grade_codes = {label: code for code, label in enumerate(grades)}
+        parts = {name: [base['arrays'][name]] for name in COLUMNS}
+        loaded = 0
+        for chunk in session.execute(query).partitions():
+            days, assigned, proxies, chunk_subjects, chunk_grades, weekdays, present, proxied = zip(*chunk)
+            parts['date'].append(np.fromiter((day.toordinal() for day in days), dtype=np.int32, count=len(days)))
+            parts['assigned_id'].append(np.array(assigned, dtype=np.int32))
+            parts['proxy_id'].append(np.array(proxies, dtype=np.int32))
+            parts['subject'].append(self._encode('subject', subjects, subject_codes, chunk_subjects))
+            parts['grade'].append(self._encode('grade', grades, grade_codes, chunk_grades))
+            parts['day_of_week'].append(np.array(weekdays, dtype=np.int8))
+            parts['is_present'].append(np.array(present, dtype=np.bool_))
+            parts['is_proxy'].append(np.array(proxied, dtype=np.bool_))
+            loaded += len(chunk)
+        arrays = {name: np.concatenate(chunks) for name, chunks in parts.items()}
+        return {'arrays': arrays, 'subjects': subjects, 'grades': grades}, loaded
+
+    def _truncated(self, since: date) -> dict:
+        """The current columns without the rows dated `since` or later."""
+        cut = int(np.searchsorted(self.arrays['date'], since.toordinal(), side='left'))
+        return {**self._columns, 'arrays': {name: array[:cut] for name, array in self.arrays.items()}}
+
+    def refresh(self, session=None) -> dict:
+        """
+        Brings the arrays up to date with the database.
+
+        Args:
+            session (Session, optional): Session to read with. Defaults to `db.session`.
+
+        Returns:
+            dict: What was done: `mode` (full, incremental or none) and rows read.
+        """
+        session = session or db.session
+        with self._lock:
+            # Stamps are read first so writes made during the load are seen next time
+            stamp = session.execute(select(func.max(Attendance.updated_at))).scalar()
+            timetable_stamp = session.execute(select(func.max(Timetable.updated_at))).scalar()
+
+            since, mode = None, 'full'
+            if self.loaded and timetable_stamp == self._timetable_stamp:
+                since = session.execute(
+                    select(func.min(Attendance.date))
+                    .where(Attendance.updated_at > self._stamp - self.clock_skew)
+                ).scalar() if self._stamp is not None else None
+                mode = 'incremental' if since is not None else 'none'
+
+                # Deletions leave no updated_at trace, so compare the untouched rows' count
+                kept = len(self) if since is None else int(
+                    np.searchsorted(self.arrays['date'], since.toordinal(), side='left')
+                )
+                stored = session.execute(
+                    select(func.count(Attendance.id)).where(Attendance.date < since) if since is not None
+                    else select(func.count(Attendance.id))
+                ).scalar()
+                if stored != kept:
+                    since, mode = None, 'full'
+
+            rows = 0
+            if mode == 'full':
+                columns, rows = self._load(session, self._empty())
+            elif mode == 'incremental':
+                columns, rows = self._load(session, self._truncated(since), since)
+            if mode != 'none':
+                # One assignment, so readers keep whichever complete set they already took
+                self._columns = columns
+
+            self._stamp, self._timetable_stamp, self.loaded = stamp, timetable_stamp, True
+        if mode == 'full':
+            event_logger.info(f"Loaded {rows} attendance rows into columnar arrays ({self.nbytes / 1024 ** 2:.1f} MB)")
+        return {'mode': mode, 'rows': rows}
+
+    def teacher_analytics(self, start: date, end: date, teachers: list[Teacher], session=None) -> list[dict]:
+        """
+        Same metrics as `analytics.teacher_month_analytics` for any date range,
+        computed with vectorized group-bys over the cached arrays.
+
+        Args:
+            start (date): First day of the period.
+            end (date): Day after the last day of the period.
+            teachers (list[Teacher]): Teachers to report on, in display order.
+            session (Session, optional): Session used to refresh the arrays.
+
+        Returns:
+            list[dict]: One entry per teacher, as for `teacher_month_analytics`.
+        """
+        self.refresh(session)
+        columns = self._columns
+        arrays, subjects, grades = columns['arrays'], columns['subjects'], columns['grades']
+        dates = arrays['date']
+        lo = int(np.searchsorted(dates, start.toordinal(), side='left'))
+        hi = int(np.searchsorted(dates, end.toordinal(), side='left'))
+        window = {name: array[lo:hi] for name, array in arrays.items()}
+
+        # Each lecture counts once for the assigned teacher and once more for a different proxy teacher
+        assigned, proxy = window['assigned_id'], window['proxy_id']
+        other_proxy = (proxy != NO_PROXY) & (proxy != assigned)
+        teacher = np.concatenate([assigned, proxy[other_proxy]])
+        lecture = {
+            name: np.concatenate([array, array[other_proxy]])
+            for name, array in window.items() if name != 'date'
+        }
+        is_proxy = lecture['is_proxy']
+        is_assigned = lecture['assigned_id'] == teacher
+        proxy_is_teacher = lecture['proxy_id'] == teacher
+        held_as_proxy = is_proxy & proxy_is_teacher
+        held_as_assigned = ~is_proxy & is_assigned
+        flags = {
+            'total_classes': np.ones(len(teacher), dtype=np.bool_),
+            'proxy_classes': held_as_proxy,
+            'regular_classes': held_as_assigned,
+            'absent_classes': is_assigned & is_proxy & ~proxy_is_teacher,
+            'held_classes': lecture['is_present'] & (held_as_proxy | held_as_assigned),
+        }
+
+        # Group-bys are bincounts over dense integer codes, which avoids sorting
+        ids = np.array([t.id for t in teachers], dtype=np.int64)
+        positions = np.full(int(max(ids.max(initial=0), teacher.max(initial=0))) + 1, -1, dtype=np.int64)
+        positions[ids] = np.arange(len(ids))
+        position = positions[teacher]
+        selected = position >= 0
+        position = position[selected]
+        counts = {
+            name: np.bincount(position, weights=flags[name][selected], minlength=len(ids))
+            for name in COUNTERS
+        }
+        totals = {
+            int(teacher_id): {name: int(counts[name][i]) for name in COUNTERS}
+            for i, teacher_id in enumerate(ids)
+        }
+
+        # Held lectures per teacher, subject, grade and weekday
+        held = flags['held_classes'][selected]
+        shape = (len(ids), max(len(subjects), 1), max(len(grades), 1), 7)
+        groups = np.ravel_multi_index(
+            (
+                position[held],
+                lecture['subject'][selected][held],
+                lecture['grade'][selected][held],
+                lecture['day_of_week'][selected][held],
+            ),
+            shape
+        )
+        lectures = np.bincount(groups, minlength=int(np.prod(shape)))
+        keys = [
+            (int(ids[i]), subjects[subject], grades[grade], int(day_of_week))
+            for i, subject, grade, day_of_week in zip(*np.unravel_index(np.flatnonzero(lectures), shape))
+        ]
+        distributions = {}
+        for key, count in sorted(zip(keys, lectures[lectures > 0].tolist())):
+            add_distribution(distributions, *key, count)
+
+        return teacher_entries(teachers, totals, distributions)
+
+
+attendance_columns = AttendanceColumns()
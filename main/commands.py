@@ -1,8 +1,21 @@
+import os
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from flask import current_app
 from flask.cli import with_appcontext
 import click
 from main.models import Admin, Teacher
 from main.extensions import db
-from main.utils import generate_password_hash
+from main.utils import generate_password_hash, util_month_range
+from main.attendance import materialize_attendance
+from main.transcode import transcode_queue, build_transcode_cmd
+from main.retention import compact_recordings, apply_retention
+from main.payroll import run_payroll
+from main.invoices import render_receipts
+from main.snapshots import reconcile_snapshots
+from main.rollups import backfill_rollups
+from main.columnar import AttendanceColumns
 
 @click.command('rehash-passwords')
 @with_appcontext
@@ -28,6 +41,424 @@ def rehash_passwords():
     click.echo('All passwords have been rehashed. Default passwords set: admin123 for admins, teacher123 for teachers')
     click.echo('Please ask users to change their passwords on next login.')
 
+@click.command('materialize-attendance')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='First date (YYYY-MM-DD). Defaults to today.')
+@click.option('--days', type=int, default=7, show_default=True, help='Number of days to materialize from the start date.')
+@with_appcontext
+def materialize_attendance_command(start, days):
+    """Create missing attendance rows from the timetable for a date window."""
+    start_date = start.date() if start else date.today()
+    dates = [start_date + timedelta(days=i) for i in range(days)]
+    click.echo(f'Materializing attendance from {dates[0]} to {dates[-1]}...')
+    count = materialize_attendance(dates)
+    click.echo(f'Done. Created {count} attendance rows; existing rows were left unchanged.')
+
+@click.command('bench-transcode')
+@click.option('--duration', type=int, default=30, show_default=True, help='Length of the synthetic clip in seconds.')
+@click.option('--size', default='1920x1080', show_default=True, help='Resolution of the synthetic clip.')
+@click.option('--profile', 'profiles', multiple=True, help='Profile to benchmark. Repeatable, defaults to all.')
+@with_appcontext
+def bench_transcode(duration, size, profiles):
+    """Transcode a synthetic clip under each profile and report throughput."""
+    available = current_app.config.get('TRANSCODE_PROFILES', {})
+    profiles = profiles or list(available)
+    unknown = [name for name in profiles if name not in available]
+    if unknown:
+        raise click.BadParameter(f"Unknown profile(s): {', '.join(unknown)}", param_hint='--profile')
+
+    threads = current_app.config.get('TRANSCODE_THREADS', 0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = os.path.join(tmp_dir, 'source.mp4')
+        click.echo(f'Generating {duration}s {size} test clip...')
+        transcode_queue.run_ffmpeg([
+            'ffmpeg', '-y',
+            '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30',
+            '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+            '-t', str(duration), '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', source
+        ])
+        click.echo(f'Source: {os.path.getsize(source) / 1024 ** 2:.1f} MB, threads per job: {threads or "auto"}')
+        click.echo(f"{'profile':<12}{'seconds':>10}{'x realtime':>12}{'size MB':>10}")
+
+        for name in profiles:
+            output = os.path.join(tmp_dir, f'{name}.mp4')
+            started = time.monotonic()
+            transcode_queue.run_ffmpeg(build_transcode_cmd(source, output, available[name], threads))
+            elapsed = time.monotonic() - started
+            size_mb = os.path.getsize(output) / 1024 ** 2
+            click.echo(f'{name:<12}{elapsed:>10.1f}{duration / elapsed:>12.2f}{size_mb:>10.1f}')
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+@click.command('compact-recordings')
+@click.option('--batch', type=int, default=200, show_default=True, help='Maximum number of files to move per step.')
+@click.option('--steps', type=int, default=1, show_default=True, help='Number of batches to run.')
+@click.option('--dry-run', is_flag=True, help='Report what would change without moving files.')
+@with_appcontext
+def compact_recordings_command(batch, steps, dry_run):
+    """Move recordings from older folder layouts into the sharded store."""
+    totals = {'moved': 0, 'imported': 0, 'skipped': 0}
+    for step in range(steps):
+        report = compact_recordings(batch=batch, dry_run=dry_run)
+        for key in totals:
+            totals[key] += report[key]
+        click.echo(f"Step {step + 1}: moved {report['moved']}, imported {report['imported']}, skipped {report['skipped']}")
+        if dry_run or report['moved'] + report['imported'] == 0:
+            break
+    click.echo(f"Done. Moved {totals['moved']}, imported {totals['imported']}, skipped {totals['skipped']}.")
+
+@click.command('apply-retention')
+@click.option('--batch', type=int, default=50, show_default=True, help='Maximum number of files to re-encode or delete per step.')
+@click.option('--steps', type=int, default=1, show_default=True, help='Number of batches to run.')
+@click.option('--dry-run', is_flag=True, help='Report what would change without touching files.')
+@with_appcontext
+def apply_retention_command(batch, steps, dry_run):
+    """Re-encode or delete old recordings according to RECORDING_RETENTION."""
+    reclaimed = 0
+    for step in range(steps):
+        report = apply_retention(batch=batch, dry_run=dry_run)
+        reclaimed += report['bytes_reclaimed']
+        click.echo(
+            f"Step {step + 1}: re-encoded {report['reencoded']}, deleted {report['deleted']}, "
+            f"failed {report['failed']}, reclaimed {_format_bytes(report['bytes_reclaimed'])}"
+        )
+        if dry_run or report['reencoded'] + report['deleted'] == 0:
+            break
+    click.echo(f"Done. {'Would reclaim' if dry_run else 'Reclaimed'} {_format_bytes(reclaimed)}.")
+
+@click.command('run-payroll')
+@click.option('--month', type=click.DateTime(formats=['%Y-%m']), default=None, help='Month to invoice (YYYY-MM). Defaults to last month.')
+@with_appcontext
+def run_payroll_command(month):
+    """Compute, store and render every teacher's invoice for a month into one zip."""
+    if month is None:
+        last_month = date.today().replace(day=1) - timedelta(days=1)
+        year, month_number = last_month.year, last_month.month
+    else:
+        year, month_number = month.year, month.month
+
+    click.echo(f'Running payroll for {year}-{month_number:02d}...')
+
+    def progress(done, total, teacher_id):
+        click.echo(f'  [{done}/{total}] teacher {teacher_id}')
+
+    result = run_payroll(year, month_number, progress)
+    if 'archive' not in result:
+        raise click.ClickException(result.get('error', 'Payroll failed'))
+    if result['failed']:
+        click.echo(f"Could not render invoices for teachers: {', '.join(map(str, result['failed']))}", err=True)
+    click.echo(
+        f"Done. {result['teachers']} teachers, {result['total_lectures']} lectures, "
+        f"total {result['total_amount']:.2f}. Archive: {result['archive']}"
+    )
+
+@click.command('render-receipts')
+@click.option('--month', type=click.DateTime(formats=['%Y-%m']), required=True, help='Month of the invoices (YYYY-MM).')
+@click.option('--sales-id', type=int, default=None, help='Only invoices created by this sales person.')
+@with_appcontext
+def render_receipts_command(month, sales_id):
+    """Render every student receipt of a month into the PDF cache."""
+    if not current_app.config.get('PDF_CACHE_DIR'):
+        raise click.ClickException('PDF_CACHE_DIR is not set, so rendered receipts would not be kept.')
+    start, end = util_month_range(month.year, month.month)
+
+    def progress(done, total, invoice_id):
+        if done % 100 == 0 or done == total:
+            click.echo(f'  [{done}/{total}] invoice {invoice_id}')
+
+    result = render_receipts(start, end, sales_id, progress)
+    if result['failed']:
+        click.echo(f"Could not render receipts for invoices: {', '.join(map(str, result['failed']))}", err=True)
+    click.echo(f"Done. Rendered {result['rendered']} receipt(s).")
+
+@click.command('reconcile-teacher-invoices')
+@click.option('--month', type=click.DateTime(formats=['%Y-%m']), default=None, help='Only this month (YYYY-MM). Defaults to all history.')
+@click.option('--dry-run', is_flag=True, help='Report drift without fixing it.')
+@with_appcontext
+def reconcile_teacher_invoices_command(month, dry_run):
+    """Rebuild the monthly TeacherInvoice snapshots from attendance and report drift."""
+    start, end = util_month_range(month.year, month.month) if month else (None, None)
+    drift = reconcile_snapshots(start, end, dry_run=dry_run)
+    for row in drift:
+        click.echo(
+            f"  teacher {row['teacher_id']} {row['month'][:7]}: "
+            f"stored {row['stored_lectures']} lectures / {row['stored_amount']}, "
+            f"expected {row['expected_lectures']} / {row['expected_amount']}"
+        )
+    click.echo(f"Done. {len(drift)} snapshot(s) {'drifted' if dry_run else 'corrected'}.")
+
+@click.command('backfill-rollups')
+@click.option('--month', type=click.DateTime(formats=['%Y-%m']), default=None, help='Only this month (YYYY-MM). Defaults to all history.')
+@with_appcontext
+def backfill_rollups_command(month):
+    """Rebuild the monthly analytics rollups from attendance and student invoices."""
+    start, end = util_month_range(month.year, month.month) if month else (None, None)
+
+    def progress(month_start, teacher_rows, sales_rows):
+        click.echo(f'  {month_start:%Y-%m}: {teacher_rows} teacher rows, {sales_rows} sales rows')
+
+    report = backfill_rollups(start, end, progress)
+    click.echo(f"Done. Rebuilt {report['months']} month(s): {report['teacher_rows']} teacher rows, {report['sales_rows']} sales rows.")
+
+def _orm_teacher_analytics(session, start, end, teachers):
+    """Teacher analytics computed from ORM objects, one query per teacher (the pre-aggregation code path)."""
+    from sqlalchemy import or_
+    from main.models import Attendance, Timetable
+
+    analytics = []
+    for teacher in teachers:
+        records = (
+            session.query(Attendance).join(Timetable)
+            .filter(or_(Timetable.teacher_id == teacher.id, Attendance.proxy_id == teacher.id), Attendance.date >= start, Attendance.date < end)
+            .all()
+        )
+        held = [
+            r for r in records
+            if r.is_present and ((r.is_proxy and r.proxy_id == teacher.id) or (not r.is_proxy and r.timetable.teacher_id == teacher.id))
+        ]
+        subjects, grades, days = {}, {}, {i: 0 for i in range(7)}
+        for r in held:
+            subjects[r.timetable.subject] = subjects.get(r.timetable.subject, 0) + 1
+            grades[r.timetable.grade] = grades.get(r.timetable.grade, 0) + 1
+            days[r.timetable.day_of_week] += 1
+        analytics.append({
+            'id': teacher.id,
+            'name': teacher.name,
+            'email': teacher.email,
+            'total_classes': len(records),
+            'proxy_classes': sum(1 for r in records if r.is_proxy and r.proxy_id == teacher.id),
+            'regular_classes': sum(1 for r in records if not r.is_proxy and r.timetable.teacher_id == teacher.id),
+            'absent_classes': sum(1 for r in records if r.timetable.teacher_id == teacher.id and r.is_proxy and r.proxy_id != teacher.id),
+            'monthly_earnings': teacher.pay_per_lecture * len(held),
+            'attendance_rate': round(len(held) / len(records) * 100, 2) if records else 0,
+            'subject_distribution': subjects,
+            'grade_distribution': grades,
+            'day_distribution': days,
+            'pay_per_lecture': teacher.pay_per_lecture
+        })
+        session.expunge_all()
+    return analytics
+
+@click.command('bench-analytics')
+@click.option('--rows', type=int, default=1_000_000, show_default=True, help='Attendance rows in the synthetic dataset.')
+@click.option('--teachers', 'teacher_count', type=int, default=100, show_default=True, help='Number of synthetic teachers.')
+@click.option('--skip-orm', is_flag=True, help='Only time the columnar engine.')
+@with_appcontext
+def bench_analytics(rows, teacher_count, skip_orm):
+    """Compare ORM and columnar teacher analytics on a synthetic attendance table."""
+    import random
+    from sqlalchemy import create_engine, insert
+    from sqlalchemy.orm import Session
+    from main.models import Attendance, Timetable
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}")
+        db.metadata.create_all(engine, tables=[Teacher.__table__, Timetable.__table__, Attendance.__table__])
+        with Session(engine) as session:
+            teachers = [
+                Teacher(name=f'Teacher {i}', email=f'teacher{i}@bench', password='-', role='teacher',
+                        address='-', mobile='0', pan_number='-', pay_per_lecture=100 + i)
+                for i in range(teacher_count)
+            ]
+            session.add_all(teachers)
+            session.flush()
+            slots = [
+                Timetable(teacher_id=teacher.id, day_of_week=slot % 7, start_time=datetime.min.time(),
+                          subject=rng.choice(['Maths', 'Physics', 'Chemistry', 'Biology', 'English']), grade=str(rng.randint(6, 12)))
+                for teacher in teachers for slot in range(30)
+            ]
+            session.add_all(slots)
+            session.commit()
+            teacher_ids = [teacher.id for teacher in teachers]
+            by_day = {day: [slot.id for slot in slots if slot.day_of_week == day] for day in range(7)}
+
+            click.echo(f'Generating {rows} attendance rows for {teacher_count} teachers...')
+            first_day, day, batch, written = date(2015, 1, 1), date(2015, 1, 1), [], 0
+
+            def attendance_rows(day):
+                for timetable_id in by_day[day.weekday()]:
+                    r = rng.random()
+                    proxy = r < 0.1
+                    yield {'timetable_id': timetable_id, 'date': day, 'is_present': r < 0.8, 'is_proxy': proxy,
+                           'proxy_id': rng.choice(teacher_ids) if proxy else None}
+
+            while written < rows:
+                batch.extend(attendance_rows(day))
+                day += timedelta(days=1)
+                if len(batch) >= 50000:
+                    session.execute(insert(Attendance.__table__), batch)
+                    written += len(batch)
+                    batch = []
+            if batch:
+                session.execute(insert(Attendance.__table__), batch)
+                written += len(batch)
+            session.commit()
+            click.echo(f'{written} rows from {first_day} to {day - timedelta(days=1)}')
+
+            columns = AttendanceColumns(clock_skew=0)
+            started = time.monotonic()
+            columns.refresh(session)
+            load = time.monotonic() - started
+            click.echo(f'columnar load     {load:>8.2f}s  {columns.nbytes / 1024 ** 2:.1f} MB for {len(columns)} rows')
+
+            for label, start in (('all history', first_day), ('last year', day - timedelta(days=365))):
+                started = time.monotonic()
+                columnar = columns.teacher_analytics(start, day, teachers, session)
+                click.echo(f'columnar {label:<10}{time.monotonic() - started:>7.3f}s')
+                if skip_orm:
+                    continue
+                started = time.monotonic()
+                orm = _orm_teacher_analytics(session, start, day, session.query(Teacher).all())
+                click.echo(f'orm      {label:<10}{time.monotonic() - started:>7.3f}s  results match: {orm == columnar}')
+
+            session.execute(insert(Attendance.__table__), list(attendance_rows(day)))
+            session.commit()
+            started = time.monotonic()
+            report = columns.refresh(session)
+            click.echo(f"append one day    {time.monotonic() - started:>8.3f}s  ({report['mode']}, {report['rows']} rows read)")
+        engine.dispose()
+
+@click.command('stress-payments')
+@click.option('--database-url', default=None, help='Scratch database to create the tables in. Defaults to a temporary SQLite file.')
+@click.option('--workers', type=int, default=8, show_default=True, help='Concurrent cashiers.')
+@click.option('--payments', 'payment_count', type=int, default=500, show_default=True, help='Payments per worker.')
+@click.option('--students', 'student_count', type=int, default=20, show_default=True, help='Students the payments are spread over.')
+@with_appcontext
+def stress_payments(database_url, workers, payment_count, student_count):
+    """Fire concurrent payments, with duplicated retries, and check no amount is lost or paid twice."""
+    import random
+    import threading
+    import uuid
+    from flask import Flask
+    from sqlalchemy import func
+    from sqlalchemy.exc import OperationalError
+    from main.models import Sales, Student, StudentInvoice, PaymentRequest, SalesMonthRollup
+    from main import payments
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scratch = Flask(__name__)
+        scratch.config.update(
+            SQLALCHEMY_DATABASE_URI=database_url or f"sqlite:///{os.path.join(tmp_dir, 'stress.db')}",
+            SQLALCHEMY_ENGINE_OPTIONS={} if database_url else {'connect_args': {'timeout': 30}},
+        )
+        db.init_app(scratch)
+        with scratch.app_context():
+            db.create_all()
+            cashiers = [
+                Sales(name=f'Cashier {i}', email=f'cashier{i}-{uuid.uuid4().hex[:8]}@stress', password='-',
+                      address='-', mobile='0', pan_number='-')
+                for i in range(workers)
+            ]
+            students = [
+                Student(grade=str(6 + i % 7), fname='Stress', lname=f'Student {i} {uuid.uuid4().hex[:8]}', total_fees=100000, fees_paid=0.0)
+                for i in range(student_count)
+            ]
+            db.session.add_all(cashiers + students)
+            db.session.commit()
+            cashier_ids = [cashier.id for cashier in cashiers]
+            targets = [(student.id, student.grade, f'{student.fname} {student.lname}') for student in students]
+
+        expected = {student_id: 0 for student_id, _, _ in targets}
+        counts = {'paid': 0, 'replayed': 0, 'retries': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def cashier(worker):
+            rng = random.Random(worker)
+            with scratch.app_context():
+                sales = db.session.get(Sales, cashier_ids[worker])
+                for _ in range(payment_count):
+                    student_id, grade, name = rng.choice(targets)
+                    amount = float(rng.randint(1, 500))
+                    key = uuid.uuid4().hex
+                    # Every tenth payment is submitted twice, as a client retrying after a timeout would
+                    sends = 2 if rng.random() < 0.1 else 1
+                    paid = False
+                    for _ in range(sends):
+                        for attempt in range(10):
+                            try:
+                                # Half the payments name the student by grade and exact name instead of the picked id
+                                by_id = rng.random() < 0.5
+                                _, replayed = payments.record_payment(
+                                    sales, grade, name, amount, 100000,
+                                    student_id=student_id if by_id else None, idempotency_key=key
+                                )
+                                break
+                            except OperationalError:
+                                # Lock timeouts and deadlocks are retried with the same key
+                                with lock:
+                                    counts['retries'] += 1
+                                time.sleep(0.01 * (attempt + 1))
+                        else:
+                            with lock:
+                                counts['failed'] += 1
+                            continue
+                        with lock:
+                            counts['replayed' if replayed else 'paid'] += 1
+                            if not paid:
+                                expected[student_id] += amount
+                        paid = True
+
+        started = time.monotonic()
+        threads = [threading.Thread(target=cashier, args=(worker,)) for worker in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        click.echo(
+            f"{counts['paid']} payments, {counts['replayed']} replays, {counts['retries']} retries, "
+            f"{counts['failed']} failed in {elapsed:.2f}s ({counts['paid'] / elapsed:.0f}/s)"
+        )
+
+        problems = []
+        with scratch.app_context():
+            student_ids = list(expected)
+            invoices = dict(
+                db.session.query(StudentInvoice.student_id, func.count(StudentInvoice.id))
+                .filter(StudentInvoice.student_id.in_(student_ids))
+                .group_by(StudentInvoice.student_id).all()
+            )
+            invoice_paid = dict(
+                db.session.query(StudentInvoice.student_id, func.sum(StudentInvoice.fees_paid))
+                .filter(StudentInvoice.student_id.in_(student_ids))
+                .group_by(StudentInvoice.student_id).all()
+            )
+            for student in db.session.query(Student).filter(Student.id.in_(student_ids)):
+                want = expected[student.id]
+                if invoices.get(student.id, 0) > 1:
+                    problems.append(f'student {student.id} has {invoices[student.id]} invoices')
+                if student.fees_paid != want or (invoice_paid.get(student.id) or 0) != want:
+                    problems.append(f'student {student.id}: paid {student.fees_paid}, invoices {invoice_paid.get(student.id)}, expected {want}')
+            keys = db.session.query(func.count(PaymentRequest.id)).filter(PaymentRequest.sales_id.in_(cashier_ids)).scalar()
+            if keys != counts['paid']:
+                problems.append(f"{keys} idempotency keys stored for {counts['paid']} payments")
+            rollup = db.session.query(func.sum(SalesMonthRollup.total_amount)).filter(SalesMonthRollup.sales_id.in_(cashier_ids)).scalar()
+            if (rollup or 0) != sum(expected.values()):
+                problems.append(f'sales rollups hold {rollup}, expected {sum(expected.values())}')
+            db.session.remove()
+            db.engine.dispose()
+
+    for problem in problems:
+        click.echo(f'  {problem}')
+    if problems:
+        raise click.ClickException(f'{len(problems)} problem(s) found.')
+    click.echo(f'OK. {sum(expected.values()):.0f} paid across {len(expected)} students, nothing lost or paid twice.')
+
 def init_app(app):
     """Register CLI commands."""
-    app.cli.add_command(rehash_passwords) 
\ No newline at end of file
+    app.cli.add_command(rehash_passwords)
+    app.cli.add_command(materialize_attendance_command)
+    app.cli.add_command(bench_transcode)
+    app.cli.add_command(compact_recordings_command)
+    app.cli.add_command(apply_retention_command)
+    app.cli.add_command(run_payroll_command)
+    app.cli.add_command(render_receipts_command)
+    app.cli.add_command(reconcile_teacher_invoices_command)
+    app.cli.add_command(backfill_rollups_command)
+    app.cli.add_command(bench_analytics)
+    app.cli.add_command(stress_payments)
\ No newline at end of file
@@ -0,0 +1,189 @@
+import threading
+import time
+from datetime import date
+
+from sqlalchemy import event, func, select
+
+from main.extensions import db
+from main.logger import event_logger
+from main.models import FeeSchedule
+
+# ── main/fees.py ─────────────────────────────────────────────────────────────────
+
+# How a student's total fees split into receipt lines. Rows in fee_schedules
+# set the split per academic year and grade band; a year without rows keeps
+# the schedule of the latest earlier year, and DEFAULT_SCHEDULE applies
+# where nothing has been configured for the year and grade.
+
+# (component, label, share) per grade band; (None, None) covers every grade
+_STANDARD = [
+    ('tuition', 'Tuition Fees', 0.82),
+    ('books', 'Books', 0.04),
+    ('ebook', 'E-Books', 0.02),
+    ('kit', 'Kit', 0.02),
+    ('uniform', 'Uniform', 0.04),
+    ('bag', 'Bag', 0.03),
+    ('activity', 'Extracurricular', 0.03),
+]
+DEFAULT_SCHEDULE = {
+    (None, None): _STANDARD,
+    # Senior grades get more e-books and no kit
+    (9, 12): [
+        (component, label, {'ebook': 0.04, 'kit': 0.00}.get(component, share))
+        for component, label, share in _STANDARD
+    ],
+}
+
+
+def academic_year(day: date, start_month: int = 4) -> int:
+    """Returns the calendar year in which the academic year containing `day` started."""
+    return day.year if day.month >= start_month else day.year - 1
+
+
+def _grade_number(grade) -> int | None:
+    try:
+        return int(grade)
+    except (TypeError, ValueError):
+        return None
+
+
+def _band_lines(bands: dict, grade) -> list[tuple]:
+    """Lines of the narrowest band containing `grade`; a None bound leaves that side open."""
+    number = _grade_number(grade)
+    best, best_rank = None, None
+    for band_from, band_to in bands:
+        low = float('-inf') if band_from is None else band_from
+        high = float('inf') if band_to is None else band_to
+        if (band_from, band_to) != (None, None) and (number is None or not low <= number <= high):
+            continue
+        rank = (high - low, (band_from is None) + (band_to is None))
+        if best_rank is None or rank < best_rank:
+            best, best_rank = (band_from, band_to), rank
+    return bands[best] if best is not None else []
+
+
+class FeeSchedules:
+    """
+    In-process copy of the fee_schedules table.
+
+    The table is small, so it is read whole on first use and kept until a
+    commit in this process touches a FeeSchedule row. Edits made by other
+    processes are noticed every `sync_interval` seconds by comparing the
+    row count and newest `updated_at`.
+    """
+
+    def __init__(self):
+        self.sync_interval = 60
+        self.start_month = 4
+        self._lock = threading.Lock()
+        self._years = None  # academic year -> {(grade_from, grade_to): [(component, label, share)]}
+        self._version = None
+        self._checked_at = 0.0
+
+    def init_app(self, app):
+        self.sync_interval = app.config.get('FEE_SCHEDULE_SYNC_INTERVAL', 60)
+        self.start_month = app.config.get('ACADEMIC_YEAR_START_MONTH', 4)
+        if not event.contains(db.session, 'after_flush', self._collect_changes):
+            event.listen(db.session, 'after_flush', self._collect_changes)
+            event.listen(db.session, 'after_commit', self._invalidate_committed)
+            event.listen(db.session, 'after_rollback', self._discard_changes)
+
+    def _collect_changes(self, session, flush_context):
+        if any(isinstance(obj, FeeSchedule) for obj in (*session.new, *session.dirty, *session.deleted)):
+            session.info['fee_schedules_changed'] = True
+
+    def _invalidate_committed(self, session):
+        if session.info.pop('fee_schedules_changed', False):
+            self.invalidate()
+
+    def _discard_changes(self, session):
+        session.info.pop('fee_schedules_changed', None)
+
+    def invalidate(self) -> None:
+        """Drops the cached schedules; the next breakdown reloads them."""
+        with self._lock:
+            self._years = None
+
+    def _current_version(self):
+        return tuple(db.session.execute(
+            select(func.count(FeeSchedule.id), func.max(FeeSchedule.updated_at))
+        ).one())
+
+    def _schedules(self) -> dict:
+        """Returns the cached schedules, reloading them when missing or changed elsewhere."""
+        with self._lock:
+            if self._years is not None and time.monotonic() - self._checked_at < self.sync_interval:
+                return self._years
+            version = self._current_version()
+            if self._years is not None and version == self._version:
+                self._checked_at = time.monotonic()
+                return self._years
+
+            years = {}
+            for row in FeeSchedule.query.order_by(FeeSchedule.position, FeeSchedule.id).all():
+                band = (
+                    None if row.grade_from <= FeeSchedule.OPEN_FROM else row.grade_from,
+                    None if row.grade_to >= FeeSchedule.OPEN_TO else row.grade_to,
+                )
+                lines = years.setdefault(row.academic_year, {}).setdefault(band, {})
+                lines.pop(row.component, None)  # a later duplicate replaces the earlier row
+                lines[row.component] = (row.component, row.label, row.share)
+            self._years = {
+                year: {band: list(lines.values()) for band, lines in bands.items()}
+                for year, bands in years.items()
+            }
+            self._version, self._checked_at = version, time.monotonic()
+            event_logger.info(f"Loaded fee schedules for {len(self._years)} academic year(s)")
+            return self._years
+
+    def _lines(self, years: dict, grade, day: date) -> list[tuple]:
+        year = academic_year(day or date.today(), self.start_month)
+        configured = [y for y in years if y <= year]
+        lines = _band_lines(years[max(configured)], grade) if configured else []
+        return lines or _band_lines(DEFAULT_SCHEDULE, grade)
+
+    def breakdown(self, total_fees: float, grade, day: date = None) -> list[dict]:
+        """
+        Splits a student's total fees into receipt lines.
+
+        Args:
+            total_fees (float): The student's total fees.
+            grade: The student's grade; numeric grades can fall into a band.
+            day (date, optional): Date of the invoice, choosing the academic year. Defaults to today.
+
+        Returns:
+            list[dict]: Lines in receipt order, each with component, label and amount.
+        """
+        return [
+            {'component': component, 'label': label, 'amount': round((total_fees or 0) * share, 2)}
+            for component, label, share in self._lines(self._schedules(), grade, day)
+        ]
+
+    def breakdowns(self, invoices) -> dict[int, list[dict]]:
+        """
+        Breakdowns for many invoices at once, for bulk receipt runs. The
+        schedules are checked once and each (academic year, grade) resolved
+        once, however many invoices share it.
+
+        Args:
+            invoices (list[StudentInvoice]): Invoices, ideally with their students loaded.
+
+        Returns:
+            dict[int, list[dict]]: Lines per invoice id, as for `breakdown`.
+        """
+        years = self._schedules()
+        resolved = {}
+        result = {}
+        for inv in invoices:
+            student = inv.student
+            key = (academic_year(inv.date or date.today(), self.start_month), student.grade)
+            if key not in resolved:
+                resolved[key] = self._lines(years, student.grade, inv.date)
+            result[inv.id] = [
+                {'component': component, 'label': label, 'amount': round((student.total_fees or 0) * share, 2)}
+                for component, label, share in resolved[key]
+            ]
+        return result
+
+
+fee_schedules = FeeSchedules()
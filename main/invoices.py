@@ -0,0 +1,153 @@
+from collections import deque
+from concurrent.futures import Future
+from datetime import date
+
+from flask import render_template
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+
+from main.extensions import db
+from main.fees import fee_schedules
+from main.logger import event_logger, error_logger
+from main.models import Student, StudentInvoice
+from main.pdf import pdf_renderer, PdfRenderError, invoice_tag
+
+# ── main/invoices.py ─────────────────────────────────────────────────────────────
+
+
+def _like_prefix(prefix: str) -> str:
+    """LIKE pattern matching values that start with `prefix` literally."""
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{escaped}%'
+
+
+def invoice_records(before: int = None, limit: int = 50, sales_id: int = None, grade: str = None,
+                    date_from: date = None, date_to: date = None, name: str = None) -> list[dict]:
+    """
+    Returns one page of student invoices, newest first, using keyset
+    pagination on the invoice id so every page reads a fixed-size slice no
+    matter how deep the client has scrolled.
+
+    Args:
+        before (int, optional): Only invoices with a smaller id, i.e. the last id of the previous page.
+        limit (int): Maximum number of records to return.
+        sales_id (int, optional): Only invoices created by this sales person.
+        grade (str, optional): Only students of this grade.
+        date_from (date, optional): Only invoices dated on or after this day.
+        date_to (date, optional): Only invoices dated on or before this day.
+        name (str, optional): Student name prefix, matched against the first
+            or last name. "First Last" matches the first name exactly and the
+            last name by prefix.
+
+    Returns:
+        list[dict]: Invoice rows with the student's grade and name.
+    """
+    query = (
+        db.session.query(
+            StudentInvoice.id,
+            Student.grade,
+            Student.fname,
+            Student.lname,
+            StudentInvoice.total_fees,
+            StudentInvoice.fees_paid,
+            StudentInvoice.date,
+            StudentInvoice.created_by,
+            StudentInvoice.sales_id
+        )
+        .join(Student, Student.id == StudentInvoice.student_id)
+    )
+    if before is not None:
+        query = query.filter(StudentInvoice.id < before)
+    if sales_id is not None:
+        query = query.filter(StudentInvoice.sales_id == sales_id)
+    if grade:
+        query = query.filter(Student.grade == grade)
+    if date_from:
+        query = query.filter(StudentInvoice.date >= date_from)
+    if date_to:
+        query = query.filter(StudentInvoice.date <= date_to)
+    if name:
+        parts = name.split(None, 1)
+        if len(parts) > 1:
+            query = query.filter(Student.fname == parts[0], Student.lname.like(_like_prefix(parts[1]), escape='\\'))
+        else:
+            pattern = _like_prefix(parts[0])
+            query = query.filter(or_(Student.fname.like(pattern, escape='\\'), Student.lname.like(pattern, escape='\\')))
+
+    return [row._asdict() for row in query.order_by(StudentInvoice.id.desc()).limit(limit).all()]
+
+
+def receipt_html(inv: StudentInvoice, breakdown: list[dict] = None) -> str:
+    """
+    Renders the receipt of an invoice. The same HTML means the same cached
+    PDF, so every path that produces a receipt goes through here.
+
+    Args:
+        inv (StudentInvoice): The invoice.
+        breakdown (list[dict], optional): Lines from `fee_schedules.breakdowns`, when computed in bulk.
+
+    Returns:
+        str: The receipt HTML.
+    """
+    student = inv.student
+    if breakdown is None:
+        breakdown = fee_schedules.breakdown(student.total_fees, student.grade, inv.date)
+    return render_template('invoice.html', student=student, invoice=inv, breakdown=breakdown)
+
+
+def render_receipts(start: date, end: date, sales_id: int = None, progress=None) -> dict:
+    """
+    Renders the receipts of every invoice dated in [start, end) into the
+    PDF cache, so later downloads are served without waiting.
+
+    Args:
+        start (date): First invoice date.
+        end (date): Day after the last invoice date.
+        sales_id (int, optional): Only invoices created by this sales person.
+        progress (callable, optional): Called as progress(done, total, invoice_id).
+
+    Returns:
+        dict: Number of receipts rendered and the ids that failed.
+    """
+    query = (
+        StudentInvoice.query
+        .options(joinedload(StudentInvoice.student))
+        .filter(StudentInvoice.date >= start, StudentInvoice.date < end)
+    )
+    if sales_id is not None:
+        query = query.filter(StudentInvoice.sales_id == sales_id)
+    invoices = query.order_by(StudentInvoice.id).all()
+    breakdowns = fee_schedules.breakdowns(invoices)
+
+    # Keep the pool busy while leaving queue space for interactive downloads
+    window = 2 * pdf_renderer.workers
+    pending = deque()
+    failed = []
+    done = 0
+
+    def collect(invoice_id, future):
+        nonlocal done
+        try:
+            future.result()
+        except PdfRenderError as e:
+            error_logger.error(f"Receipt for invoice {invoice_id} failed: {e}")
+            failed.append(invoice_id)
+        done += 1
+        if progress:
+            progress(done, len(invoices), invoice_id)
+
+    for inv in invoices:
+        if len(pending) >= window:
+            collect(*pending.popleft())
+        future = Future()
+        try:
+            future = pdf_renderer.submit(receipt_html(inv, breakdowns[inv.id]), tags=(invoice_tag(inv.id),))
+        except PdfRenderError as e:
+            future.set_exception(e)
+        pending.append((inv.id, future))
+    while pending:
+        collect(*pending.popleft())
+
+    result = {'rendered': len(invoices) - len(failed), 'failed': failed}
+    event_logger.info(f"Rendered receipts for {start} to {end}: {result}")
+    return result
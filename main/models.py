@@ -90,6 +90,11 @@ class Teacher(BaseModel):
 
 class Student(BaseModel):
     __tablename__ = 'students'
+    __table_args__ = (
+        db.UniqueConstraint('grade', 'fname', 'lname', name='uq_students_grade_fname_lname'),
+        db.Index('ix_students_fname_lname', 'fname', 'lname'),
+        db.Index('ix_students_lname', 'lname'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     fname = db.Column(db.String(100), nullable=False)
@@ -122,10 +127,13 @@ class Timetable(BaseModel):
 
 class TeacherInvoice(BaseModel):
     __tablename__ = 'teacher_invoices'
+    __table_args__ = (
+        db.UniqueConstraint('teacher_id', 'date', name='uq_teacher_invoices_teacher_date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     teacher_id = db.Column(db.Integer, db.ForeignKey('teachers.id'), nullable=False, index=True)
-    date = db.Column(db.Date, nullable=False, index=True)
+    date = db.Column(db.Date, nullable=False, index=True)  # First day of the invoiced month
     total_lectures = db.Column(db.Integer, nullable=False)
     total_amount = db.Column(db.Float, nullable=False)
 
@@ -135,6 +143,10 @@ class TeacherInvoice(BaseModel):
 
 class StudentInvoice(BaseModel):
     __tablename__ = 'student_invoices'
+    __table_args__ = (
+        db.Index('ix_student_invoices_sales_id_date', 'sales_id', 'date'),
+        db.Index('ix_student_invoices_sales_id_id', 'sales_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False, index=True)
@@ -150,6 +162,10 @@ class StudentInvoice(BaseModel):
 
 class Attendance(BaseModel):
     __tablename__ = 'attendance'
+    __table_args__ = (
+        db.UniqueConstraint('timetable_id', 'date', name='uq_attendance_timetable_date'),
+        db.Index('ix_attendance_proxy_id_date', 'proxy_id', 'date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     timetable_id = db.Column(db.Integer, db.ForeignKey('timetable_templates.id'), nullable=False, index=True)
@@ -161,4 +177,108 @@ class Attendance(BaseModel):
     proxy_teacher = db.relationship('Teacher', foreign_keys=[proxy_id])
 
     def __repr__(self):
-        return f"<Attendance {self.date} {self.timetable.subject}>"
\ No newline at end of file
+        return f"<Attendance {self.date} {self.timetable.subject}>"
+
+
+class Recording(BaseModel):
+    __tablename__ = 'recordings'
+    __table_args__ = (
+        db.Index('ix_recordings_teacher_id_date', 'teacher_id', 'date'),
+        db.Index('ix_recordings_grade_date', 'grade', 'date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    attendance_id = db.Column(db.Integer, db.ForeignKey('attendance.id'), nullable=False, unique=True)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teachers.id'), nullable=False)  # Teacher who held the lecture
+    date = db.Column(db.Date, nullable=False, index=True)
+    grade = db.Column(db.String(20), nullable=False)
+    subject = db.Column(db.String(100), nullable=False)
+    path = db.Column(db.String(255), nullable=False)  # Relative to UPLOAD_FOLDER
+    sha256 = db.Column(db.String(64), nullable=False, index=True)  # Hash of the original upload
+    size = db.Column(db.BigInteger, nullable=True)
+    duration = db.Column(db.Float, nullable=True)
+    codec = db.Column(db.String(20), nullable=True)
+    mode = db.Column(db.String(20), nullable=True)  # remux, transcode or duplicate
+    status = db.Column(db.String(20), nullable=False, default='ready', index=True)
+
+    attendance = db.relationship('Attendance', backref=db.backref('recording', uselist=False))
+    teacher = db.relationship('Teacher')
+
+    def __repr__(self):
+        return f"<Recording {self.date} {self.subject} {self.status}>"
+
+class TeacherMonthRollup(BaseModel):
+    __tablename__ = 'teacher_month_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('teacher_id', 'month', 'subject', 'grade', 'day_of_week', name='uq_teacher_month_rollups_key'),
+        db.Index('ix_teacher_month_rollups_month_teacher_id', 'month', 'teacher_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teachers.id'), nullable=False)
+    month = db.Column(db.Date, nullable=False)  # First day of the month
+    subject = db.Column(db.String(100), nullable=False)
+    grade = db.Column(db.String(20), nullable=False)
+    day_of_week = db.Column(db.Integer, nullable=False)
+    total_classes = db.Column(db.Integer, nullable=False, default=0)
+    proxy_classes = db.Column(db.Integer, nullable=False, default=0)
+    regular_classes = db.Column(db.Integer, nullable=False, default=0)
+    absent_classes = db.Column(db.Integer, nullable=False, default=0)
+    held_classes = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<TeacherMonthRollup {self.teacher_id} {self.month} {self.subject}>"
+
+
+class SalesMonthRollup(BaseModel):
+    __tablename__ = 'sales_month_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('sales_id', 'month', name='uq_sales_month_rollups_sales_month'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    sales_id = db.Column(db.Integer, db.ForeignKey('sales.id'), nullable=False)
+    month = db.Column(db.Date, nullable=False, index=True)  # First day of the month
+    invoices = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<SalesMonthRollup {self.sales_id} {self.month}>"
+
+class PaymentRequest(BaseModel):
+    __tablename__ = 'payment_requests'
+    __table_args__ = (
+        db.UniqueConstraint('sales_id', 'idempotency_key', name='uq_payment_requests_sales_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    sales_id = db.Column(db.Integer, db.ForeignKey('sales.id'), nullable=False)
+    idempotency_key = db.Column(db.String(64), nullable=False)  # Sent by the client, reused on retries
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('student_invoices.id'), nullable=True)
+    amount = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f"<PaymentRequest {self.sales_id} {self.idempotency_key}>"
+
+class FeeSchedule(BaseModel):
+    __tablename__ = 'fee_schedules'
+    __table_args__ = (
+        db.UniqueConstraint('academic_year', 'grade_from', 'grade_to', 'component', name='uq_fee_schedules_year_band_component'),
+    )
+
+    # Bounds that leave their side of a band open; a band open on both sides
+    # also covers non-numeric grades. Unlike NULLs they compare equal in the unique key
+    OPEN_FROM, OPEN_TO = 0, 99
+
+    id = db.Column(db.Integer, primary_key=True)
+    academic_year = db.Column(db.Integer, nullable=False, index=True)  # Calendar year the academic year starts in
+    grade_from = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Grade band, inclusive; OPEN_FROM/OPEN_TO bounds are open
+    grade_to = db.Column(db.Integer, nullable=False, default=99, server_default='99')
+    component = db.Column(db.String(30), nullable=False)  # e.g. tuition, books
+    label = db.Column(db.String(100), nullable=False)  # Shown on the receipt
+    share = db.Column(db.Float, nullable=False)  # Fraction of the total fees
+    position = db.Column(db.Integer, nullable=False, default=0)  # Order on the receipt
+
+    def __repr__(self):
+        return f"<FeeSchedule {self.academic_year} {self.grade_from}-{self.grade_to} {self.component}>"
@@ -0,0 +1,165 @@
+from datetime import date
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from main.extensions import db
+from main.logger import event_logger
+from main.models import Student, StudentInvoice, Sales, PaymentRequest
+from main.pdf import pdf_renderer, invoice_tag, sales_month_tag
+from main.rollups import add_sales_payment
+from main.snapshots import insert_missing
+from main.student_index import student_index
+
+# ── main/payments.py ─────────────────────────────────────────────────────────────
+
+# A payment is recorded in one transaction: the student row is found by its
+# exact (grade, fname, lname) key or picked id and locked, the invoice and
+# student totals are raised with relative UPDATEs, and the client's
+# idempotency key is stored alongside so a retried request is answered from
+# the first one instead of paying twice.
+
+
+class PaymentError(Exception):
+    """Raised when a payment cannot be recorded as requested."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def _replay(sales_id: int, idempotency_key: str, amount: float) -> StudentInvoice | None:
+    """Returns the invoice of an earlier request with this key, if there was one."""
+    earlier = PaymentRequest.query.filter_by(sales_id=sales_id, idempotency_key=idempotency_key).first()
+    if earlier is None:
+        return None
+    if earlier.amount != amount:
+        raise PaymentError('Idempotency key was already used for a different payment', 409)
+    return db.session.get(StudentInvoice, earlier.invoice_id)
+
+
+def _split_name(name: str) -> tuple[str, str]:
+    parts = name.split(None, 1)
+    return parts[0], parts[1] if len(parts) > 1 else ''
+
+
+def find_student(grade: str, name: str) -> Student | None:
+    """
+    Returns the student whose grade, first name and last name are exactly
+    these, the identity payments are recorded against. Near matches are left
+    to `student_index.suggest` so a similar name is never paid silently.
+    """
+    fname, lname = _split_name(name)
+    return Student.query.filter_by(grade=grade, fname=fname, lname=lname).first()
+
+
+def _locked_student(grade: str, name: str, total: float, student_id: int = None) -> Student:
+    """
+    Finds the student and locks their row until the transaction ends,
+    creating them on their first payment. The unique (grade, fname, lname)
+    constraint makes concurrent first payments share one row.
+    """
+    if student_id is None:
+        student = find_student(grade, name)
+        student_id = student.id if student else None
+
+    if student_id is None:
+        fname, lname = _split_name(name)
+        key = {'grade': grade, 'fname': fname, 'lname': lname}
+        insert_missing(db.session.connection(), Student.__table__, [dict(key, total_fees=total, fees_paid=0.0)], list(key))
+        student = Student.query.filter_by(**key).with_for_update().one()
+        student_index.add_on_commit(db.session, student)
+        return student
+
+    student = db.session.get(Student, student_id, with_for_update=True)
+    if student is None:
+        raise PaymentError('Student not found', 404)
+    return student
+
+
+def _add_to_fees_paid(model, row_id: int, amount: float) -> None:
+    """Raises fees_paid in the database, so concurrent payments cannot overwrite each other."""
+    db.session.execute(
+        update(model.__table__)
+        .where(model.__table__.c.id == row_id)
+        .values(fees_paid=model.__table__.c.fees_paid + amount)
+    )
+
+
+def record_payment(sales: Sales, grade: str, name: str, amount: float, total: float,
+                   student_id: int = None, idempotency_key: str = None) -> tuple[StudentInvoice, bool]:
+    """
+    Records a payment against the student's invoice, creating the student
+    and the invoice on their first payment.
+
+    Args:
+        sales (Sales): Sales person taking the payment.
+        grade (str): Student's grade.
+        name (str): Student's full name, used when no `student_id` is given;
+            matched exactly against first and last name.
+        amount (float): Amount paid.
+        total (float): Total fees, used for a new student or invoice.
+        student_id (int, optional): Student picked in the form.
+        idempotency_key (str, optional): Client generated key; a request
+            repeating a key already recorded for this sales person returns
+            the first request's invoice without paying again.
+
+    Returns:
+        tuple[StudentInvoice, bool]: The invoice, and whether the request was a replay.
+    """
+    if idempotency_key:
+        invoice = _replay(sales.id, idempotency_key, amount)
+        if invoice is not None:
+            return invoice, True
+
+    try:
+        payment = None
+        if idempotency_key:
+            # Flushed first: a concurrent request with the same key waits on
+            # the unique index and fails once this transaction commits
+            payment = PaymentRequest(sales_id=sales.id, idempotency_key=idempotency_key, amount=amount)
+            db.session.add(payment)
+            db.session.flush()
+
+        student = _locked_student(grade, name, total, student_id)
+
+        # The student lock serializes payments per student, so only one creates the invoice
+        invoice = StudentInvoice.query.filter_by(student_id=student.id).order_by(StudentInvoice.id).first()
+        if invoice is None:
+            invoice = StudentInvoice(
+                student_id=student.id,
+                sales_id=sales.id,
+                date=date.today(),
+                total_fees=total,
+                fees_paid=amount,
+                created_by=sales.name
+            )
+            db.session.add(invoice)
+            db.session.flush()
+        else:
+            _add_to_fees_paid(StudentInvoice, invoice.id, amount)
+            db.session.expire(invoice, ['fees_paid', 'updated_at'])
+            # Bulk UPDATEs skip the flush events that keep these in step
+            add_sales_payment(db.session, invoice.sales_id, invoice.date, amount)
+            pdf_renderer.invalidate_on_commit(
+                db.session, (invoice_tag(invoice.id), sales_month_tag(invoice.sales_id, invoice.date))
+            )
+
+        _add_to_fees_paid(Student, student.id, amount)
+        db.session.expire(student, ['fees_paid', 'updated_at'])
+
+        if payment is not None:
+            payment.student_id, payment.invoice_id = student.id, invoice.id
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        invoice = _replay(sales.id, idempotency_key, amount) if idempotency_key else None
+        if invoice is None:
+            raise
+        return invoice, True
+    except Exception:
+        db.session.rollback()
+        raise
+
+    event_logger.info(f"Recorded payment of {amount} on invoice {invoice.id} by sales {sales.id}")
+    return invoice, False
@@ -0,0 +1,259 @@
+import csv
+import io
+import os
+import threading
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+
+from flask import current_app, render_template
+from sqlalchemy import case
+
+from main.extensions import db
+from main.logger import event_logger, error_logger
+from main.models import Attendance, Timetable, Teacher, TeacherInvoice
+from main.pdf import pdf_renderer, teacher_month_tag, PdfRenderError
+from main.utils import util_month_range
+
+# ── main/payroll.py ──────────────────────────────────────────────────────────────
+
+# Payroll runs started from the admin panel, by id. Kept in memory like transcode jobs.
+_runs: dict[str, dict] = {}
+_runs_lock = threading.Lock()
+
+
+def monthly_lectures(year: int, month: int, teacher_ids: list[int] = None) -> dict[int, list[dict]]:
+    """
+    Returns the paid lectures of a month grouped by the teacher who held them,
+    using a single query. A regular lecture is paid to the assigned teacher
+    and a proxy lecture to the proxy teacher.
+
+    Args:
+        year (int): Invoice year.
+        month (int): Invoice month, 1-12.
+        teacher_ids (list[int], optional): Only these teachers. Defaults to all.
+
+    Returns:
+        dict[int, list[dict]]: Lecture entries per teacher id, ordered by date.
+    """
+    start, end = util_month_range(year, month)
+    payee = case((Attendance.is_proxy == True, Attendance.proxy_id), else_=Timetable.teacher_id)
+
+    query = (
+        db.session.query(
+            payee.label('payee_id'),
+            Attendance.date,
+            Attendance.is_proxy,
+            Timetable.subject,
+            Timetable.grade,
+            Timetable.start_time
+        )
+        .join(Timetable, Timetable.id == Attendance.timetable_id)
+        .filter(
+            Attendance.is_present == True,
+            Attendance.date >= start,
+            Attendance.date < end
+        )
+    )
+    if teacher_ids is not None:
+        query = query.filter(payee.in_(teacher_ids))
+
+    lectures = {}
+    for row in query.order_by(Attendance.date, Timetable.start_time).all():
+        if row.payee_id is None:
+            continue
+        lectures.setdefault(row.payee_id, []).append({
+            'date': row.date,
+            'subject': row.subject,
+            'grade': row.grade,
+            'start_time': row.start_time,
+            'is_proxy': row.is_proxy,
+        })
+    return lectures
+
+
+def invoice_context(teacher: Teacher, lectures: list[dict], year: int, month: int) -> dict:
+    """Builds the invoice_template.html context for one teacher's month."""
+    entries = [dict(lecture, payment=teacher.pay_per_lecture) for lecture in lectures]
+    return {
+        'teacher': teacher,
+        'entries': entries,
+        'total_lectures': len(entries),
+        'total_amount': sum(entry['payment'] for entry in entries),
+        'month': f'{month:02d}',
+        'year': str(year),
+    }
+
+
+def invoice_filename(teacher_id: int, year: int, month: int) -> str:
+    return f"invoice_{teacher_id}_{year}{month:02d}.pdf"
+
+
+def archive_path(year: int, month: int) -> str:
+    return os.path.join(current_app.config['PAYROLL_FOLDER'], f"payroll_{year}_{month:02d}.zip")
+
+
+def run_payroll(year: int, month: int, progress=None) -> dict:
+    """
+    Computes, stores and renders the invoices of every active teacher with
+    lectures in a month, and bundles the PDFs with a CSV summary into one zip.
+    Re-running a month replaces its TeacherInvoice rows and archive.
+
+    Args:
+        year (int): Invoice year.
+        month (int): Invoice month, 1-12.
+        progress (callable, optional): Called as progress(done, total, teacher_id)
+            after each invoice is rendered.
+
+    Returns:
+        dict: Result status with success flag, counts, totals and the archive path.
+    """
+    start, _ = util_month_range(year, month)
+    teachers = {teacher.id: teacher for teacher in Teacher.query.filter_by(is_active=True).all()}
+    lectures = monthly_lectures(year, month, list(teachers))
+    teacher_ids = sorted(lectures)
+    payable = [teachers[teacher_id] for teacher_id in teacher_ids]
+
+    # Render the HTML before committing, while the teachers are still loaded,
+    # and store the invoice rows first so the totals are kept even if rendering fails
+    existing = {
+        invoice.teacher_id: invoice
+        for invoice in TeacherInvoice.query.filter(TeacherInvoice.date == start).all()
+    }
+    contexts, documents, summary_rows = {}, {}, []
+    for teacher in payable:
+        context = invoice_context(teacher, lectures[teacher.id], year, month)
+        contexts[teacher.id] = context
+        documents[teacher.id] = render_template('invoice_template.html', **context)
+        summary_rows.append([teacher.id, teacher.name, teacher.email, context['total_lectures'], context['total_amount']])
+        invoice = existing.get(teacher.id) or TeacherInvoice(teacher_id=teacher.id, date=start)
+        invoice.total_lectures = context['total_lectures']
+        invoice.total_amount = context['total_amount']
+        db.session.add(invoice)
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        error_logger.error(f"Storing payroll for {year}-{month:02d} failed: {e}", exc_info=True)
+        return {'success': False, 'error': 'Could not store teacher invoices'}
+
+    os.makedirs(current_app.config['PAYROLL_FOLDER'], exist_ok=True)
+    path = archive_path(year, month)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    failed = []
+
+    # Keep the pool busy while leaving queue space for interactive downloads
+    window = 2 * pdf_renderer.workers
+    pending = deque()
+    done = 0
+
+    def collect(archive, teacher_id, future):
+        nonlocal done
+        try:
+            archive.writestr(invoice_filename(teacher_id, year, month), future.result())
+        except PdfRenderError as e:
+            error_logger.error(f"Payroll invoice for teacher {teacher_id} failed: {e}")
+            failed.append(teacher_id)
+        done += 1
+        if progress:
+            progress(done, len(teacher_ids), teacher_id)
+
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for teacher_id in teacher_ids:
+                if len(pending) >= window:
+                    collect(archive, *pending.popleft())
+                future = Future()
+                try:
+                    future = pdf_renderer.submit(documents[teacher_id], tags=(teacher_month_tag(teacher_id, start),))
+                except PdfRenderError as e:
+                    future.set_exception(e)
+                pending.append((teacher_id, future))
+            while pending:
+                collect(archive, *pending.popleft())
+
+            summary = io.StringIO()
+            writer = csv.writer(summary)
+            writer.writerow(['teacher_id', 'name', 'email', 'lectures', 'amount', 'rendered'])
+            for row in summary_rows:
+                writer.writerow(row + ['no' if row[0] in failed else 'yes'])
+            archive.writestr(f"payroll_{year}_{month:02d}.csv", summary.getvalue())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    result = {
+        'success': not failed,
+        'teachers': len(teacher_ids),
+        'failed': failed,
+        'total_lectures': sum(context['total_lectures'] for context in contexts.values()),
+        'total_amount': sum(context['total_amount'] for context in contexts.values()),
+        'archive': path,
+    }
+    if failed:
+        result['error'] = f"{len(failed)} invoice(s) could not be rendered"
+    event_logger.info(f"Payroll for {year}-{month:02d}: {result}")
+    return result
+
+
+def start_payroll_run(year: int, month: int) -> dict:
+    """
+    Runs the payroll for a month on a background thread.
+
+    Args:
+        year (int): Invoice year.
+        month (int): Invoice month, 1-12.
+
+    Returns:
+        dict: The run, whose `done`/`total` fields are updated as it progresses.
+    """
+    with _runs_lock:
+        active = next(
+            (run for run in _runs.values()
+             if (run['year'], run['month']) == (year, month) and run['status'] == 'running'),
+            None
+        )
+        if active:
+            return active
+        run = {
+            'id': uuid.uuid4().hex,
+            'year': year,
+            'month': month,
+            'status': 'running',
+            'done': 0,
+            'total': None,
+            'result': None,
+            'started_at': datetime.utcnow().isoformat(),
+            'finished_at': None,
+        }
+        _runs[run['id']] = run
+
+    app = current_app._get_current_object()
+
+    def progress(done, total, teacher_id):
+        run['done'], run['total'] = done, total
+
+    def work():
+        with app.app_context():
+            try:
+                result = run_payroll(year, month, progress)
+                run['total'] = result.get('teachers', run['total'])
+                run['result'] = {key: value for key, value in result.items() if key != 'archive'}
+                run['status'] = 'done' if result.get('success') else 'failed'
+            except Exception as e:
+                error_logger.error(f"Payroll run {run['id']} failed: {e}", exc_info=True)
+                run['result'] = {'success': False, 'error': str(e)}
+                run['status'] = 'failed'
+            finally:
+                run['finished_at'] = datetime.utcnow().isoformat()
+                db.session.remove()
+
+    threading.Thread(target=work, name=f"payroll-{year}-{month:02d}", daemon=True).start()
+    return run
+
+
+def get_payroll_run(run_id: str) -> dict | None:
+    return _runs.get(run_id)
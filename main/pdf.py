@@ -0,0 +1,484 @@
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import date
+
+from flask import make_response
+from sqlalchemy import event
+
+from main.extensions import db
+from main.logger import event_logger, error_logger
+from main.models import Attendance, StudentInvoice
+
+# ── main/pdf.py ──────────────────────────────────────────────────────────────────
+
+
+class PdfRenderError(RuntimeError):
+    """Raised when a document could not be rendered, including when the service is saturated."""
+
+
+class PdfBackend(ABC):
+    """
+    Interface for HTML to PDF converters. Backends must be safe to call from
+    several threads at once; the renderer limits how many calls run together.
+    """
+
+    name = None
+
+    def __init__(self, app):
+        self.app = app
+
+    @abstractmethod
+    def render(self, html: str, options: dict, timeout: float) -> bytes:
+        """Converts `html` to PDF bytes, raising PdfRenderError on failure."""
+
+    def close(self):
+        pass
+
+
+class WkhtmltopdfBackend(PdfBackend):
+    """Pipes HTML through wkhtmltopdf on stdin/stdout, so no temporary files are written."""
+
+    name = 'wkhtmltopdf'
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.binary = app.config.get('WKHTMLTOPDF_PATH', 'wkhtmltopdf')
+
+    @staticmethod
+    def _flags(options: dict) -> list[str]:
+        """Converts pdfkit style options ({'page-size': 'A4', 'quiet': ''}) to command line flags."""
+        flags = []
+        for key, value in options.items():
+            flags.append(key if key.startswith('-') else f'--{key}')
+            if value not in (None, '', True):
+                flags.append(str(value))
+        return flags
+
+    def render(self, html: str, options: dict, timeout: float) -> bytes:
+        cmd = [self.binary, *self._flags(options), '-', '-']
+        try:
+            result = subprocess.run(cmd, input=html.encode('utf-8'), capture_output=True, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            raise PdfRenderError(f'PDF rendering exceeded {timeout}s') from e
+        except OSError as e:
+            raise PdfRenderError(f'Could not start {self.binary}: {e}') from e
+        # wkhtmltopdf exits with 1 for recoverable resource errors but still writes the PDF
+        if not result.stdout.startswith(b'%PDF'):
+            raise PdfRenderError(f'wkhtmltopdf failed: {result.stderr.decode(errors="replace").strip()}')
+        return result.stdout
+
+
+class WeasyPrintBackend(PdfBackend):
+    """Renders in-process with WeasyPrint, avoiding a process start per document."""
+
+    name = 'weasyprint'
+
+    def __init__(self, app):
+        super().__init__(app)
+        try:
+            import weasyprint
+        except ImportError as e:
+            raise PdfRenderError('The weasyprint backend requires the weasyprint package') from e
+        self._weasyprint = weasyprint
+        self.base_url = app.config.get('PDF_BASE_URL')
+
+    def render(self, html: str, options: dict, timeout: float) -> bytes:
+        # The renderer enforces the timeout on the waiting side for in-process backends
+        return self._weasyprint.HTML(string=html, base_url=self.base_url).write_pdf()
+
+
+BACKENDS = {
+    WkhtmltopdfBackend.name: WkhtmltopdfBackend,
+    WeasyPrintBackend.name: WeasyPrintBackend,
+}
+
+
+def register_backend(backend_cls: type) -> None:
+    """Makes a PdfBackend subclass selectable through the PDF_BACKEND setting."""
+    BACKENDS[backend_cls.name] = backend_cls
+
+
+def invoice_tag(invoice_id: int) -> str:
+    return f'student_invoice:{invoice_id}'
+
+
+def teacher_month_tag(teacher_id: int, month: date) -> str:
+    return f'teacher:{teacher_id}:{month:%Y-%m}'
+
+
+def sales_month_tag(sales_id: int, month: date) -> str:
+    return f'sales:{sales_id}:{month:%Y-%m}'
+
+
+class PdfCache:
+    """
+    Disk-backed cache of rendered PDFs keyed by a hash of the HTML and the
+    backend options, evicting the least recently used files once the cache
+    grows past `max_bytes`.
+
+    Because the key covers the full document, a changed invoice always
+    renders afresh. Entries can also carry tags so that rows changing in the
+    database drop the documents built from them straight away instead of
+    waiting for eviction. Tags are tracked per process.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = None
+        self._size = 0
+        self._tags = {}
+        self._key_tags = {}
+
+    @staticmethod
+    def key(backend: str, html: str, options: dict) -> str:
+        digest = hashlib.sha256()
+        digest.update(backend.encode())
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        digest.update(html.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.pdf')
+
+    def _load(self):
+        """Indexes files left by earlier runs, oldest access first."""
+        entries = []
+        if os.path.isdir(self.directory):
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith('.pdf'):
+                        stat = os.stat(os.path.join(root, name))
+                        entries.append((stat.st_mtime, name[:-len('.pdf')], stat.st_size))
+        entries.sort()
+        self._entries = OrderedDict((key, size) for _, key, size in entries)
+        self._size = sum(self._entries.values())
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            return key in self._entries
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            if key not in self._entries:
+                return None
+            path = self._path(key)
+            try:
+                with open(path, 'rb') as f:
+                    pdf = f.read()
+                os.utime(path)
+            except OSError:
+                # Evicted by another process
+                self._size -= self._entries.pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return pdf
+
+    def put(self, key: str, pdf: bytes, tags: tuple = ()):
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(tmp_path, 'wb') as f:
+                    f.write(pdf)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                error_logger.error(f"Could not cache PDF {key}: {e}")
+                return
+            self._size += len(pdf) - self._entries.pop(key, 0)
+            self._entries[key] = len(pdf)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+                self._key_tags.setdefault(key, set()).add(tag)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_key, _ = next(iter(self._entries.items()))
+                self._remove(old_key)
+
+    def invalidate(self, tags) -> int:
+        """Removes every cached document carrying one of `tags` and returns how many were removed."""
+        removed = 0
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    if self._entries is not None and key in self._entries:
+                        self._remove(key)
+                        removed += 1
+        return removed
+
+    def _remove(self, key: str):
+        self._size -= self._entries.pop(key)
+        for tag in self._key_tags.pop(key, ()):
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries or ()),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+            }
+
+
+def _changed_tags(session) -> set:
+    """Cache tags for the invoice and attendance rows in a flush."""
+    tags = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, StudentInvoice):
+            if obj.id:
+                tags.add(invoice_tag(obj.id))
+            if obj.sales_id and obj.date:
+                tags.add(sales_month_tag(obj.sales_id, obj.date))
+        elif isinstance(obj, Attendance) and obj.date:
+            if obj.timetable is not None:
+                tags.add(teacher_month_tag(obj.timetable.teacher_id, obj.date))
+            if obj.proxy_id:
+                tags.add(teacher_month_tag(obj.proxy_id, obj.date))
+    return tags
+
+
+class PdfRenderer:
+    """
+    Renders PDFs on a bounded pool of worker threads. At most `workers`
+    documents render at once and at most `max_pending` wait behind them;
+    further requests are rejected instead of piling up converter processes.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._backend = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._in_flight = {}  # cache key -> Future of a document being rendered
+        self.cache = None
+        self._metrics = {
+            'cache_hits': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'timed_out': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0,
+            'render_time_total': 0.0,
+        }
+
+    def init_app(self, app):
+        self.app = app
+        self.backend_name = app.config.get('PDF_BACKEND', WkhtmltopdfBackend.name)
+        self.workers = app.config.get('PDF_WORKERS', 2)
+        self.max_pending = app.config.get('PDF_QUEUE_SIZE', 20)
+        self.timeout = app.config.get('PDF_TIMEOUT', 60)
+        self.request_timeout = app.config.get('PDF_REQUEST_TIMEOUT', 25)
+        self.options = app.config.get('WKHTMLTOPDF_OPTIONS', {})
+        if self.backend_name not in BACKENDS:
+            error_logger.error(f"Unknown PDF backend '{self.backend_name}', using wkhtmltopdf")
+            self.backend_name = WkhtmltopdfBackend.name
+
+        if app.config.get('PDF_CACHE_DIR'):
+            self.cache = PdfCache(app.config['PDF_CACHE_DIR'], app.config.get('PDF_CACHE_MAX_BYTES', 256 * 1024 ** 2))
+            if not event.contains(db.session, 'after_flush', self._collect_tags):
+                event.listen(db.session, 'after_flush', self._collect_tags)
+                event.listen(db.session, 'after_commit', self._invalidate_committed)
+                event.listen(db.session, 'after_rollback', self._discard_tags)
+
+    @property
+    def backend(self) -> PdfBackend:
+        if self._backend is None:
+            self._backend = BACKENDS[self.backend_name](self.app)
+        return self._backend
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='pdf')
+        return self._executor
+
+    def submit(self, html: str, options: dict = None, tags: tuple = ()):
+        """
+        Queues a document for rendering without waiting for it. Documents
+        already in the cache resolve immediately, and a document already
+        being rendered shares that render.
+
+        Args:
+            html (str): Rendered HTML of the document.
+            options (dict, optional): Backend options, defaults to WKHTMLTOPDF_OPTIONS.
+            tags (tuple, optional): Cache tags of the rows the document was built from.
+
+        Returns:
+            Future: Resolves to the PDF bytes or raises PdfRenderError.
+        """
+        options = self.options if options is None else options
+        key = None
+        if self.cache:
+            key = PdfCache.key(self.backend_name, html, options)
+            pdf = self.cache.get(key)
+            if pdf is not None:
+                with self._lock:
+                    self._metrics['cache_hits'] += 1
+                future = Future()
+                future.set_result(pdf)
+                return future
+
+        backend = self.backend
+        with self._lock:
+            if key in self._in_flight:
+                return self._in_flight[key]
+            if self._queued + self._running >= self.workers + self.max_pending:
+                self._metrics['rejected'] += 1
+                event_logger.warning(f"PDF queue full ({self.max_pending}), rejecting document")
+                raise PdfRenderError('PDF service is busy. Please try again shortly.')
+            self._queued += 1
+            future = self.executor.submit(self._render, backend, html, options, time.monotonic(), key, tags)
+            if key:
+                self._in_flight[key] = future
+
+        if key:
+            future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def _forget(self, key: str, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def status(self, html: str, options: dict = None) -> str:
+        """
+        Reports whether a document can be served without rendering it now.
+
+        Returns:
+            str: 'ready' when cached, 'rendering' while queued or rendering,
+                otherwise 'missing' (it renders on first download).
+        """
+        if not self.cache:
+            return 'missing'
+        key = PdfCache.key(self.backend_name, html, self.options if options is None else options)
+        if key in self.cache:
+            return 'ready'
+        with self._lock:
+            return 'rendering' if key in self._in_flight else 'missing'
+
+    def render(self, html: str, options: dict = None, tags: tuple = ()) -> bytes:
+        """
+        Renders a document and waits for the result, at most
+        `request_timeout` seconds so the calling request finishes within the
+        HTTP worker timeout. A document still queued or rendering by then
+        keeps going and, with the cache enabled, is served on the next try.
+
+        Args:
+            html (str): Rendered HTML of the document.
+            options (dict, optional): Backend options, defaults to WKHTMLTOPDF_OPTIONS.
+            tags (tuple, optional): Cache tags of the rows the document was built from.
+
+        Returns:
+            bytes: The PDF.
+        """
+        future = self.submit(html, options, tags)
+        try:
+            return future.result(timeout=self.request_timeout)
+        except FutureTimeoutError as e:
+            with self._lock:
+                self._metrics['timed_out'] += 1
+            raise PdfRenderError('PDF service is busy. Please try again shortly.') from e
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self._metrics['completed'] + self._metrics['failed']
+            return {
+                'backend': self.backend_name,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'queued': self._queued,
+                'running': self._running,
+                'cache_hits': self._metrics['cache_hits'],
+                'cache': self.cache.stats() if self.cache else None,
+                'completed': self._metrics['completed'],
+                'failed': self._metrics['failed'],
+                'rejected': self._metrics['rejected'],
+                'timed_out': self._metrics['timed_out'],
+                'avg_queue_wait': round(self._metrics['queue_wait_total'] / done, 3) if done else None,
+                'max_queue_wait': round(self._metrics['queue_wait_max'], 3),
+                'avg_render_time': round(self._metrics['render_time_total'] / done, 3) if done else None,
+            }
+
+    def _render(self, backend: PdfBackend, html: str, options: dict, submitted: float,
+                key: str = None, tags: tuple = ()) -> bytes:
+        started = time.monotonic()
+        queue_wait = started - submitted
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._metrics['queue_wait_total'] += queue_wait
+            self._metrics['queue_wait_max'] = max(self._metrics['queue_wait_max'], queue_wait)
+
+        failed = False
+        try:
+            pdf = backend.render(html, options, self.timeout)
+            if key:
+                self.cache.put(key, pdf, tags)
+            return pdf
+        except PdfRenderError:
+            failed = True
+            raise
+        except Exception as e:
+            failed = True
+            raise PdfRenderError(f'PDF rendering failed: {e}') from e
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._running -= 1
+                self._metrics['render_time_total'] += elapsed
+                self._metrics['failed' if failed else 'completed'] += 1
+            if failed:
+                error_logger.error(f"PDF rendering with {backend.name} failed after {elapsed:.2f}s")
+
+    def _collect_tags(self, session, flush_context):
+        session.info.setdefault('pdf_cache_tags', set()).update(_changed_tags(session))
+
+    def invalidate_on_commit(self, session, tags) -> None:
+        """Drops cached documents carrying `tags` once `session` commits, for rows changed with bulk statements."""
+        if self.cache:
+            session.info.setdefault('pdf_cache_tags', set()).update(tags)
+
+    def _invalidate_committed(self, session):
+        tags = session.info.pop('pdf_cache_tags', None)
+        if tags and self.cache:
+            self.cache.invalidate(tags)
+
+    def _discard_tags(self, session):
+        session.info.pop('pdf_cache_tags', None)
+
+
+def pdf_response(pdf: bytes, filename: str):
+    """Wraps PDF bytes in a download response."""
+    response = make_response(pdf)
+    response.headers['Content-Type'] = 'application/pdf'
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+
+pdf_renderer = PdfRenderer()
@@ -0,0 +1,192 @@
+import os
+import shutil
+import uuid
+
+from main.logger import event_logger
+from main.storage import derivatives_dir
+
+# ── main/renditions.py ───────────────────────────────────────────────────────────
+
+POSTER_NAME = 'poster.jpg'
+PREVIEW_NAME = 'preview.jpg'
+HLS_DIR = 'hls'
+MASTER_PLAYLIST = 'master.m3u8'
+RENDITION_PLAYLIST = 'index.m3u8'
+
+MIMETYPES = {
+    '.jpg': 'image/jpeg',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+}
+
+
+def _bits(rate: str) -> int:
+    """Converts an ffmpeg bitrate such as '600k' to bits per second."""
+    rate = str(rate).strip().lower()
+    multiplier = {'k': 1000, 'm': 1000 ** 2}.get(rate[-1:], 1)
+    return int(float(rate.rstrip('km')) * multiplier)
+
+
+def build_poster_cmd(source_path: str, output_path: str, offset: float, width: int) -> list[str]:
+    """Builds an ffmpeg command that grabs a single JPEG frame at `offset` seconds."""
+    return [
+        'ffmpeg', '-y', '-ss', f"{offset:.2f}", '-i', source_path,
+        '-frames:v', '1', '-vf', f"scale={width}:-2", '-q:v', '4', output_path
+    ]
+
+
+def build_preview_cmd(source_path: str, output_path: str, duration: float, frames: int, width: int) -> list[str]:
+    """
+    Builds an ffmpeg command that samples `frames` evenly spaced frames and
+    tiles them side by side into one JPEG strip.
+
+    Args:
+        source_path (str): Input video.
+        output_path (str): Output JPEG path.
+        duration (float): Length of the video in seconds.
+        frames (int): Number of thumbnails in the strip.
+        width (int): Width of each thumbnail in pixels.
+
+    Returns:
+        list[str]: The ffmpeg command.
+    """
+    return [
+        'ffmpeg', '-y', '-i', source_path,
+        '-vf', f"fps={frames}/{max(duration, 1):.2f},scale={width}:-2,tile={frames}x1",
+        '-frames:v', '1', '-q:v', '5', output_path
+    ]
+
+
+def build_hls_cmd(source_path: str, output_dir: str, rendition: dict, segment_seconds: int, threads: int = 0) -> list[str]:
+    """
+    Builds an ffmpeg command that encodes one bitrate-capped HLS rendition.
+
+    Args:
+        source_path (str): Input video.
+        output_dir (str): Folder for the rendition playlist and segments.
+        rendition (dict): Rendition with `height`, `video_bitrate` and `audio_bitrate`.
+        segment_seconds (int): Target segment length.
+        threads (int, optional): Encoder thread cap, 0 lets ffmpeg decide.
+
+    Returns:
+        list[str]: The ffmpeg command.
+    """
+    video_bitrate = rendition['video_bitrate']
+    cmd = [
+        'ffmpeg', '-y', '-i', source_path,
+        '-map', '0:v:0', '-map', '0:a:0?',
+        # Never upscale; -2 keeps the width even as required by libx264
+        '-vf', f"scale=-2:'min({rendition['height']},ih)'",
+        '-c:v', 'libx264', '-preset', 'veryfast',
+        '-b:v', video_bitrate, '-maxrate', video_bitrate, '-bufsize', f"{2 * _bits(video_bitrate)}",
+        # Key frames on segment boundaries so every segment starts cleanly
+        '-force_key_frames', f"expr:gte(t,n_forced*{segment_seconds})",
+        '-c:a', 'aac', '-b:a', rendition.get('audio_bitrate', '64k'),
+    ]
+    if threads:
+        cmd += ['-threads', str(threads)]
+    cmd += [
+        '-f', 'hls', '-hls_time', str(segment_seconds), '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(output_dir, 'segment_%04d.ts'),
+        os.path.join(output_dir, RENDITION_PLAYLIST)
+    ]
+    return cmd
+
+
+def write_master_playlist(hls_dir: str, renditions: list[dict]) -> None:
+    """Writes the HLS master playlist listing the renditions, lowest bitrate first."""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for rendition in sorted(renditions, key=lambda r: _bits(r['video_bitrate'])):
+        bandwidth = _bits(rendition['video_bitrate']) + _bits(rendition.get('audio_bitrate', '64k'))
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},NAME=\"{rendition['name']}\"")
+        lines.append(f"{rendition['name']}/{RENDITION_PLAYLIST}")
+    with open(os.path.join(hls_dir, MASTER_PLAYLIST), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def generate_derivatives(mp4_path: str, duration: float | None, settings: dict, run_ffmpeg, threads: int = 0) -> dict:
+    """
+    Produces the poster frame, preview strip and HLS renditions for a stored
+    MP4. Everything is written to a scratch folder and moved into place in one
+    step, so a half-finished set is never served. Nothing is done if the
+    derivatives already exist, e.g. for a deduplicated upload.
+
+    Args:
+        mp4_path (str): Stored MP4 to derive from.
+        duration (float | None): Length of the video in seconds, if known.
+        settings (dict): The RECORDING_DERIVATIVES configuration.
+        run_ffmpeg: Callable that runs an ffmpeg command and raises on failure.
+        threads (int, optional): Encoder thread cap for the HLS renditions.
+
+    Returns:
+        dict: Which derivatives are available.
+    """
+    target = derivatives_dir(mp4_path)
+    if os.path.isdir(target):
+        return describe_derivatives(mp4_path)
+
+    work_dir = f"{target}.{uuid.uuid4().hex}.tmp"
+    os.makedirs(work_dir)
+    try:
+        length = duration or 0
+        poster_offset = min(settings.get('poster_offset', 30), length / 2) if length else 0
+        run_ffmpeg(build_poster_cmd(
+            mp4_path, os.path.join(work_dir, POSTER_NAME), poster_offset, settings.get('poster_width', 640)
+        ))
+
+        if length and settings.get('preview_frames'):
+            run_ffmpeg(build_preview_cmd(
+                mp4_path, os.path.join(work_dir, PREVIEW_NAME), length,
+                settings['preview_frames'], settings.get('preview_width', 160)
+            ))
+
+        renditions = settings.get('hls_renditions') or []
+        if renditions:
+            hls_dir = os.path.join(work_dir, HLS_DIR)
+            for rendition in renditions:
+                output_dir = os.path.join(hls_dir, rendition['name'])
+                os.makedirs(output_dir)
+                run_ffmpeg(build_hls_cmd(
+                    mp4_path, output_dir, rendition, settings.get('hls_segment_seconds', 6), threads
+                ))
+            write_master_playlist(hls_dir, renditions)
+
+        os.replace(work_dir, target)
+    finally:
+        if os.path.isdir(work_dir):
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    event_logger.info(f"Generated derivatives for {os.path.basename(mp4_path)}")
+    return describe_derivatives(mp4_path)
+
+
+def describe_derivatives(mp4_path: str) -> dict:
+    """Lists the derivatives stored for an MP4 as paths relative to their folder."""
+    target = derivatives_dir(mp4_path)
+    return {
+        'poster': POSTER_NAME if os.path.exists(os.path.join(target, POSTER_NAME)) else None,
+        'preview': PREVIEW_NAME if os.path.exists(os.path.join(target, PREVIEW_NAME)) else None,
+        'hls': f"{HLS_DIR}/{MASTER_PLAYLIST}" if os.path.exists(os.path.join(target, HLS_DIR, MASTER_PLAYLIST)) else None,
+    }
+
+
+def move_derivatives(old_mp4_path: str, new_mp4_path: str) -> None:
+    """Moves the derivatives of an MP4 along with it."""
+    source = derivatives_dir(old_mp4_path)
+    if os.path.isdir(source):
+        os.makedirs(os.path.dirname(new_mp4_path), exist_ok=True)
+        os.replace(source, derivatives_dir(new_mp4_path))
+
+
+def remove_derivatives(mp4_path: str) -> int:
+    """Deletes the derivatives of an MP4 and returns the bytes reclaimed."""
+    target = derivatives_dir(mp4_path)
+    if not os.path.isdir(target):
+        return 0
+    reclaimed = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(target)
+        for name in names
+    )
+    shutil.rmtree(target, ignore_errors=True)
+    return reclaimed
@@ -0,0 +1,253 @@
+import os
+import re
+from datetime import date, datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from main.extensions import db
+from main.logger import event_logger, error_logger
+from main.models import Attendance, Timetable, Recording
+from main.storage import LEGACY_OBJECTS_DIR, INCOMING_DIR, RECORDINGS_DIR, recording_path, hash_file
+from main.renditions import move_derivatives, remove_derivatives
+from main.transcode import transcode_queue, build_transcode_cmd
+
+# ── main/retention.py ────────────────────────────────────────────────────────────
+
+# Per-lecture folders written before recordings were content addressed,
+# e.g. proxy_10_Maths_2025-06-16_4_0930
+LEGACY_DIR_PATTERN = re.compile(
+    r'^(?P<proxy>proxy_)?(?P<grade>[^_]+)_(?P<subject>.+)_(?P<date>\d{4}-\d{2}-\d{2})_(?P<teacher_id>\d+)_(?P<hhmm>\d{4})$'
+)
+RESERVED_DIRS = {LEGACY_OBJECTS_DIR, INCOMING_DIR, RECORDINGS_DIR, '.sessions'}
+
+
+def _absolute(path: str) -> str:
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], path)
+
+
+def _relative(path: str) -> str:
+    return os.path.relpath(path, current_app.config['UPLOAD_FOLDER'])
+
+
+def _size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _move_object(sha256: str, old_path: str, stored_on: date, dry_run: bool) -> str:
+    """Moves a stored file into the sharded layout and repoints every row sharing it."""
+    new_path = recording_path(current_app.config['UPLOAD_FOLDER'], sha256, stored_on)
+    if not dry_run:
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        os.replace(old_path, new_path)
+        move_derivatives(old_path, new_path)
+        Recording.query.filter_by(sha256=sha256).update({'path': _relative(new_path)}, synchronize_session=False)
+    return new_path
+
+
+def compact_recordings(batch: int = 200, dry_run: bool = False) -> dict:
+    """
+    Moves up to `batch` recordings from older layouts into the sharded
+    recordings/<yyyy>/<mm>/<aa>/ layout. Catalogued files under objects/ are
+    moved first, then legacy per-lecture folders are hashed, catalogued and
+    moved. Safe to run repeatedly; each run continues where the last stopped.
+
+    Args:
+        batch (int): Maximum number of files to move in this run.
+        dry_run (bool): Report what would change without touching anything.
+
+    Returns:
+        dict: Counts of moved, imported and skipped files.
+    """
+    report = {'moved': 0, 'imported': 0, 'skipped': 0}
+
+    # 1. Catalogued files still in the flat objects/<aa>/ layout
+    legacy_objects = (
+        db.session.query(Recording.sha256, Recording.path, func.min(Recording.created_at))
+        .filter(Recording.path.like(f'{LEGACY_OBJECTS_DIR}/%'), Recording.status.in_(('ready', 'archived')))
+        .group_by(Recording.sha256, Recording.path)
+        .limit(batch)
+        .all()
+    )
+    for sha256, path, created_at in legacy_objects:
+        old_path = _absolute(path)
+        if not os.path.exists(old_path):
+            # Flag it so later runs do not keep picking it up
+            if not dry_run:
+                Recording.query.filter_by(sha256=sha256).update({'status': 'missing'}, synchronize_session=False)
+            report['skipped'] += 1
+            continue
+        _move_object(sha256, old_path, (created_at or datetime.utcnow()).date(), dry_run)
+        report['moved'] += 1
+    if not dry_run:
+        db.session.commit()
+
+    # 2. Uncatalogued per-lecture folders from before the catalog existed
+    remaining = batch - report['moved']
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if remaining <= 0:
+                break
+            if not entry.is_dir() or entry.name in RESERVED_DIRS:
+                continue
+            match = LEGACY_DIR_PATTERN.match(entry.name)
+            if not match:
+                continue
+            if _import_legacy_dir(entry.path, match, dry_run):
+                report['imported'] += 1
+                remaining -= 1
+            else:
+                report['skipped'] += 1
+
+    event_logger.info(f"Recording compaction{' (dry run)' if dry_run else ''}: {report}")
+    return report
+
+
+def _import_legacy_dir(folder: str, match: re.Match, dry_run: bool) -> bool:
+    """Catalogues the MP4 in a legacy per-lecture folder and moves it into the store."""
+    base_name = os.path.basename(folder)
+    if match.group('proxy'):
+        base_name = base_name[len('proxy_'):]
+    video = os.path.join(folder, base_name + '.mp4')
+    if not os.path.exists(video):
+        return False
+
+    start_time = time(int(match.group('hhmm')[:2]), int(match.group('hhmm')[2:]))
+    lecture_date = date.fromisoformat(match.group('date'))
+    attendance = (
+        Attendance.query.join(Timetable)
+        .filter(
+            Attendance.date == lecture_date,
+            Timetable.teacher_id == int(match.group('teacher_id')),
+            Timetable.grade == match.group('grade'),
+            Timetable.subject == match.group('subject'),
+            Timetable.start_time == start_time
+        )
+        .first()
+    )
+    if not attendance or attendance.recording:
+        return False
+    if dry_run:
+        return True
+
+    # Only the converted file survives for legacy lectures, so it is hashed instead of the upload
+    sha256 = hash_file(video)
+    new_path = _move_object(sha256, video, lecture_date, dry_run)
+    db.session.add(Recording(
+        attendance_id=attendance.id,
+        teacher_id=attendance.proxy_id if attendance.is_proxy and attendance.proxy_id else attendance.timetable.teacher_id,
+        date=lecture_date,
+        grade=attendance.timetable.grade,
+        subject=attendance.timetable.subject,
+        path=_relative(new_path),
+        sha256=sha256,
+        size=_size(new_path),
+        codec='h264',
+        mode='transcode',
+        status='ready',
+    ))
+    db.session.commit()
+
+    if not os.listdir(folder):
+        os.rmdir(folder)
+    return True
+
+
+def apply_retention(batch: int = 50, dry_run: bool = False) -> dict:
+    """
+    Applies RECORDING_RETENTION to stored files, oldest first and at most
+    `batch` files per step. A file shared by several lectures is only
+    touched once its newest lecture passes the age limit.
+
+    Files older than `reencode_after_days` are re-encoded with the
+    `reencode_profile` transcoding profile and marked archived. When
+    `delete_after_days` is set, files older than that are removed along with
+    their HLS renditions and thumbnails and marked deleted, keeping the
+    catalog row for auditing.
+
+    Args:
+        batch (int): Maximum number of files per step.
+        dry_run (bool): Report what would change without touching anything.
+
+    Returns:
+        dict: Counts of re-encoded and deleted files and bytes reclaimed.
+    """
+    policy = current_app.config.get('RECORDING_RETENTION', {})
+    report = {'reencoded': 0, 'deleted': 0, 'failed': 0, 'bytes_reclaimed': 0}
+    today = date.today()
+    deleted = set()
+
+    delete_after = policy.get('delete_after_days')
+    if delete_after:
+        cutoff = today - timedelta(days=delete_after)
+        for sha256, path in _expired(cutoff, ('ready', 'archived'), batch):
+            report['bytes_reclaimed'] += _size(_absolute(path))
+            report['deleted'] += 1
+            deleted.add(sha256)
+            if dry_run:
+                continue
+            if os.path.exists(_absolute(path)):
+                os.remove(_absolute(path))
+            report['bytes_reclaimed'] += remove_derivatives(_absolute(path))
+            Recording.query.filter_by(sha256=sha256).update({'status': 'deleted'}, synchronize_session=False)
+            db.session.commit()
+
+    reencode_after = policy.get('reencode_after_days')
+    profile = current_app.config.get('TRANSCODE_PROFILES', {}).get(policy.get('reencode_profile'))
+    if reencode_after and profile:
+        cutoff = today - timedelta(days=reencode_after)
+        for sha256, path in _expired(cutoff, ('ready',), batch):
+            source = _absolute(path)
+            if sha256 in deleted:
+                continue
+            if dry_run:
+                report['reencoded'] += 1
+                continue
+            if not os.path.exists(source):
+                continue
+            try:
+                reclaimed = _reencode(source, profile)
+            except Exception as e:
+                error_logger.error(f"Retention re-encode failed for {path}: {e}", exc_info=True)
+                report['failed'] += 1
+                continue
+            Recording.query.filter_by(sha256=sha256).update(
+                {'status': 'archived', 'size': _size(source)}, synchronize_session=False
+            )
+            db.session.commit()
+            report['reencoded'] += 1
+            report['bytes_reclaimed'] += reclaimed
+
+    event_logger.info(f"Recording retention{' (dry run)' if dry_run else ''}: {report}")
+    return report
+
+
+def _expired(cutoff: date, statuses: tuple, batch: int) -> list:
+    """Returns (sha256, path) of stored files whose newest lecture is before `cutoff`."""
+    return (
+        db.session.query(Recording.sha256, func.min(Recording.path))
+        .filter(Recording.status.in_(statuses))
+        .group_by(Recording.sha256)
+        .having(func.max(Recording.date) < cutoff)
+        .order_by(func.max(Recording.date))
+        .limit(batch)
+        .all()
+    )
+
+
+def _reencode(path: str, profile: dict) -> int:
+    """Re-encodes a file in place, keeping the original if the result is not smaller."""
+    work_path = path[:-len('.mp4')] + '.retention.tmp.mp4'
+    threads = current_app.config.get('TRANSCODE_THREADS', 0)
+    try:
+        transcode_queue.run_ffmpeg(build_transcode_cmd(path, work_path, profile, threads))
+        before, after = _size(path), _size(work_path)
+        if after >= before:
+            os.remove(work_path)
+            return 0
+        os.replace(work_path, path)
+        return before - after
+    finally:
+        if os.path.exists(work_path):
+            os.remove(work_path)
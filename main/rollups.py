@@ -0,0 +1,296 @@
+from datetime import date
+
+from sqlalchemy import bindparam, delete, event, func, insert, select, update
+
+from main.analytics import COUNTERS, teacher_lectures, lecture_counts
+from main.extensions import db
+from main.logger import event_logger, error_logger
+from main.models import Attendance, Timetable, StudentInvoice, TeacherMonthRollup, SalesMonthRollup
+from main.snapshots import month_start, insert_missing, edited_slots, slot_lectures
+from main.utils import util_month_range
+
+# ── main/rollups.py ──────────────────────────────────────────────────────────────
+
+# Monthly counters behind the analytics pages. Like the TeacherInvoice
+# snapshots they are adjusted inside the flush that changes attendance,
+# timetable slots or student invoices, so they commit or roll back together
+# with it.
+
+TEACHER_KEY = ('teacher_id', 'month', 'subject', 'grade', 'day_of_week')
+SALES_KEY = ('sales_id', 'month')
+
+
+def _teacher_counts(teacher_id, assigned_id, proxy_id, is_proxy, is_present) -> tuple[int, ...]:
+    """One lecture's contribution to a teacher's COUNTERS, mirroring `analytics.lecture_counts`."""
+    is_proxy, is_present = bool(is_proxy), bool(is_present)
+    held_as_proxy = is_proxy and proxy_id == teacher_id
+    held_as_assigned = not is_proxy and assigned_id == teacher_id
+    absent = assigned_id == teacher_id and is_proxy and proxy_id != teacher_id
+    held = is_present and (held_as_proxy or held_as_assigned)
+    return 1, int(held_as_proxy), int(held_as_assigned), int(absent), int(held)
+
+
+def _add(deltas: dict, key: tuple, values: tuple, sign: int) -> None:
+    current = deltas.get(key, (0,) * len(values))
+    deltas[key] = tuple(a + sign * b for a, b in zip(current, values))
+
+
+def _add_lecture(deltas: dict, timetable, day, is_present, is_proxy, proxy_id, sign: int) -> None:
+    """Adds (or with sign -1 removes) one attendance row's counts for every teacher it concerns."""
+    if timetable is None or day is None:
+        return
+    teacher_ids = {timetable.teacher_id}
+    if proxy_id is not None:
+        teacher_ids.add(proxy_id)
+    for teacher_id in teacher_ids:
+        key = (teacher_id, month_start(day), timetable.subject, timetable.grade, timetable.day_of_week)
+        _add(deltas, key, _teacher_counts(teacher_id, timetable.teacher_id, proxy_id, is_proxy, is_present), sign)
+
+
+def _stored_rows(connection, table, columns: list[str], ids: list[int]) -> dict:
+    if not ids:
+        return {}
+    return {
+        row.id: row for row in connection.execute(
+            select(table.c.id, *(table.c[name] for name in columns)).where(table.c.id.in_(ids))
+        ).all()
+    }
+
+
+def _collect_deltas(session, flush_context, instances):
+    """
+    Records the rollup changes implied by the attendance and student invoice
+    rows about to flush, and by timetable slots whose teacher, subject, grade
+    or weekday is edited or that are deleted.
+    """
+    lectures, invoices, slots_changed = [], [], False
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Attendance):
+            lectures.append(obj)
+        elif isinstance(obj, StudentInvoice):
+            invoices.append(obj)
+        elif isinstance(obj, Timetable):
+            slots_changed = True
+    if not lectures and not invoices and not slots_changed:
+        return
+
+    # Stored rows are read back because attribute history has no old value
+    # for attributes that were expired when they were set
+    connection = session.connection()
+
+    def persistent_ids(objs):
+        return [obj.id for obj in objs if obj not in session.new and obj.id is not None]
+
+    # Lectures of an edited slot were counted under its stored values and move to the new ones
+    slots = edited_slots(session, connection) if slots_changed else {}
+    current = {timetable_id: obj for timetable_id, (_, obj) in slots.items()}
+
+    if lectures or slots:
+        stored = _stored_rows(
+            connection, Attendance.__table__,
+            ['timetable_id', 'date', 'is_present', 'is_proxy', 'proxy_id'], persistent_ids(lectures)
+        )
+        timetable_ids = {obj.timetable_id for obj in lectures} | {row.timetable_id for row in stored.values()}
+        timetable_ids.discard(None)
+        table = Timetable.__table__
+        timetables = {
+            row.id: row for row in connection.execute(
+                select(table.c.id, table.c.teacher_id, table.c.subject, table.c.grade, table.c.day_of_week)
+                .where(table.c.id.in_(timetable_ids))
+            ).all()
+        } if timetable_ids else {}
+        timetables.update({timetable_id: row for timetable_id, (row, _) in slots.items()})
+
+        def now(timetable_id):
+            return current[timetable_id] if timetable_id in current else timetables.get(timetable_id)
+
+        deltas = session.info.setdefault('teacher_rollup_deltas', {})
+        for obj in lectures:
+            row = stored.get(obj.id)
+            if row is not None:
+                _add_lecture(deltas, timetables.get(row.timetable_id), row.date, row.is_present, row.is_proxy, row.proxy_id, -1)
+            if obj not in session.deleted:
+                _add_lecture(deltas, now(obj.timetable_id), obj.date, obj.is_present, obj.is_proxy, obj.proxy_id, 1)
+
+        for row in slot_lectures(connection, list(slots), persistent_ids(lectures)):
+            _add_lecture(deltas, timetables.get(row.timetable_id), row.date, row.is_present, row.is_proxy, row.proxy_id, -1)
+            _add_lecture(deltas, now(row.timetable_id), row.date, row.is_present, row.is_proxy, row.proxy_id, 1)
+
+    if invoices:
+        stored = _stored_rows(connection, StudentInvoice.__table__, ['sales_id', 'date', 'fees_paid'], persistent_ids(invoices))
+        deltas = session.info.setdefault('sales_rollup_deltas', {})
+        for obj in invoices:
+            row = stored.get(obj.id)
+            if row is not None and row.sales_id is not None and row.date is not None:
+                _add(deltas, (row.sales_id, month_start(row.date)), (1, row.fees_paid or 0.0), -1)
+            if obj not in session.deleted and obj.sales_id is not None and obj.date is not None:
+                _add(deltas, (obj.sales_id, month_start(obj.date)), (1, obj.fees_paid or 0.0), 1)
+
+
+def _apply(connection, table, key_columns: tuple, value_columns: tuple, deltas: dict) -> None:
+    """Creates missing rollup rows, then adds the deltas with one relative UPDATE per row."""
+    deltas = {key: values for key, values in deltas.items() if any(values)}
+    if not deltas:
+        return
+
+    zeros = {name: 0 for name in value_columns}
+    insert_missing(connection, table, [dict(zip(key_columns, key), **zeros) for key in deltas], list(key_columns))
+    # Relative updates, so concurrent flushes for the same row do not lose counts
+    connection.execute(
+        update(table)
+        .where(*(table.c[name] == bindparam(f'b_{name}') for name in key_columns))
+        .values({name: table.c[name] + bindparam(f'd_{name}') for name in value_columns}),
+        [
+            {
+                **{f'b_{name}': value for name, value in zip(key_columns, key)},
+                **{f'd_{name}': value for name, value in zip(value_columns, values)},
+            }
+            for key, values in deltas.items()
+        ]
+    )
+
+
+def _apply_deltas(session, flush_context):
+    """Adds the recorded deltas to the rollup rows within the flush's transaction."""
+    teacher_deltas = session.info.pop('teacher_rollup_deltas', None)
+    sales_deltas = session.info.pop('sales_rollup_deltas', None)
+    # Cached analytics covering these months are dropped once the transaction commits
+    if teacher_deltas or sales_deltas:
+        months = session.info.setdefault('analytics_months', set())
+        months.update(key[1] for key in (*(teacher_deltas or ()), *(sales_deltas or ())))
+    if teacher_deltas:
+        _apply(session.connection(), TeacherMonthRollup.__table__, TEACHER_KEY, COUNTERS, teacher_deltas)
+    if sales_deltas:
+        _apply(session.connection(), SalesMonthRollup.__table__, SALES_KEY, ('invoices', 'total_amount'), sales_deltas)
+
+
+def add_sales_payment(session, sales_id: int, day: date, amount: float) -> None:
+    """
+    Adds a payment made with a relative UPDATE of StudentInvoice.fees_paid,
+    which the flush events never see, to the sales rollup of its month.
+    """
+    month = month_start(day)
+    _apply(session.connection(), SalesMonthRollup.__table__, SALES_KEY, ('invoices', 'total_amount'), {(sales_id, month): (0, amount)})
+    session.info.setdefault('analytics_months', set()).add(month)
+
+
+def add_materialized_lectures(session, lectures: list[tuple]) -> None:
+    """
+    Adds attendance rows created by the bulk insert in
+    `attendance.materialize_attendance`, which the flush events never see,
+    to the teacher rollups. `lectures` holds a (timetable, date) pair per row
+    actually inserted; the rows are unmarked, so each counts as a scheduled
+    lecture of the assigned teacher.
+    """
+    deltas = {}
+    for timetable, day in lectures:
+        _add_lecture(deltas, timetable, day, False, False, None, 1)
+    _apply(session.connection(), TeacherMonthRollup.__table__, TEACHER_KEY, COUNTERS, deltas)
+    session.info.setdefault('analytics_months', set()).update(key[1] for key in deltas)
+
+
+def _discard_deltas(session):
+    session.info.pop('teacher_rollup_deltas', None)
+    session.info.pop('sales_rollup_deltas', None)
+
+
+def init_app(app):
+    """Keeps the analytics rollups in step with attendance, timetable and student invoice changes made through the ORM."""
+    if not event.contains(db.session, 'after_flush', _apply_deltas):
+        event.listen(db.session, 'before_flush', _collect_deltas)
+        event.listen(db.session, 'after_flush', _apply_deltas)
+        event.listen(db.session, 'after_rollback', _discard_deltas)
+
+
+def _months(start: date, end: date) -> list[date]:
+    months = []
+    month = month_start(start)
+    while month < end:
+        months.append(month)
+        month = util_month_range(month.year, month.month)[1]
+    return months
+
+
+def _rebuild_month(month: date) -> tuple[int, int]:
+    """Replaces the rollup rows of one month with counts recomputed from the raw tables."""
+    start, end = util_month_range(month.year, month.month)
+    connection = db.session.connection()
+
+    lectures = teacher_lectures(start, end)
+    c = lectures.c
+    teacher_rows = [
+        {'teacher_id': row.teacher_id, 'month': start, 'subject': row.subject, 'grade': row.grade,
+         'day_of_week': row.day_of_week, **{name: int(getattr(row, name) or 0) for name in COUNTERS}}
+        for row in connection.execute(
+            select(c.teacher_id, c.subject, c.grade, c.day_of_week, *lecture_counts(lectures))
+            .group_by(c.teacher_id, c.subject, c.grade, c.day_of_week)
+        ).all()
+        if row.teacher_id is not None
+    ]
+    sales_rows = [
+        {'sales_id': row.sales_id, 'month': start, 'invoices': row.invoices, 'total_amount': row.total_amount or 0.0}
+        for row in connection.execute(
+            select(
+                StudentInvoice.sales_id,
+                func.count(StudentInvoice.id).label('invoices'),
+                func.sum(StudentInvoice.fees_paid).label('total_amount')
+            )
+            .where(StudentInvoice.date >= start, StudentInvoice.date < end)
+            .group_by(StudentInvoice.sales_id)
+        ).all()
+    ]
+
+    connection.execute(delete(TeacherMonthRollup.__table__).where(TeacherMonthRollup.month == start))
+    connection.execute(delete(SalesMonthRollup.__table__).where(SalesMonthRollup.month == start))
+    if teacher_rows:
+        connection.execute(insert(TeacherMonthRollup.__table__), teacher_rows)
+    if sales_rows:
+        connection.execute(insert(SalesMonthRollup.__table__), sales_rows)
+    db.session.info.setdefault('analytics_months', set()).add(start)
+    return len(teacher_rows), len(sales_rows)
+
+
+def backfill_rollups(start: date = None, end: date = None, progress=None) -> dict:
+    """
+    Rebuilds the analytics rollups from attendance and student invoices, one
+    month per transaction. Needed after upgrading and after bulk changes made
+    outside the ORM.
+
+    Args:
+        start (date, optional): A day in the first month to rebuild. Defaults to the oldest data.
+        end (date, optional): Day after the last one to include. Defaults to the newest data.
+        progress (callable, optional): Called as progress(month, teacher_rows, sales_rows).
+
+    Returns:
+        dict: Number of months rebuilt and rollup rows written.
+    """
+    if start is None or end is None:
+        bounds = [
+            value for value in (
+                *db.session.query(func.min(Attendance.date), func.max(Attendance.date)).one(),
+                *db.session.query(func.min(StudentInvoice.date), func.max(StudentInvoice.date)).one(),
+            )
+            if value is not None
+        ]
+        if not bounds:
+            return {'months': 0, 'teacher_rows': 0, 'sales_rows': 0}
+        start = start or min(bounds)
+        end = end or util_month_range(max(bounds).year, max(bounds).month)[1]
+
+    report = {'months': 0, 'teacher_rows': 0, 'sales_rows': 0}
+    for month in _months(start, end):
+        try:
+            teacher_rows, sales_rows = _rebuild_month(month)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            error_logger.error(f"Rollup backfill for {month:%Y-%m} failed: {e}", exc_info=True)
+            raise
+        report['months'] += 1
+        report['teacher_rows'] += teacher_rows
+        report['sales_rows'] += sales_rows
+        if progress:
+            progress(month, teacher_rows, sales_rows)
+
+    event_logger.info(f"Backfilled analytics rollups: {report}")
+    return report
@@ -1,7 +1,18 @@
-from flask import Blueprint, request, session, render_template, redirect, url_for, jsonify
-from main.models import Timetable, Teacher, Admin, Attendance, StudentInvoice, Sales
-from main.utils import util_db_add, util_db_update, util_db_delete, generate_password_hash, login_required
+import os
+from datetime import datetime, timedelta
+
+from flask import Blueprint, request, session, render_template, redirect, url_for, jsonify, current_app, send_file, send_from_directory, make_response
+from main.models import Timetable, Teacher, Admin, Attendance, Student, StudentInvoice, Sales, Recording, TeacherInvoice
+from main.utils import util_db_add, util_db_update, util_db_delete, generate_password_hash, login_required, util_month_range
 from main.extensions import db
+from main.attendance import invalidate_materialized
+from main.transcode import transcode_queue
+from main.pdf import pdf_renderer
+from main.payroll import start_payroll_run, get_payroll_run, archive_path
+from main.analytics import teacher_rollup_analytics, sales_rollup_totals, teacher_series, sales_series, analytics_cache
+from main.columnar import attendance_columns
+from main.storage import derivatives_dir
+from main.renditions import MIMETYPES, describe_derivatives
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -380,6 +391,7 @@ def create_timetable():
     result = util_db_add(new_entry)
     if not result.get('success'):
         return jsonify({'success': False, 'error': 'Creation failed'}), 500
+    invalidate_materialized()
         
     return jsonify({ 'success': True, 'data': new_entry.to_dict()}), 200
 
@@ -402,6 +414,7 @@ def modify_entry():
         result = util_db_delete(entry)
         if not result.get('success'):
             return jsonify({'success': False, 'error': 'Deletion failed'}), 500
+        invalidate_materialized()
         return jsonify({'success': True}), 200
 
     # PUT → update
@@ -421,8 +434,249 @@ def modify_entry():
     result = util_db_update()
     if not result.get('success'):
         return jsonify({'success': False, 'error': 'Update failed'}), 500
+    invalidate_materialized()
     return jsonify({'success': True, 'entry': entry.to_dict()}), 200
 
+@admin_bp.route('/transcode/stats')
+@login_required
+def transcode_stats():
+    user = session.get('user')
+    if not user or user.get('role') != 'admin':
+        return redirect(url_for('index.login'))
+
+    return jsonify({'success': True, 'stats': transcode_queue.stats()}), 200
+
+@admin_bp.route('/pdf/stats')
+@login_required
+def pdf_stats():
+    user = session.get('user')
+    if not user or user.get('role') != 'admin':
+        return redirect(url_for('index.login'))
+
+    return jsonify({'success': True, 'stats': pdf_renderer.stats()}), 200
+
+@admin_bp.route('/payroll', methods=['POST'])
+@login_required
+def start_payroll():
+    user = session.get('user')
+    if not user or user.get('role') != 'admin':
+        return redirect(url_for('index.login'))
+
+    data = request.get_json(silent=True) or request.form
+    try:
+        year = int(data.get('year'))
+        month = int(data.get('month'))
+        if not 1 <= month <= 12:
+            raise ValueError()
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'A valid year and month are required'}), 400
+
+    run = start_payroll_run(year, month)
+    return jsonify({
+        'success': True,
+        'run': run,
+        'status_url': url_for('admin.payroll_status', run_id=run['id'])
+    }), 202
+
+@admin_bp.route('/payroll/summary')
+@login_required
+def payroll_summary():
+    user = session.get('user')
+    if not user or user.get('role') != 'admin':
+        return redirect(url_for('index.login'))
+
+    now = datetime.now()
+    year = request.args.get('year', now.year, type=int)
+    month = request.args.get('month', now.month, type=int)
+    if not 1 <= month <= 12:
+        return jsonify({'success': False, 'error': 'Invalid month'}), 400
+
+    # Running totals kept by main.snapshots, one row per teacher
+    rows = (
+        db.session.query(TeacherInvoice, Teacher.name)
+        .join(Teacher, Teacher.id == TeacherInvoice.teacher_id)
+        .filter(TeacherInvoice.date == util_month_range(year, month)[0])
+        .order_by(Teacher.name)
+        .all()
+    )
+    teachers = [
+        {
+            'teacher_id': invoice.teacher_id,
+            'name': name,
+            'total_lectures': invoice.total_lectures,
+            'total_amount': invoice.total_amount,
+        }
+        for invoice, name in rows
+    ]
+    return jsonify({
+        'success': True,
+        'year': year,
+        'month': month,
+        'teachers': teachers,
+        'total_lectures': sum(row['total_lectures'] for row in teachers),
+        'total_amount': sum(row['total_amount'] for row in teachers),
+    }), 200
+
+@admin_bp.route('/payroll/<run_id>')
+@login_required
+def payroll_status(run_id):
+    user = session.get('user')
+    if not user or user.get('role') != 'admin':
+        return redirect(url_for('index.login'))
+
+    run = get_payroll_run(run_id)
+    if not run:
+        return jsonify({'success': False, 'error': 'Payroll run not found'}), 404
+    response = {'success': True, 'run': run}
+    if run['status'] == 'done' or (run['result'] and 'failed' in run['result']):
+        response['download_url'] = url_for('admin.download_payroll', year=run['year'], month=run['month'])
+    return jsonify(response), 200
+
+@admin_bp.route('/payroll/<int:year>/<int:month>.zip')
+@login_required
+def download_payroll(year, month):
+    user = session.get('user')
+    if not user or user.get('role') != 'admin':
+        return redirect(url_for('index.login'))
+
+    path = archive_path(year, month)
+    if not os.path.exists(path):
+        return jsonify({'success': False, 'error': 'No payroll archive for this month'}), 404
+    return send_file(path, mimetype='application/zip', as_attachment=True, download_name=os.path.basename(path))
+
+@admin_bp.route('/recordings')
+@login_required
+def search_recordings():
+    user = session.get('user')
+    if not user or user.get('role') != 'admin':
+        return redirect(url_for('index.login'))
+
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', 50)), 1), 200)
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+        teacher_id = int(request.args['teacher_id']) if request.args.get('teacher_id') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid search parameters'}), 400
+
+    query = db.session.query(Recording, Teacher.name).join(Teacher, Teacher.id == Recording.teacher_id)
+    if teacher_id:
+        query = query.filter(Recording.teacher_id == teacher_id)
+    if request.args.get('grade'):
+        query = query.filter(Recording.grade == request.args['grade'].strip())
+    if request.args.get('subject'):
+        query = query.filter(Recording.subject == request.args['subject'].strip())
+    if request.args.get('status'):
+        query = query.filter(Recording.status == request.args['status'].strip())
+    if request.args.get('sha256'):
+        query = query.filter(Recording.sha256 == request.args['sha256'].strip().lower())
+    if date_from:
+        query = query.filter(Recording.date >= date_from)
+    if date_to:
+        query = query.filter(Recording.date <= date_to)
+
+    rows = (
+        query.order_by(Recording.date.desc(), Recording.id.desc())
+        .offset((page - 1) * per_page)
+        .limit(per_page + 1)
+        .all()
+    )
+
+    recordings = []
+    for recording, teacher_name in rows[:per_page]:
+        data = recording.to_dict()
+        data['date'] = recording.date.isoformat()
+        data['teacher_name'] = teacher_name
+        recordings.append(data)
+
+    return jsonify({
+        'success': True,
+        'recordings': recordings,
+        'page': page,
+        'per_page': per_page,
+        'has_more': len(rows) > per_page
+    }), 200
+
+@admin_bp.route('/recordings/<int:recording_id>/stream')
+@login_required
+def stream_recording(recording_id):
+    user = session.get('user')
+    if not user or user.get('role') != 'admin':
+        return redirect(url_for('index.login'))
+
+    recording = Recording.query.get_or_404(recording_id)
+    if recording.status not in ('ready', 'archived'):
+        return jsonify({'success': False, 'error': f'Recording is {recording.status}'}), 410
+
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], recording.path)
+    if not os.path.exists(path):
+        return jsonify({'success': False, 'error': 'Recording file not found'}), 404
+
+    stat = os.stat(path)
+    # Retention can re-encode a file in place, so the size is part of the tag
+    etag = f"{recording.sha256}-{stat.st_size}"
+    mode = current_app.config.get('RECORDING_SENDFILE')
+
+    if mode in ('nginx', 'sendfile'):
+        # Let the web server serve the bytes (including ranges) from the file
+        response = make_response('')
+        if mode == 'nginx':
+            prefix = current_app.config['RECORDING_ACCEL_PREFIX'].rstrip('/')
+            response.headers['X-Accel-Redirect'] = prefix + '/' + recording.path.replace(os.sep, '/')
+        else:
+            response.headers['X-Sendfile'] = path
+        response.headers['Content-Type'] = 'video/mp4'
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.set_etag(etag)
+        response.last_modified = datetime.utcfromtimestamp(stat.st_mtime)
+        return response.make_conditional(request)
+
+    # send_file answers Range requests with 206 and handles If-None-Match/If-Modified-Since
+    return send_file(
+        path,
+        mimetype='video/mp4',
+        conditional=True,
+        etag=etag,
+        last_modified=stat.st_mtime,
+        max_age=current_app.config.get('RECORDING_CACHE_MAX_AGE', 3600)
+    )
+
+@admin_bp.route('/recordings/<int:recording_id>/derivatives')
+@admin_bp.route('/recordings/<int:recording_id>/derivatives/<path:name>')
+@login_required
+def recording_derivatives(recording_id, name=None):
+    user = session.get('user')
+    if not user or user.get('role') != 'admin':
+        return redirect(url_for('index.login'))
+
+    recording = Recording.query.get_or_404(recording_id)
+    if recording.status not in ('ready', 'archived'):
+        return jsonify({'success': False, 'error': f'Recording is {recording.status}'}), 410
+
+    mp4_path = os.path.join(current_app.config['UPLOAD_FOLDER'], recording.path)
+    if name is None:
+        # Index of what is available, as URLs the player can load directly
+        available = describe_derivatives(mp4_path)
+        return jsonify({
+            'success': True,
+            'derivatives': {
+                kind: url_for('admin.recording_derivatives', recording_id=recording.id, name=path) if path else None
+                for kind, path in available.items()
+            }
+        }), 200
+
+    # Playlists reference segments by relative path, so they are served from the same folder
+    return send_from_directory(
+        derivatives_dir(mp4_path),
+        name,
+        mimetype=MIMETYPES.get(os.path.splitext(name)[1].lower()),
+        conditional=True,
+        max_age=current_app.config.get('RECORDING_CACHE_MAX_AGE', 3600)
+    )
+
 @admin_bp.route('/teacher-analytics')
 @login_required
 def teacher_analytics():
@@ -430,106 +684,16 @@ def teacher_analytics():
     if not user or user.get('role') != 'admin':
         return redirect(url_for('index.login'))
         
-    from datetime import datetime, timedelta
-    from sqlalchemy import func, and_, or_
-    
     # Get all active teachers
     teachers = Teacher.query.filter_by(is_active=True).all()
-    analytics = []
     
     # Get selected month and year from query params
     selected_month = request.args.get('month', datetime.now().month)
     selected_year = request.args.get('year', datetime.now().year)
+    start_date, end_date = util_month_range(int(selected_year), int(selected_month))
     
-    for teacher in teachers:
-        # Get all attendance records for this teacher
-        attendance_records = Attendance.query.join(Timetable).filter(
-            or_(
-                Timetable.teacher_id == teacher.id,
-                Attendance.proxy_id == teacher.id
-            ),
-            db.extract('month', Attendance.date) == int(selected_month),
-            db.extract('year', Attendance.date) == int(selected_year)
-        ).all()
-        
-        # Calculate metrics
-        total_classes = len(attendance_records)
-        proxy_classes = sum(1 for record in attendance_records if record.is_proxy and record.proxy_id == teacher.id)
-        regular_classes = sum(1 for record in attendance_records if not record.is_proxy and record.timetable.teacher_id == teacher.id)
-        absent_classes = sum(1 for record in attendance_records 
-            if record.timetable.teacher_id == teacher.id 
-            and record.is_proxy 
-            and record.proxy_id != teacher.id
-        )
-        
-        # Get monthly earnings
-        monthly_earnings = sum(
-            teacher.pay_per_lecture 
-            for record in attendance_records 
-            if record.is_present and (
-                (record.is_proxy and record.proxy_id == teacher.id) or
-                (not record.is_proxy and record.timetable.teacher_id == teacher.id)
-            )
-        )
-        
-        # Get subject distribution
-        subject_distribution = {}
-        for record in attendance_records:
-            if record.is_present and (
-                (record.is_proxy and record.proxy_id == teacher.id) or
-                (not record.is_proxy and record.timetable.teacher_id == teacher.id)
-            ):
-                subject = record.timetable.subject
-                subject_distribution[subject] = subject_distribution.get(subject, 0) + 1
-        
-        # Get grade distribution
-        grade_distribution = {}
-        for record in attendance_records:
-            if record.is_present and (
-                (record.is_proxy and record.proxy_id == teacher.id) or
-                (not record.is_proxy and record.timetable.teacher_id == teacher.id)
-            ):
-                grade = record.timetable.grade
-                grade_distribution[grade] = grade_distribution.get(grade, 0) + 1
-        
-        # Get day-wise distribution
-        day_distribution = {i: 0 for i in range(7)}
-        for record in attendance_records:
-            if record.is_present and (
-                (record.is_proxy and record.proxy_id == teacher.id) or
-                (not record.is_proxy and record.timetable.teacher_id == teacher.id)
-            ):
-                day = record.timetable.day_of_week
-                day_distribution[day] += 1
-        
-        # Calculate attendance consistency
-        total_scheduled = len(attendance_records)
-        total_present = sum(1 for record in attendance_records 
-            if record.is_present and (
-                (record.is_proxy and record.proxy_id == teacher.id) or
-                (not record.is_proxy and record.timetable.teacher_id == teacher.id)
-            )
-        )
-        attendance_rate = (total_present / total_scheduled * 100) if total_scheduled > 0 else 0
-        
-        # Compile analytics for this teacher
-        teacher_analytics = {
-            'id': teacher.id,
-            'name': teacher.name,
-            'email': teacher.email,
-            'total_classes': total_classes,
-            'proxy_classes': proxy_classes,
-            'regular_classes': regular_classes,
-            'absent_classes': absent_classes,
-            'monthly_earnings': monthly_earnings,
-            'attendance_rate': round(attendance_rate, 2),
-            'subject_distribution': subject_distribution,
-            'grade_distribution': grade_distribution,
-            'day_distribution': day_distribution,
-            'pay_per_lecture': teacher.pay_per_lecture
-        }
-        
-        analytics.append(teacher_analytics)
+    # Metrics for all teachers are summed from the month's pre-aggregated rollup rows
+    analytics = teacher_rollup_analytics(start_date, end_date, teachers)
     
     # Generate months and years for dropdown
     current_year = datetime.now().year
@@ -565,29 +729,34 @@ def sales_analytics():
     # Get selected month and year from query params
     selected_month = request.args.get('month', datetime.now().month)
     selected_year = request.args.get('year', datetime.now().year)
+    start_date, end_date = util_month_range(int(selected_year), int(selected_month))
     
+    # Totals come from the month's rollup rows; only the invoice listing reads student_invoices
+    sales_ids = [admin.id for admin in sales_admins]
+    totals = sales_rollup_totals(start_date, end_date, sales_ids)
+    student_details = {}
+    invoices = (
+        db.session.query(StudentInvoice.sales_id, StudentInvoice.date, StudentInvoice.fees_paid, Student.fname, Student.lname)
+        .join(Student, Student.id == StudentInvoice.student_id)
+        .filter(
+            StudentInvoice.sales_id.in_(sales_ids),
+            StudentInvoice.date >= start_date,
+            StudentInvoice.date < end_date
+        )
+        .order_by(StudentInvoice.date, StudentInvoice.id)
+        .all()
+    )
+    for invoice in invoices:
+        student_details.setdefault(invoice.sales_id, []).append({
+            'name': f"{invoice.fname} {invoice.lname}",
+            'date': invoice.date,
+            'amount': invoice.fees_paid
+        })
+
     for admin in sales_admins:
-        # Get all student invoices created by this sales admin
-        invoices = StudentInvoice.query.filter(
-            StudentInvoice.created_by == admin.name,
-            db.extract('month', StudentInvoice.date) == int(selected_month),
-            db.extract('year', StudentInvoice.date) == int(selected_year)
-        ).all()
-        
-        # Calculate metrics
-        total_amount = sum(invoice.fees_paid for invoice in invoices)
+        total_amount = totals.get(admin.id, {}).get('total_amount', 0.0)
         commission = total_amount * 0.10  # 10% commission
         
-        # Get student details for each invoice
-        student_details = []
-        for invoice in invoices:
-            student = invoice.student
-            student_details.append({
-                'name': f"{student.fname} {student.lname}",
-                'date': invoice.date,
-                'amount': invoice.fees_paid
-            })
-        
         # Compile analytics for this sales admin
         admin_analytics = {
             'id': admin.id,
@@ -595,7 +764,7 @@ def sales_analytics():
             'email': admin.email,
             'total_amount': total_amount,
             'commission': commission,
-            'student_details': student_details
+            'student_details': student_details.get(admin.id, [])
         }
         
         analytics.append(admin_analytics)
@@ -615,4 +784,85 @@ def sales_analytics():
                          months=months,
                          years=years,
                          selected_month=selected_month,
-                         selected_year=selected_year)
\ No newline at end of file
+                         selected_year=selected_year)
+
+def _analytics_range():
+    """
+    Reads the inclusive `from`/`to` months (YYYY-MM) of an analytics API
+    request. Defaults to the twelve months ending with the current one.
+
+    Returns:
+        tuple[date, date]: First day of the first month and of the month after the last.
+    """
+    now = datetime.now()
+    last = datetime.strptime(request.args['to'], '%Y-%m') if request.args.get('to') else now
+    first = (
+        datetime.strptime(request.args['from'], '%Y-%m') if request.args.get('from')
+        else datetime(last.year - 1 if last.month < 12 else last.year, last.month % 12 + 1, 1)
+    )
+    months = (last.year - first.year) * 12 + last.month - first.month + 1
+    max_months = current_app.config.get('ANALYTICS_MAX_MONTHS', 60)
+    if months < 1:
+        raise ValueError("'from' must not be after 'to'")
+    if months > max_months:
+        raise ValueError(f"At most {max_months} months can be requested")
+    return util_month_range(first.year, first.month)[0], util_month_range(last.year, last.month)[1]
+
+@admin_bp.route('/analytics/teachers')
+@login_required
+def teacher_analytics_series():
+    user = session.get('user')
+    if not user or user.get('role') != 'admin':
+        return redirect(url_for('index.login'))
+
+    try:
+        start, end = _analytics_range()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    teacher_ids = sorted(set(request.args.getlist('teacher_id', type=int)))
+
+    data = analytics_cache.get_or_compute(
+        ('teachers', start, end, tuple(teacher_ids)), start, end,
+        lambda: teacher_series(start, end, teacher_ids)
+    )
+    return jsonify({'success': True, **data}), 200
+
+@admin_bp.route('/analytics/sales')
+@login_required
+def sales_analytics_series():
+    user = session.get('user')
+    if not user or user.get('role') != 'admin':
+        return redirect(url_for('index.login'))
+
+    try:
+        start, end = _analytics_range()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    sales_ids = sorted(set(request.args.getlist('sales_id', type=int)))
+
+    data = analytics_cache.get_or_compute(
+        ('sales', start, end, tuple(sales_ids)), start, end,
+        lambda: sales_series(start, end, sales_ids)
+    )
+    return jsonify({'success': True, **data}), 200
+
+@admin_bp.route('/analytics/teachers/range')
+@login_required
+def teacher_analytics_range():
+    user = session.get('user')
+    if not user or user.get('role') != 'admin':
+        return redirect(url_for('index.login'))
+
+    try:
+        start = datetime.strptime(request.args['from'], '%Y-%m-%d').date()
+        last = datetime.strptime(request.args['to'], '%Y-%m-%d').date()
+        if last < start:
+            raise ValueError()
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'error': "Valid 'from' and 'to' dates (YYYY-MM-DD) are required"}), 400
+
+    teacher_ids = request.args.getlist('teacher_id', type=int)
+    teachers = Teacher.query.filter(Teacher.id.in_(teacher_ids)) if teacher_ids else Teacher.query.filter_by(is_active=True)
+    # Any day range, over the in-memory columnar copy of attendance
+    analytics = attendance_columns.teacher_analytics(start, last + timedelta(days=1), teachers.order_by(Teacher.name).all())
+    return jsonify({'success': True, 'from': start.isoformat(), 'to': last.isoformat(), 'teachers': analytics}), 200
\ No newline at end of file
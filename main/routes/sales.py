@@ -1,11 +1,11 @@
-from flask import Blueprint, render_template, request, jsonify, session, url_for, current_app, make_response, redirect, flash, send_file
-from main.models import Student, StudentInvoice, Admin, Sales
-from main.utils import util_db_add, util_db_update, util_db_delete, login_required, is_sales
+from flask import Blueprint, render_template, request, jsonify, session, url_for, current_app, redirect, flash
+from main.models import StudentInvoice, Sales
+from main.utils import util_db_update, util_db_delete, login_required, is_sales, util_month_range
+from main.invoices import invoice_records, receipt_html
+from main.student_index import student_index
+from main import payments
+from main.pdf import pdf_renderer, pdf_response, PdfRenderError, invoice_tag, sales_month_tag
 from datetime import date, datetime
-import pdfkit
-import os
-import subprocess
-import tempfile
 
 sales_bp = Blueprint('sales', __name__, url_prefix='/sales')
 
@@ -18,26 +18,51 @@ def dashboard():
     if not current_admin:
         return redirect(url_for('index.login'))
 
-    invoices = (
-        StudentInvoice.query
-        .join(Student, Student.id == StudentInvoice.student_id)
-        .add_columns(
-            StudentInvoice.id,
-            Student.grade,
-            Student.fname, Student.lname,
-            StudentInvoice.total_fees,
-            StudentInvoice.fees_paid,
-            StudentInvoice.date,
-            StudentInvoice.created_by
-        )
-        .order_by(StudentInvoice.id.desc())
-        .all()
-    )
+    # Only the first page is rendered; the page fetches the rest from sales.invoice_records_api
+    per_page = current_app.config.get('SALES_RECORDS_PER_PAGE', 50)
+    invoices = invoice_records(limit=per_page + 1)
     return render_template('sales_dashboard.html',
-                           invoices=invoices,
+                           invoices=invoices[:per_page],
+                           has_more=len(invoices) > per_page,
                            current_date=date.today().isoformat(),
                            sales_person=current_admin.name)
 
+@sales_bp.route('/records')
+@login_required
+@is_sales
+def invoice_records_api():
+    try:
+        before = request.args.get('before', type=int)
+        date_from = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else None
+        date_to = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Dates must be YYYY-MM-DD'}), 400
+    per_page = min(max(request.args.get('per_page', current_app.config.get('SALES_RECORDS_PER_PAGE', 50), type=int), 1), 200)
+
+    # One extra row tells us whether there is another page without a COUNT query
+    records = invoice_records(
+        before=before,
+        limit=per_page + 1,
+        sales_id=session['user'].get('id') if request.args.get('mine') else None,
+        grade=request.args.get('grade', '').strip() or None,
+        date_from=date_from,
+        date_to=date_to,
+        name=request.args.get('name', '').strip() or None
+    )
+    has_more = len(records) > per_page
+    records = records[:per_page]
+
+    return jsonify({
+        'success': True,
+        'records': [
+            dict(record, date=record['date'].isoformat(), invoice_url=url_for('sales.download_invoice', inv_id=record['id']))
+            for record in records
+        ],
+        'per_page': per_page,
+        'has_more': has_more,
+        'next_before': records[-1]['id'] if has_more else None
+    }), 200
+
 @sales_bp.route('/fee')
 @login_required
 @is_sales
@@ -48,16 +73,20 @@ def lookup_fee():
         if not grade or not name:
             return jsonify({'success': False, 'error': 'Grade and name are required'}), 400
 
-        parts = name.split(None,1)
-        fname = parts[0]
-        lname = parts[1] if len(parts)>1 else ''
-
-        student = Student.query.filter_by(grade=grade, fname=fname, lname=lname).first()
+        # Only an exact name is the student a payment goes to; near misses,
+        # matched in memory ignoring case, accents and spacing, are suggestions
+        student = payments.find_student(grade, name)
         if not student:
-            return jsonify({'success': False, 'new': True, 'error': None}), 200
+            return jsonify({
+                'success': False,
+                'new': True,
+                'suggestions': student_index.suggest(name, grade=grade, limit=5),
+                'error': None
+            }), 200
 
         return jsonify({
             'success': True, 
+            'student_id': student.id,
             'total_fees': student.total_fees,
             'error': None
         }), 200
@@ -68,37 +97,40 @@ def lookup_fee():
             'new': False
         }), 500
 
+@sales_bp.route('/students/suggest')
+@login_required
+@is_sales
+def suggest_students():
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 8, type=int), 1), 20)
+    if not query:
+        return jsonify({'success': True, 'suggestions': []}), 200
+
+    suggestions = student_index.suggest(query, grade=request.args.get('grade', '').strip() or None, limit=limit)
+    return jsonify({'success': True, 'suggestions': suggestions}), 200
+
 @sales_bp.route('/invoice/<int:inv_id>')
 @login_required
 @is_sales
 def download_invoice(inv_id):
     inv = StudentInvoice.query.get_or_404(inv_id)
-    student = inv.student  # via backref
-    # Reuse the same breakdown logic from record_payment:
-    pct = {
-        'tuition': 0.82, 'books': 0.04, 'ebook': 0.02,
-        'kit': 0.02, 'uniform': 0.04, 'bag': 0.03, 'activity': 0.03
-    }
     try:
-        gnum = int(student.grade)
-    except:
-        gnum = None
-    if gnum and 9 <= gnum <= 12:
-        pct['ebook'] = 0.04
-        pct['kit']   = 0.00
-    breakdown = { k: round(student.total_fees * v, 2) for k,v in pct.items() }
-
-    html = render_template('invoice.html',
-                           student=student,
-                           invoice=inv,
-                           breakdown=breakdown)
-    pdf = pdfkit.from_string(html, False, options=current_app.config.get('WKHTMLTOPDF_OPTIONS', {}))
-    response = make_response(pdf)
-    response.headers.update({
-        'Content-Type': 'application/pdf',
-        'Content-Disposition': f'attachment; filename=invoice_{inv.id}.pdf'
-    })
-    return response
+        # Served from the cache when the background render after the payment has finished
+        pdf = pdf_renderer.render(receipt_html(inv), tags=(invoice_tag(inv.id),))
+    except PdfRenderError as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    return pdf_response(pdf, f'invoice_{inv.id}.pdf')
+
+@sales_bp.route('/invoice/<int:inv_id>/status')
+@login_required
+@is_sales
+def invoice_status(inv_id):
+    inv = StudentInvoice.query.get_or_404(inv_id)
+    return jsonify({
+        'success': True,
+        'status': pdf_renderer.status(receipt_html(inv)),
+        'download_url': url_for('sales.download_invoice', inv_id=inv.id)
+    }), 200
 
 @sales_bp.route('/record/<int:inv_id>', methods=['DELETE'])
 @login_required
@@ -169,75 +201,43 @@ def record_payment():
         except:
             return jsonify({'success': False, 'error': 'Invalid numbers provided'}), 400
 
+        # Retries of the same submission carry the same key and are not paid twice
+        idempotency_key = (request.headers.get('Idempotency-Key') or data.get('idempotency_key') or '').strip() or None
+        if idempotency_key and len(idempotency_key) > 64:
+            return jsonify({'success': False, 'error': 'Idempotency key is too long'}), 400
+
         # Get current sales person
         current_sales = Sales.query.filter_by(email=session['user']['email']).first()
         if not current_sales:
             return jsonify({'success': False, 'error': 'Sales person not found'}), 404
 
-        parts = name.split(None,1)
-        fname = parts[0]
-        lname = parts[1] if len(parts)>1 else ''
-
-        # find or create student
-        student = Student.query.filter_by(grade=grade, fname=fname, lname=lname).first()
-        if not student:
-            student = Student(
-                grade=grade,
-                fname=fname,
-                lname=lname,
-                total_fees=total,
-                fees_paid=0.0
-            )
-            util_db_add(student)
-
-        # update or create invoice
-        inv = StudentInvoice.query.filter_by(student_id=student.id).first()
-        if inv:
-            inv.fees_paid += paid
-        else:
-            inv = StudentInvoice(
-                student_id=student.id,
-                sales_id=current_sales.id,
-                date=date.today(),
-                total_fees=total,
-                fees_paid=paid,
-                created_by=current_sales.name
-            )
-            util_db_add(inv)
-
-        # sync Student.fees_paid
-        student.fees_paid += paid
-
-        result = util_db_update()
-        if not result.get('success'):
-            return jsonify({'success': False, 'error': 'Database update failed'}), 500
-
-        # percentage breakdown logic
-        pct = {
-            'tuition': 0.82,
-            'books':   0.04,
-            'ebook':   0.02,
-            'kit':     0.02,
-            'uniform': 0.04,
-            'bag':     0.03,
-            'activity':0.03
-        }
+        # a suggestion picked in the form wins over the typed name
         try:
-            gnum = int(grade)
-        except:
-            gnum = None
-        if gnum and 9 <= gnum <= 12:
-            pct['ebook'] = 0.04
-            pct['kit']   = 0.00
+            inv, replayed = payments.record_payment(
+                current_sales, grade, name, paid, total,
+                student_id=data.get('student_id') or None,
+                idempotency_key=idempotency_key
+            )
+        except payments.PaymentError as e:
+            return jsonify({'success': False, 'error': str(e)}), e.status
 
-        breakdown = { k: round(total * v, 2) for k,v in pct.items() }
-        html = render_template('invoice.html', student=student, invoice=inv, breakdown=breakdown)
-        pdf = pdfkit.from_string(html, False, options=current_app.config.get('WKHTMLTOPDF_OPTIONS', {}))
+        # The receipt renders into the PDF cache in the background; the
+        # download URL picks it up, waits for it or renders it on demand
+        if pdf_renderer.cache:
+            try:
+                pdf_renderer.submit(receipt_html(inv), tags=(invoice_tag(inv.id),))
+            except PdfRenderError:
+                pass  # queue full; the receipt renders on first download instead
 
-        response = make_response(pdf)
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = 'attachment; filename=invoice.pdf'
-        return response
+        return jsonify({
+            'success': True,
+            'replayed': replayed,
+            'invoice_id': inv.id,
+            'student_id': inv.student_id,
+            'fees_paid': inv.fees_paid,
+            'receipt_url': url_for('sales.download_invoice', inv_id=inv.id),
+            'receipt_status_url': url_for('sales.invoice_status', inv_id=inv.id)
+        }), 200 if replayed else 201
 
     except Exception as e:
         return jsonify({
@@ -262,11 +262,7 @@ def generate_invoice():
         year = request.form.get('year')
         
         # Get all student invoices for the selected month and year
-        start_date = date(int(year), int(month), 1)
-        if int(month) == 12:
-            end_date = date(int(year) + 1, 1, 1)
-        else:
-            end_date = date(int(year), int(month) + 1, 1)
+        start_date, end_date = util_month_range(int(year), int(month))
 
         invoices = StudentInvoice.query.filter(
             StudentInvoice.sales_id == sales.id,
@@ -302,11 +298,12 @@ def generate_invoice():
                              total_commission=total_commission,
                              commission_rate=sales.commission_rate)
 
-        pdf = pdfkit.from_string(html, False, options=current_app.config.get('WKHTMLTOPDF_OPTIONS', {}))
-        response = make_response(pdf)
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename=sales_commission_{month}_{year}.pdf'
-        return response
+        try:
+            pdf = pdf_renderer.render(html, tags=(sales_month_tag(sales.id, start_date),))
+        except PdfRenderError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('sales.generate_invoice'))
+        return pdf_response(pdf, f'sales_commission_{month}_{year}.pdf')
 
     # For GET request, show the form
     months = [
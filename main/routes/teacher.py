@@ -1,15 +1,18 @@
 import os
-import subprocess
-import tempfile
-from datetime import datetime, timedelta
-from flask import Blueprint, request, session, current_app, render_template, redirect, url_for, flash, send_file
+from datetime import date, datetime
+from flask import Blueprint, request, session, current_app, render_template, redirect, url_for, flash, jsonify
 from sqlalchemy import or_
 
-from werkzeug.utils import secure_filename
-
 from main.extensions import db
 from main.models import Timetable, Teacher, Attendance
 from main.utils import login_required
+from main.attendance import util_date_window, ensure_attendance, pending_lectures
+from main.transcode import transcode_queue
+from main.storage import incoming_path, save_stream
+from main.pdf import pdf_renderer, pdf_response, PdfRenderError, teacher_month_tag
+from main.payroll import monthly_lectures, invoice_context, invoice_filename
+from main.snapshots import teacher_month_snapshot
+from main.uploads import create_upload_session, get_upload_session, append_chunk, close_upload_session, upload_digest
 
 teacher_bp = Blueprint('teacher', __name__, url_prefix='/teacher')
 
@@ -30,47 +33,16 @@ def mark_attendance():
         flash('Teacher profile not found.', 'danger')
         return redirect(url_for('index.login'))
 
-    # Get dates for last 6 days
-    dates = [(today - timedelta(days=i)) for i in range(6)]
-    lectures = []
-    
-    for date in dates:
-        day_of_week = date.weekday()
-        templates = Timetable.query.filter_by(day_of_week=day_of_week).all()
-        
-        for template in templates:
-            # Check if attendance record exists
-            attendance = Attendance.query.filter_by(
-                timetable_id=template.id,
-                date=date
-            ).first()
-            
-            # If no attendance record exists, create one
-            if not attendance:
-                attendance = Attendance(
-                    timetable_id=template.id,
-                    date=date
-                )
-                db.session.add(attendance)
-                db.session.commit()
-            
-            # Only add to lectures list if not marked
-            if not attendance.is_present:
-                lectures.append({
-                    'id': attendance.id,
-                    'subject': template.subject,
-                    'grade': template.grade,
-                    'start_time': template.start_time,
-                    'teacher_name': template.assigned_teacher.name,
-                    'date': date,
-                    'is_present': attendance.is_present,
-                    'is_proxy': attendance.is_proxy,
-                    'proxy_name': attendance.proxy_teacher.name if attendance.proxy_teacher else None
-                })
-    
-    # Sort lectures by date and time
-    lectures.sort(key=lambda x: (x['date'], x['start_time']))
-    
+    # Get dates for the attendance window, creating missing rows in bulk
+    dates = util_date_window(current_app.config.get('ATTENDANCE_WINDOW_DAYS', 6), today)
+    ensure_attendance(dates)
+
+    lectures = pending_lectures(
+        dates,
+        teacher_id=teacher.id if request.args.get('mine') else None,
+        grade=request.args.get('grade') or None
+    )
+
     return render_template('mark_attendance.html', lectures=lectures)
 
 @teacher_bp.route('/mark-attendance', methods=['POST'])
@@ -82,61 +54,202 @@ def handle_attendance_upload():
         flash('Teacher profile not found.', 'danger')
         return redirect(url_for('teacher.mark_attendance'))
 
+    wants_json = request.accept_mimetypes.best == 'application/json'
     attendance_id = request.form.get('attendance_id')
     file = request.files.get('video')
     if not attendance_id or not file or not allowed_file(file.filename):
+        if wants_json:
+            return jsonify({'success': False, 'error': 'Invalid lecture selection or file type. Only videos allowed.'}), 400
         flash('Invalid lecture selection or file type. Only videos allowed.', 'danger')
         return redirect(url_for('teacher.mark_attendance'))
 
     attendance = Attendance.query.get(attendance_id)
     if not attendance or attendance.is_present:
+        if wants_json:
+            return jsonify({'success': False, 'error': 'Lecture not found or already marked.'}), 400
         flash('Lecture not found or already marked.', 'danger')
         return redirect(url_for('teacher.mark_attendance'))
 
-    is_proxy = (attendance.timetable.teacher_id != teacher.id)
-    attendance.is_present = True
-    if is_proxy:
-        attendance.is_proxy = True
-        attendance.proxy_id = teacher.id
-        # Mark original teacher as absent
-        original_attendance = Attendance.query.filter_by(
-            timetable_id=attendance.timetable_id,
-            date=attendance.date,
-            proxy_id=None
-        ).first()
-        if original_attendance:
-            original_attendance.is_present = False
-            db.session.add(original_attendance)
-
-    base_name = f"{attendance.timetable.grade}_{attendance.timetable.subject}_{attendance.date.isoformat()}_{attendance.timetable.teacher_id}_{attendance.timetable.start_time.strftime('%H%M')}"
-    prefix = 'proxy_' if is_proxy else ''
-    upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], prefix + base_name)
-    os.makedirs(upload_dir, exist_ok=True)
-
-    original_filename = secure_filename(file.filename)
-    temp_path = os.path.join(upload_dir, original_filename)
-    file.save(temp_path)
-
-    final_filename = base_name + '.mp4'
-    final_path = os.path.join(upload_dir, final_filename)
-    ffmpeg_cmd = [
-        'ffmpeg', '-y', '-i', temp_path,
-        '-c:v', 'libx264', '-c:a', 'aac', final_path
-    ]
-    try:
-        subprocess.run(ffmpeg_cmd, check=True)
-    except subprocess.CalledProcessError:
-        flash('Video conversion to MP4 failed.', 'danger')
+    # Hash while saving so identical uploads can reuse an existing recording
+    temp_path = incoming_path(current_app.config['UPLOAD_FOLDER'], file.filename)
+    saved = save_stream(file.stream, temp_path)
+
+    result = queue_lecture_video(attendance, teacher, temp_path, saved['sha256'])
+    if not result.get('success'):
         os.remove(temp_path)
+        if wants_json:
+            return jsonify({'success': False, 'error': result.get('error')}), 503
+        flash(result.get('error'), 'danger')
         return redirect(url_for('teacher.mark_attendance'))
 
-    # cleanup temp and commit
-    os.remove(temp_path)
-    db.session.commit()
+    if wants_json:
+        return jsonify(result), 202
 
-    flash('Attendance marked and video saved successfully!', 'success')
+    flash('Video uploaded. Attendance will be marked once processing finishes.', 'success')
     return redirect(url_for('teacher.mark_attendance'))
-    
+
+def queue_lecture_video(attendance, teacher, source_path, content_hash):
+    """
+    Hands a saved upload to the transcoding queue. Attendance is marked once
+    conversion succeeds (or immediately if the same content was already
+    converted) and the source file is removed afterwards.
+    """
+    result = transcode_queue.submit(attendance.id, teacher.id, source_path, content_hash)
+    if not result.get('success'):
+        return result
+
+    job = result['job']
+    return {
+        'success': True,
+        'job': job,
+        'status_url': url_for('teacher.transcode_status', job_id=job['id'])
+    }
+
+def owned_by_teacher(record: dict) -> bool:
+    # Admin and sales ids share the integer space with teacher ids, so the role must match too
+    user = session.get('user') or {}
+    return user.get('role') == 'teacher' and record['teacher_id'] == user.get('id')
+
+# ── Resumable uploads ─────────────────────────────────────────────────────────
+@teacher_bp.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    teacher = Teacher.query.filter_by(email=session['user'].get('email')).first()
+    if not teacher:
+        return jsonify({'success': False, 'error': 'Teacher profile not found.'}), 404
+
+    data = request.get_json() or {}
+    filename = data.get('filename', '')
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'File size is required'}), 400
+
+    if not filename or not allowed_file(filename):
+        return jsonify({'success': False, 'error': 'Invalid file type. Only videos allowed.'}), 400
+    if size <= 0:
+        return jsonify({'success': False, 'error': 'File size must be greater than zero'}), 400
+    max_size = current_app.config.get('MAX_VIDEO_UPLOAD_BYTES')
+    if max_size and size > max_size:
+        return jsonify({'success': False, 'error': f'File must be smaller than {max_size // (1024 * 1024)} MB'}), 413
+
+    attendance = Attendance.query.get(data.get('attendance_id'))
+    if not attendance or attendance.is_present:
+        return jsonify({'success': False, 'error': 'Lecture not found or already marked.'}), 400
+
+    data_path = incoming_path(current_app.config['UPLOAD_FOLDER'], filename)
+    upload = create_upload_session(current_app.config['UPLOAD_FOLDER'], attendance.id, teacher.id, data_path, size)
+
+    return jsonify({
+        'success': True,
+        'upload_id': upload['id'],
+        'upload_url': url_for('teacher.upload_chunk', upload_id=upload['id']),
+        'offset': 0,
+        'size': size
+    }), 201
+
+@teacher_bp.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    upload = get_upload_session(current_app.config['UPLOAD_FOLDER'], upload_id)
+    if not upload or not owned_by_teacher(upload):
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+    return jsonify({'success': True, 'offset': upload['offset'], 'size': upload['size']}), 200
+
+@teacher_bp.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    upload = get_upload_session(current_app.config['UPLOAD_FOLDER'], upload_id)
+    if not upload or not owned_by_teacher(upload):
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+
+    # Content-Range: bytes <start>-<end>/<total>
+    try:
+        unit, _, byte_range = request.headers.get('Content-Range', '').partition(' ')
+        span, _, total = byte_range.partition('/')
+        start, _, end = span.partition('-')
+        start, end, total = int(start), int(end), int(total)
+        if unit != 'bytes' or end < start or total != upload['size']:
+            raise ValueError()
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid Content-Range header', 'offset': upload['offset']}), 400
+
+    result = append_chunk(upload, start, request.stream, end - start + 1)
+    if not result.get('success'):
+        if result['status'] == 415:
+            close_upload_session(current_app.config['UPLOAD_FOLDER'], upload, discard=True)
+        return jsonify({'success': False, 'error': result['error'], 'offset': result['offset']}), result['status']
+
+    return jsonify({'success': True, 'offset': result['offset'], 'size': upload['size']}), 200
+
+@teacher_bp.route('/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload(upload_id):
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    upload = get_upload_session(upload_folder, upload_id)
+    if not upload or not owned_by_teacher(upload):
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+    if upload['offset'] != upload['size']:
+        return jsonify({'success': False, 'error': 'Upload is incomplete', 'offset': upload['offset']}), 409
+
+    teacher = Teacher.query.get(upload['teacher_id'])
+    attendance = Attendance.query.get(upload['attendance_id'])
+    if not teacher or not attendance or attendance.is_present:
+        close_upload_session(upload_folder, upload, discard=True)
+        return jsonify({'success': False, 'error': 'Lecture not found or already marked.'}), 400
+
+    # The session is kept when queueing fails so the client can retry finalize
+    result = queue_lecture_video(attendance, teacher, upload['data_path'], upload_digest(upload))
+    if not result.get('success'):
+        return jsonify({'success': False, 'error': result.get('error')}), 503
+    close_upload_session(upload_folder, upload)
+    return jsonify(result), 202
+
+@teacher_bp.route('/jobs/<job_id>')
+@login_required
+def transcode_status(job_id):
+    job = transcode_queue.get(job_id)
+    if not job or not owned_by_teacher(job):
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job}), 200
+
+@teacher_bp.route('/lectures/pending')
+@login_required
+def pending_lectures_api():
+    user = session.get('user')
+    if not user or user.get('role') != 'teacher':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+    days = current_app.config.get('ATTENDANCE_WINDOW_DAYS', 6)
+    dates = util_date_window(days, datetime.now().date())
+    ensure_attendance(dates)
+
+    # One extra row tells us whether there is another page without a COUNT query
+    lectures = pending_lectures(
+        dates,
+        teacher_id=user.get('id') if request.args.get('mine') else None,
+        grade=request.args.get('grade') or None,
+        limit=per_page + 1,
+        offset=(page - 1) * per_page
+    )
+
+    return jsonify({
+        'success': True,
+        'lectures': [
+            dict(
+                lecture,
+                date=lecture['date'].isoformat(),
+                start_time=lecture['start_time'].strftime('%H:%M')
+            )
+            for lecture in lectures[:per_page]
+        ],
+        'page': page,
+        'per_page': per_page,
+        'has_more': len(lectures) > per_page
+    }), 200
+
 @teacher_bp.route('/dashboard')
 def dashboard():
     user = session.get('user')
@@ -145,6 +258,28 @@ def dashboard():
 
     return render_template('mark_attendance.html', teacher_name=user.get('name'))
 
+@teacher_bp.route('/earnings')
+@login_required
+def earnings():
+    user = session.get('user')
+    if not user or user.get('role') != 'teacher':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    now = datetime.now()
+    year = request.args.get('year', now.year, type=int)
+    month = request.args.get('month', now.month, type=int)
+    if not 1 <= month <= 12:
+        return jsonify({'success': False, 'error': 'Invalid month'}), 400
+
+    snapshot = teacher_month_snapshot(user.get('id'), year, month)
+    return jsonify({
+        'success': True,
+        'year': year,
+        'month': month,
+        'total_lectures': snapshot.total_lectures if snapshot else 0,
+        'total_amount': snapshot.total_amount if snapshot else 0.0,
+    }), 200
+
 @teacher_bp.route('/invoice', methods=['GET', 'POST'])
 @login_required
 def generate_invoice():
@@ -167,76 +302,24 @@ def generate_invoice():
     month = request.form.get('month')  # '01'-'12'
     year = request.form.get('year')    # '2025', etc
 
-    # Get all marked attendance records for this teacher in selected month
-    attendance_records = Attendance.query.join(Timetable).filter(
-        Attendance.is_present == True,
-        db.extract('month', Attendance.date) == int(month),
-        db.extract('year', Attendance.date) == int(year),
-        or_(
-            Timetable.teacher_id == teacher.id,
-            Attendance.proxy_id == teacher.id
-        )
-    ).order_by(Attendance.date).all()
-
-    # Create entries list with all necessary information
-    entries = []
-    total_amount = 0
-    for record in attendance_records:
-        # Calculate payment based on whether it's a proxy class or regular class
-        if record.is_proxy and record.proxy_id == teacher.id:
-            # For proxy classes, use proxy teacher's pay rate
-            payment = teacher.pay_per_lecture
-        elif not record.is_proxy and record.timetable.teacher_id == teacher.id:
-            # For regular classes, use assigned teacher's pay rate
-            payment = teacher.pay_per_lecture
-        else:
-            continue  # Skip if neither proxy nor regular class for this teacher
-
-        entries.append({
-            'date': record.date,
-            'subject': record.timetable.subject,
-            'grade': record.timetable.grade,
-            'start_time': record.timetable.start_time,
-            'is_proxy': record.is_proxy,
-            'payment': payment
-        })
-        total_amount += payment
+    # Same computation as the month-end payroll run, so both produce identical documents
+    lectures = monthly_lectures(int(year), int(month), [teacher.id]).get(teacher.id, [])
+    context = invoice_context(teacher, lectures, int(year), int(month))
 
-    total_lectures = len(entries)
-    
     # Check if there are any lectures
-    if total_lectures == 0:
+    if context['total_lectures'] == 0:
         flash(f'No lectures found for {teacher.name} in {month}/{year}', 'warning')
         return redirect(url_for('teacher.generate_invoice'))
 
     # render HTML
-    rendered = render_template('invoice_template.html',
-        teacher=teacher,
-        entries=entries,
-        total_lectures=total_lectures,
-        total_amount=total_amount,
-        month=month,
-        year=year
-    )
+    rendered = render_template('invoice_template.html', **context)
 
-    # create temp files
-    tmp_html = tempfile.NamedTemporaryFile(delete=False, suffix='.html')
-    tmp_pdf = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    tmp_html.write(rendered.encode('utf-8'))
-    tmp_html.flush()
-
-    # convert to PDF via wkhtmltopdf
-    subprocess.run([
-        'wkhtmltopdf', tmp_html.name, tmp_pdf.name
-    ], check=True)
-
-    # send and cleanup
-    pdf_path = tmp_pdf.name
-    tmp_html.close()
-    tmp_pdf.close()
-    return send_file(pdf_path,
-                     as_attachment=True,
-                     download_name=f"invoice_{teacher.id}_{year}{month}.pdf")
+    try:
+        pdf = pdf_renderer.render(rendered, tags=(teacher_month_tag(teacher.id, date(int(year), int(month), 1)),))
+    except PdfRenderError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('teacher.generate_invoice'))
+    return pdf_response(pdf, invoice_filename(teacher.id, int(year), int(month)))
 
 @teacher_bp.route('/invoice_template')
 def invoice_template():
@@ -0,0 +1,293 @@
+from datetime import date
+
+from sqlalchemy import bindparam, case, event, func, insert, select, update
+
+from main.extensions import db
+from main.logger import event_logger, error_logger
+from main.models import Attendance, Timetable, Teacher, TeacherInvoice
+
+# ── main/snapshots.py ────────────────────────────────────────────────────────────
+
+# TeacherInvoice rows hold a running total per teacher and month (dated the 1st).
+# They are adjusted inside the same flush that changes attendance, so they
+# commit or roll back together with it.
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _payee(is_present, is_proxy, proxy_id, teacher_id):
+    """Teacher paid for a lecture: the proxy if one held it, else the assigned teacher."""
+    if not is_present:
+        return None
+    return proxy_id if is_proxy else teacher_id
+
+
+SLOT_COLUMNS = ('teacher_id', 'subject', 'grade', 'day_of_week')
+
+
+def edited_slots(session, connection, columns: tuple = SLOT_COLUMNS) -> dict:
+    """
+    Finds the timetable slots about to flush whose `columns` change, or that
+    are deleted. Lectures already counted against such a slot have to be moved
+    from its stored values to the new ones.
+
+    Returns:
+        dict: Timetable id -> (stored row, the Timetable or None when deleted).
+    """
+    slots = {
+        obj.id: obj for obj in (*session.dirty, *session.deleted)
+        if isinstance(obj, Timetable) and obj.id is not None
+    }
+    if not slots:
+        return {}
+
+    table = Timetable.__table__
+    edited = {}
+    for row in connection.execute(
+        select(table.c.id, *(table.c[name] for name in SLOT_COLUMNS)).where(table.c.id.in_(slots))
+    ).all():
+        obj = None if slots[row.id] in session.deleted else slots[row.id]
+        if obj is None or any(getattr(row, name) != getattr(obj, name) for name in columns):
+            edited[row.id] = (row, obj)
+    return edited
+
+
+def slot_lectures(connection, timetable_ids, skip_ids: list[int]) -> list:
+    """Stored attendance rows of the given slots, leaving out `skip_ids` (rows that flush themselves)."""
+    if not timetable_ids:
+        return []
+    table = Attendance.__table__
+    query = (
+        select(table.c.id, table.c.timetable_id, table.c.date, table.c.is_present, table.c.is_proxy, table.c.proxy_id)
+        .where(table.c.timetable_id.in_(timetable_ids))
+    )
+    if skip_ids:
+        query = query.where(table.c.id.not_in(skip_ids))
+    return connection.execute(query).all()
+
+
+def _collect_deltas(session, flush_context, instances):
+    """
+    Records the change in paid lectures per (teacher_id, month) for the
+    attendance rows about to flush, and for the lectures of timetable slots
+    moved to another teacher or deleted.
+    """
+    changed, slots_changed = [], False
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Attendance):
+            changed.append(obj)
+        elif isinstance(obj, Timetable):
+            slots_changed = True
+    if not changed and not slots_changed:
+        return
+
+    # Stored rows are read back because attribute history has no old value
+    # for attributes that were expired when they were set
+    connection = session.connection()
+    table = Attendance.__table__
+    persistent_ids = [obj.id for obj in changed if obj not in session.new and obj.id is not None]
+    stored = {
+        row.id: row for row in connection.execute(
+            select(table.c.id, table.c.timetable_id, table.c.date, table.c.is_present, table.c.is_proxy, table.c.proxy_id)
+            .where(table.c.id.in_(persistent_ids))
+        ).all()
+    } if persistent_ids else {}
+
+    timetable_ids = {obj.timetable_id for obj in changed} | {row.timetable_id for row in stored.values()}
+    timetable_ids.discard(None)
+    assigned = dict(connection.execute(
+        select(Timetable.__table__.c.id, Timetable.__table__.c.teacher_id)
+        .where(Timetable.__table__.c.id.in_(timetable_ids))
+    ).all()) if timetable_ids else {}
+
+    # Stored teachers are what was counted; new lectures count against the edited slot
+    slots = edited_slots(session, connection, ('teacher_id',)) if slots_changed else {}
+    assigned.update({timetable_id: row.teacher_id for timetable_id, (row, _) in slots.items()})
+    assigned_now = dict(assigned)
+    assigned_now.update({
+        timetable_id: obj.teacher_id if obj is not None else None
+        for timetable_id, (_, obj) in slots.items()
+    })
+
+    deltas = session.info.setdefault('teacher_invoice_deltas', {})
+
+    def add(teacher_id, day, amount):
+        if teacher_id is None or day is None:
+            return
+        key = (teacher_id, month_start(day))
+        deltas[key] = deltas.get(key, 0) + amount
+
+    for obj in changed:
+        row = stored.get(obj.id)
+        if row is not None:
+            add(_payee(row.is_present, row.is_proxy, row.proxy_id, assigned.get(row.timetable_id)), row.date, -1)
+        if obj not in session.deleted:
+            add(_payee(obj.is_present, obj.is_proxy, obj.proxy_id, assigned_now.get(obj.timetable_id)), obj.date, 1)
+
+    for row in slot_lectures(connection, list(slots), persistent_ids):
+        add(_payee(row.is_present, row.is_proxy, row.proxy_id, assigned.get(row.timetable_id)), row.date, -1)
+        add(_payee(row.is_present, row.is_proxy, row.proxy_id, assigned_now.get(row.timetable_id)), row.date, 1)
+
+
+def insert_missing(connection, table, rows: list[dict], index_elements: list[str]) -> None:
+    """
+    Inserts derived-table rows in one statement, skipping those whose
+    `index_elements` key already exists. Used to create empty counter rows
+    before they are adjusted with relative updates.
+    """
+    dialect = connection.dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table)
+        first = index_elements[0]
+        stmt = stmt.on_duplicate_key_update({first: stmt.inserted[first]})
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        stmt = pg_insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        stmt = sqlite_insert(table).on_conflict_do_nothing(index_elements=index_elements)
+    else:
+        columns = [table.c[name] for name in index_elements]
+        existing = set(connection.execute(
+            select(*columns).where(*(column.in_({row[column.name] for row in rows}) for column in columns))
+        ).all())
+        rows = [row for row in rows if tuple(row[name] for name in index_elements) not in existing]
+        if not rows:
+            return
+        stmt = insert(table)
+
+    connection.execute(stmt, rows)
+
+
+def _apply_deltas(session, flush_context):
+    """Adds the recorded deltas to the snapshot rows within the flush's transaction."""
+    deltas = {key: delta for key, delta in session.info.pop('teacher_invoice_deltas', {}).items() if delta}
+    if not deltas:
+        return
+
+    connection = session.connection()
+    teacher_ids = {teacher_id for teacher_id, _ in deltas}
+    pay = dict(connection.execute(
+        select(Teacher.__table__.c.id, Teacher.__table__.c.pay_per_lecture)
+        .where(Teacher.__table__.c.id.in_(teacher_ids))
+    ).all())
+
+    table = TeacherInvoice.__table__
+    insert_missing(connection, table, [
+        {'teacher_id': teacher_id, 'date': month, 'total_lectures': 0, 'total_amount': 0.0}
+        for teacher_id, month in deltas
+    ], ['teacher_id', 'date'])
+    # Relative updates, so concurrent flushes for the same teacher do not lose counts
+    connection.execute(
+        update(table)
+        .where(table.c.teacher_id == bindparam('b_teacher_id'), table.c.date == bindparam('b_date'))
+        .values(
+            total_lectures=table.c.total_lectures + bindparam('b_lectures'),
+            total_amount=table.c.total_amount + bindparam('b_amount')
+        ),
+        [
+            {
+                'b_teacher_id': teacher_id,
+                'b_date': month,
+                'b_lectures': delta,
+                'b_amount': delta * (pay.get(teacher_id) or 0.0),
+            }
+            for (teacher_id, month), delta in deltas.items()
+        ]
+    )
+
+
+def _discard_deltas(session):
+    session.info.pop('teacher_invoice_deltas', None)
+
+
+def init_app(app):
+    """Keeps TeacherInvoice snapshots in step with attendance and timetable changes made through the ORM."""
+    if not event.contains(db.session, 'after_flush', _apply_deltas):
+        event.listen(db.session, 'before_flush', _collect_deltas)
+        event.listen(db.session, 'after_flush', _apply_deltas)
+        event.listen(db.session, 'after_rollback', _discard_deltas)
+
+
+def teacher_month_snapshot(teacher_id: int, year: int, month: int) -> TeacherInvoice | None:
+    """Returns the running totals of a teacher for a month with a single-row lookup."""
+    return TeacherInvoice.query.filter_by(teacher_id=teacher_id, date=date(year, month, 1)).first()
+
+
+def reconcile_snapshots(start: date = None, end: date = None, dry_run: bool = False) -> list[dict]:
+    """
+    Rebuilds TeacherInvoice snapshots from attendance and reports rows that
+    had drifted. Amounts are recomputed with each teacher's current pay rate.
+
+    Args:
+        start (date, optional): First day to include. Defaults to all history.
+        end (date, optional): Day after the last one to include.
+        dry_run (bool): Report drift without changing anything.
+
+    Returns:
+        list[dict]: One entry per drifted snapshot with stored and expected totals.
+    """
+    payee = case((Attendance.is_proxy == True, Attendance.proxy_id), else_=Timetable.teacher_id)
+    query = (
+        db.session.query(payee.label('teacher_id'), Attendance.date, func.count(Attendance.id))
+        .join(Timetable, Timetable.id == Attendance.timetable_id)
+        .filter(Attendance.is_present == True)
+        .group_by(payee, Attendance.date)
+    )
+    snapshots = TeacherInvoice.query
+    if start:
+        query = query.filter(Attendance.date >= start)
+        snapshots = snapshots.filter(TeacherInvoice.date >= month_start(start))
+    if end:
+        query = query.filter(Attendance.date < end)
+        snapshots = snapshots.filter(TeacherInvoice.date < end)
+
+    # Daily counts are folded into months here to keep the query portable
+    expected_lectures = {}
+    for teacher_id, day, count in query.all():
+        if teacher_id is None:
+            continue
+        key = (teacher_id, month_start(day))
+        expected_lectures[key] = expected_lectures.get(key, 0) + count
+
+    pay = dict(db.session.query(Teacher.id, Teacher.pay_per_lecture).all())
+    stored = {(row.teacher_id, row.date): row for row in snapshots.all()}
+
+    drift = []
+    for key in sorted(set(expected_lectures) | set(stored)):
+        teacher_id, month = key
+        lectures = expected_lectures.get(key, 0)
+        amount = lectures * (pay.get(teacher_id) or 0.0)
+        row = stored.get(key)
+        if row and row.total_lectures == lectures and abs(row.total_amount - amount) < 0.005:
+            continue
+        drift.append({
+            'teacher_id': teacher_id,
+            'month': month.isoformat(),
+            'stored_lectures': row.total_lectures if row else None,
+            'stored_amount': row.total_amount if row else None,
+            'expected_lectures': lectures,
+            'expected_amount': amount,
+        })
+        if dry_run:
+            continue
+        if row is None:
+            db.session.add(TeacherInvoice(teacher_id=teacher_id, date=month, total_lectures=lectures, total_amount=amount))
+        else:
+            row.total_lectures = lectures
+            row.total_amount = amount
+
+    if not dry_run:
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            error_logger.error(f"Snapshot reconciliation failed: {e}", exc_info=True)
+            raise
+
+    event_logger.info(f"Reconciled teacher invoice snapshots{' (dry run)' if dry_run else ''}: {len(drift)} drifted")
+    return drift
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import uuid
+from datetime import date
+
+from werkzeug.utils import secure_filename
+
+# ── main/storage.py ──────────────────────────────────────────────────────────────
+
+INCOMING_DIR = 'incoming'
+RECORDINGS_DIR = 'recordings'
+LEGACY_OBJECTS_DIR = 'objects'
+BUFFER_SIZE = 1024 * 1024
+
+
+def recording_path(upload_folder: str, content_hash: str, stored_on: date) -> str:
+    """
+    Returns where the converted MP4 for an upload with this content hash is
+    stored. Files are sharded by month and hash prefix so that no directory
+    grows without bound: recordings/<yyyy>/<mm>/<aa>/<hash>.mp4.
+
+    Args:
+        upload_folder (str): Root upload folder.
+        content_hash (str): SHA-256 hex digest of the original upload.
+        stored_on (date): Date the content was first stored.
+
+    Returns:
+        str: Absolute path of the shared MP4.
+    """
+    return os.path.join(
+        upload_folder, RECORDINGS_DIR,
+        f"{stored_on.year:04d}", f"{stored_on.month:02d}",
+        content_hash[:2], content_hash + '.mp4'
+    )
+
+
+def derivatives_dir(mp4_path: str) -> str:
+    """Returns the folder next to a stored MP4 that holds its HLS renditions and thumbnails."""
+    return mp4_path[:-len('.mp4')] if mp4_path.endswith('.mp4') else mp4_path + '.d'
+
+
+def incoming_path(upload_folder: str, filename: str) -> str:
+    """Returns a unique staging path for a raw upload before conversion."""
+    os.makedirs(os.path.join(upload_folder, INCOMING_DIR), exist_ok=True)
+    return os.path.join(upload_folder, INCOMING_DIR, f"{uuid.uuid4().hex}_{secure_filename(filename)}")
+
+
+def save_stream(stream, path: str) -> dict:
+    """
+    Copies a binary stream to `path` in fixed size blocks, hashing it on the way.
+
+    Args:
+        stream: Readable binary stream.
+        path (str): Destination file.
+
+    Returns:
+        dict: The SHA-256 hex digest and size in bytes.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as f:
+        while True:
+            block = stream.read(BUFFER_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            f.write(block)
+            size += len(block)
+    return {'sha256': digest.hexdigest(), 'size': size}
+
+
+def hash_file(path: str) -> str:
+    """Returns the SHA-256 hex digest of a file, read sequentially in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BUFFER_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
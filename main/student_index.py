@@ -0,0 +1,253 @@
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from sqlalchemy import event, func, select
+
+from main.extensions import db
+from main.logger import event_logger, error_logger
+from main.models import Student
+
+# ── main/student_index.py ────────────────────────────────────────────────────────
+
+# Per-process search index over student names, so fee lookups and name
+# suggestions are answered from memory instead of a query per keystroke.
+
+
+def normalize_name(name: str) -> str:
+    """Lowercases, strips accents and punctuation and collapses whitespace."""
+    if not name:
+        return ''
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(ch for ch in name if not unicodedata.combining(ch)).lower()
+    return ' '.join(re.sub(r'[^\w\s]|_', ' ', name).split())
+
+
+def normalize_grade(grade) -> str:
+    grade = str(grade or '').strip().lower()
+    return str(int(grade)) if grade.isdigit() else grade
+
+
+def trigrams(text: str) -> set[str]:
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class StudentIndex:
+    """
+    Student names per grade, indexed two ways: sorted name keys (the full
+    name and every later word onwards) for prefix search, and trigram
+    postings for typo-tolerant matching. It only ranks suggestions; payments
+    find their student with an exact database lookup.
+
+    The index is loaded on the first request and kept current from committed
+    ORM changes in this process. Changes made by other processes are picked
+    up every `sync_interval` seconds through the indexed `updated_at` column.
+    """
+
+    def __init__(self):
+        self.sync_interval = 30
+        self.clock_skew = timedelta(seconds=60)  # updated_at drift tolerated between app servers
+        self.min_similarity = 0.3
+        self._warm_attempted = False
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._students: dict[int, dict] = {}
+        self._keys: dict[str, list[tuple[str, int]]] = {}  # grade -> sorted (key, id)
+        self._postings: dict[str, dict[str, set[int]]] = {}  # grade -> trigram -> ids
+        self._stamp = None
+        self._synced_at = 0.0
+        self.loaded = False
+
+    def init_app(self, app):
+        self.sync_interval = app.config.get('STUDENT_INDEX_SYNC_INTERVAL', 30)
+        self.min_similarity = app.config.get('STUDENT_INDEX_MIN_SIMILARITY', 0.3)
+        if not event.contains(db.session, 'after_flush', self._collect_changes):
+            event.listen(db.session, 'after_flush', self._collect_changes)
+            event.listen(db.session, 'after_commit', self._apply_changes)
+            event.listen(db.session, 'after_rollback', self._discard_changes)
+        app.before_request(self._warm)
+
+    # ── maintenance ──────────────────────────────────────────────────────────────
+
+    def _add(self, student_id: int, grade: str, fname: str, lname: str, total_fees: float) -> None:
+        self._remove(student_id)
+        name = f'{fname} {lname}'.strip()
+        norm = normalize_name(name)
+        key_grade = normalize_grade(grade)
+        self._students[student_id] = {
+            'id': student_id, 'grade': grade, 'fname': fname, 'lname': lname,
+            'name': name, 'norm': norm, 'key_grade': key_grade, 'total_fees': total_fees,
+            'grams': len(trigrams(norm)),
+        }
+        words = norm.split()
+        keys = self._keys.setdefault(key_grade, [])
+        for i in range(len(words)):
+            insort(keys, (' '.join(words[i:]), student_id))
+        postings = self._postings.setdefault(key_grade, {})
+        for gram in trigrams(norm):
+            postings.setdefault(gram, set()).add(student_id)
+
+    def _remove(self, student_id: int) -> None:
+        entry = self._students.pop(student_id, None)
+        if entry is None:
+            return
+        key_grade, norm = entry['key_grade'], entry['norm']
+        keys = self._keys.get(key_grade, [])
+        words = norm.split()
+        for i in range(len(words)):
+            pos = bisect_left(keys, (' '.join(words[i:]), student_id))
+            if pos < len(keys) and keys[pos] == (' '.join(words[i:]), student_id):
+                del keys[pos]
+        postings = self._postings.get(key_grade, {})
+        for gram in trigrams(norm):
+            postings.get(gram, set()).discard(student_id)
+
+    def _rows(self, since=None):
+        query = select(Student.id, Student.grade, Student.fname, Student.lname, Student.total_fees)
+        if since is not None:
+            query = query.where(Student.updated_at > since)
+        return db.session.execute(query).all()
+
+    def warm(self) -> int:
+        """Loads every student. Returns the number indexed."""
+        with self._lock:
+            stamp = db.session.execute(select(func.max(Student.updated_at))).scalar()
+            rows = self._rows()
+            self._reset()
+            for row in rows:
+                self._add(*row)
+            self._stamp, self._synced_at, self.loaded = stamp, time.monotonic(), True
+        event_logger.info(f"Student index loaded with {len(rows)} students")
+        return len(rows)
+
+    def sync(self, force: bool = False) -> None:
+        """Loads the index if needed, then re-reads students changed by other processes."""
+        if not self.loaded:
+            self.warm()
+            return
+        if not force and time.monotonic() - self._synced_at < self.sync_interval:
+            return
+        with self._lock:
+            stamp = db.session.execute(select(func.max(Student.updated_at))).scalar()
+            if self._stamp is None or stamp is None:
+                changed = self._rows() if stamp is not None else []
+            else:
+                changed = self._rows(self._stamp - self.clock_skew) if stamp > self._stamp - self.clock_skew else []
+            for row in changed:
+                self._add(*row)
+            self._stamp, self._synced_at = stamp or self._stamp, time.monotonic()
+
+    def _warm(self):
+        if self.loaded or self._warm_attempted:
+            return
+        self._warm_attempted = True
+        try:
+            self.sync()
+        except Exception as e:
+            error_logger.error(f"Could not load the student index: {e}", exc_info=True)
+
+    def _collect_changes(self, session, flush_context):
+        changes = session.info.setdefault('student_index_changes', {})
+        for obj in (*session.new, *session.dirty):
+            if isinstance(obj, Student) and obj.id is not None:
+                changes[obj.id] = (obj.grade, obj.fname, obj.lname, obj.total_fees)
+        for obj in session.deleted:
+            if isinstance(obj, Student) and obj.id is not None:
+                changes[obj.id] = None
+
+    def _apply_changes(self, session):
+        changes = session.info.pop('student_index_changes', None)
+        if not changes or not self.loaded:
+            return
+        with self._lock:
+            for student_id, values in changes.items():
+                if values is None:
+                    self._remove(student_id)
+                else:
+                    self._add(student_id, *values)
+
+    def _discard_changes(self, session):
+        session.info.pop('student_index_changes', None)
+
+    def add_on_commit(self, session, student: Student) -> None:
+        """Indexes a student inserted with a Core statement, which the flush events never see, once `session` commits."""
+        changes = session.info.setdefault('student_index_changes', {})
+        changes[student.id] = (student.grade, student.fname, student.lname, student.total_fees)
+
+    # ── queries ──────────────────────────────────────────────────────────────────
+
+    def get(self, student_id: int) -> dict | None:
+        with self._lock:
+            return self._students.get(student_id)
+
+    def suggest(self, query: str, grade: str = None, limit: int = 8) -> list[dict]:
+        """
+        Ranks students whose name matches `query`: exact names first, then
+        full-name prefixes, then prefixes of a later word (e.g. the last
+        name), then names sharing enough trigrams to survive a typo.
+
+        Args:
+            query (str): Name or name prefix as typed.
+            grade (str, optional): Only this grade. Defaults to all grades.
+            limit (int): Maximum number of suggestions.
+
+        Returns:
+            list[dict]: Students with id, grade, fname, lname, name, total_fees and score.
+        """
+        norm = normalize_name(query)
+        if not norm:
+            return []
+        self.sync()
+
+        with self._lock:
+            grades = [normalize_grade(grade)] if grade else list(self._keys)
+            scores: dict[int, float] = {}
+
+            def score(student_id, value):
+                if value > scores.get(student_id, 0):
+                    scores[student_id] = value
+
+            for key_grade in grades:
+                keys = self._keys.get(key_grade, [])
+                pos = bisect_left(keys, (norm, -1))
+                while pos < len(keys) and keys[pos][0].startswith(norm):
+                    key, student_id = keys[pos]
+                    full = self._students[student_id]['norm']
+                    if key == full:
+                        score(student_id, 1.0 if key == norm else 0.9)
+                    else:
+                        score(student_id, 0.8)
+                    pos += 1
+
+                query_grams = trigrams(norm)
+                shared: dict[int, int] = {}
+                postings = self._postings.get(key_grade, {})
+                for gram in query_grams:
+                    for student_id in postings.get(gram, ()):
+                        shared[student_id] = shared.get(student_id, 0) + 1
+                for student_id, common in shared.items():
+                    similarity = common / (len(query_grams) + self._students[student_id]['grams'] - common)
+                    if similarity >= self.min_similarity:
+                        score(student_id, 0.75 * similarity)
+
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], self._students[item[0]]['norm'], item[0]))
+            return [
+                {
+                    key: self._students[student_id][key]
+                    for key in ('id', 'grade', 'fname', 'lname', 'name', 'total_fees')
+                } | {'score': round(value, 3)}
+                for student_id, value in ranked[:limit]
+            ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'students': len(self._students), 'grades': len(self._keys), 'loaded': self.loaded}
+
+
+student_index = StudentIndex()
@@ -0,0 +1,422 @@
+import json
+import os
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from main.extensions import db
+from main.logger import event_logger, error_logger
+from main.models import Attendance, Teacher, Recording
+from main.attendance import mark_present
+from main.storage import recording_path
+from main.renditions import generate_derivatives
+
+# ── main/transcode.py ────────────────────────────────────────────────────────────
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+REMUX = 'remux'
+TRANSCODE = 'transcode'
+DUPLICATE = 'duplicate'
+
+# Inputs with these codecs in an MP4/MOV container only need a stream copy
+REMUX_VIDEO_CODECS = {'h264'}
+REMUX_AUDIO_CODECS = {'aac'}
+REMUX_FORMATS = {'mov', 'mp4'}
+
+
+def probe_video(path: str) -> dict | None:
+    """
+    Reads container and stream information for a video with ffprobe.
+
+    Args:
+        path (str): Video file to probe.
+
+    Returns:
+        dict | None: Format names, duration, video codec and size and the audio
+        codecs, or None if the file could not be probed.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=format_name,duration:stream=codec_type,codec_name,width,height',
+        '-of', 'json', path
+    ]
+    try:
+        output = subprocess.run(cmd, check=True, capture_output=True, timeout=60).stdout
+        info = json.loads(output)
+    except (subprocess.SubprocessError, OSError, ValueError) as e:
+        error_logger.error(f"ffprobe failed for {path}: {e}")
+        return None
+
+    streams = info.get('streams', [])
+    video = next((st for st in streams if st.get('codec_type') == 'video'), {})
+    fmt = info.get('format', {})
+    try:
+        duration = float(fmt.get('duration'))
+    except (TypeError, ValueError):
+        duration = None
+
+    return {
+        'formats': set(fmt.get('format_name', '').split(',')),
+        'duration': duration,
+        'video_codec': video.get('codec_name'),
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'audio_codecs': [st.get('codec_name') for st in streams if st.get('codec_type') == 'audio'],
+    }
+
+
+def build_transcode_cmd(source_path: str, output_path: str, profile: dict, threads: int = 0) -> list[str]:
+    """
+    Builds an H.264/AAC MP4 ffmpeg command for a transcoding profile.
+
+    Args:
+        source_path (str): Input video.
+        output_path (str): Output MP4 path.
+        profile (dict): Profile with `preset`, `crf`, `max_height` and `audio_bitrate`.
+        threads (int, optional): Encoder thread cap, 0 lets ffmpeg decide.
+
+    Returns:
+        list[str]: The ffmpeg command.
+    """
+    cmd = ['ffmpeg', '-y', '-i', source_path]
+    if profile.get('max_height'):
+        # Never upscale; -2 keeps the width even as required by libx264
+        cmd += ['-vf', f"scale=-2:'min({profile['max_height']},ih)'"]
+    cmd += [
+        '-c:v', 'libx264',
+        '-preset', profile.get('preset', 'medium'),
+        '-crf', str(profile.get('crf', 23)),
+        '-c:a', 'aac', '-b:a', profile.get('audio_bitrate', '128k'),
+    ]
+    if threads:
+        cmd += ['-threads', str(threads), '-filter_threads', str(threads)]
+    cmd += ['-movflags', '+faststart', output_path]
+    return cmd
+
+
+def can_remux(probe: dict | None) -> bool:
+    """True if a probed video is already H.264/AAC in an MP4 compatible container."""
+    if not probe:
+        return False
+    return (
+        bool(probe['formats'] & REMUX_FORMATS)
+        and probe['video_codec'] in REMUX_VIDEO_CODECS
+        and all(codec in REMUX_AUDIO_CODECS for codec in probe['audio_codecs'])
+    )
+
+
+class TranscodeQueue:
+    """
+    Bounded, in-process queue that converts uploaded lecture videos in the
+    background and marks the attendance row only once conversion succeeds.
+
+    Jobs live in memory, so status is only visible from the process that
+    accepted the upload.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._active_attendance = set()
+        self._completed = 0
+        self._failed = 0
+        self._wall_time_total = 0.0
+        self._modes = {REMUX: 0, TRANSCODE: 0, DUPLICATE: 0}
+        self._time_saved_total = 0.0
+        # Observed transcode seconds per second of video, used to estimate savings
+        self._transcode_seconds = 0.0
+        self._transcoded_media_seconds = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config.get('TRANSCODE_WORKERS', 2)
+        self.max_pending = app.config.get('TRANSCODE_QUEUE_SIZE', 20)
+        self.timeout = app.config.get('TRANSCODE_TIMEOUT', 3600)
+        self.history = app.config.get('TRANSCODE_JOB_HISTORY', 500)
+        self.threads = app.config.get('TRANSCODE_THREADS', 0)
+        self.profiles = app.config.get('TRANSCODE_PROFILES', {})
+        self.profile_name = app.config.get('TRANSCODE_PROFILE', 'balanced')
+        self.derivatives = app.config.get('RECORDING_DERIVATIVES', {})
+        if self.profile_name not in self.profiles:
+            error_logger.error(f"Unknown transcoding profile '{self.profile_name}', using defaults")
+        # Caps every ffmpeg process started through this queue, including
+        # ones run outside the worker pool
+        self.slots = threading.BoundedSemaphore(app.config.get('TRANSCODE_MAX_CONCURRENT', self.workers))
+
+    @property
+    def profile(self) -> dict:
+        return self.profiles.get(self.profile_name, {})
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='transcode')
+        return self._executor
+
+    def submit(self, attendance_id: int, teacher_id: int, source_path: str, content_hash: str) -> dict:
+        """
+        Queues a video for conversion. If a recording with the same content
+        hash already exists, it is reused and nothing is converted.
+
+        Args:
+            attendance_id (int): Attendance row to mark once the video is converted.
+            teacher_id (int): Teacher who uploaded the video.
+            source_path (str): Saved upload, removed after conversion.
+            content_hash (str): SHA-256 of the upload, keys the shared recording.
+
+        Returns:
+            dict: Result status with success flag and the job on success.
+        """
+        with self._lock:
+            if attendance_id in self._active_attendance:
+                return {'success': False, 'error': 'A video for this lecture is already being processed'}
+            if self._pending_count() >= self.max_pending:
+                event_logger.warning(f"Transcode queue full ({self.max_pending}), rejecting attendance {attendance_id}")
+                return {'success': False, 'error': 'Video processing queue is full. Please try again shortly.'}
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'attendance_id': attendance_id,
+                'teacher_id': teacher_id,
+                'source_path': source_path,
+                'content_hash': content_hash,
+                'output_path': None,
+                'work_path': None,
+                'status': QUEUED,
+                'error': None,
+                'submitted_at': datetime.utcnow().isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'wall_time': None,
+                'mode': None,
+                'media_duration': None,
+                'convert_time': None,
+                'time_saved': None,
+                'derivatives': None,
+            }
+            self._jobs[job['id']] = job
+            self._active_attendance.add(attendance_id)
+            self._prune()
+
+        self.executor.submit(self._run, job)
+        event_logger.info(f"Queued transcode job {job['id']} for attendance {attendance_id} (depth {self.stats()['queued']})")
+        return {'success': True, 'job': self.public(job)}
+
+    def get(self, job_id: str) -> dict | None:
+        job = self._jobs.get(job_id)
+        return self.public(job) if job else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = [job['status'] for job in self._jobs.values()]
+            finished = self._completed + self._failed
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'queued': statuses.count(QUEUED),
+                'running': statuses.count(RUNNING),
+                'completed': self._completed,
+                'failed': self._failed,
+                'avg_wall_time': round(self._wall_time_total / finished, 2) if finished else None,
+                'remuxed': self._modes[REMUX],
+                'transcoded': self._modes[TRANSCODE],
+                'deduplicated': self._modes[DUPLICATE],
+                'time_saved': round(self._time_saved_total, 1),
+            }
+
+    @staticmethod
+    def public(job: dict) -> dict:
+        """Returns the job fields that are safe to expose to clients."""
+        return {key: value for key, value in job.items() if key not in ('source_path', 'output_path', 'work_path')}
+
+    def _pending_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if job['status'] in (QUEUED, RUNNING))
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in (DONE, FAILED)]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: dict):
+        started = time.monotonic()
+        with self._lock:
+            job['status'] = RUNNING
+            job['started_at'] = datetime.utcnow().isoformat()
+
+        with self.app.app_context():
+            try:
+                existing = self._existing_recording(job['content_hash'])
+                if existing:
+                    job['output_path'] = os.path.join(self.app.config['UPLOAD_FOLDER'], existing.path)
+                    job['mode'] = DUPLICATE
+                    self._record_mode(job)
+                    event_logger.info(f"Job {job['id']} reuses existing recording {job['content_hash']}")
+                else:
+                    job['output_path'] = recording_path(self.app.config['UPLOAD_FOLDER'], job['content_hash'], date.today())
+                    self._convert(job)
+                self._mark_attendance(job)
+                job['status'] = DONE
+                # Derivatives are optional; the lecture is already marked if they fail
+                self._derive(job)
+            except Exception as e:
+                job['status'] = FAILED
+                job['error'] = str(e)
+                db.session.rollback()
+                if job['work_path'] and os.path.exists(job['work_path']):
+                    os.remove(job['work_path'])
+                error_logger.error(f"Transcode job {job['id']} failed: {e}", exc_info=True)
+            finally:
+                if os.path.exists(job['source_path']):
+                    os.remove(job['source_path'])
+                db.session.remove()
+
+        wall_time = time.monotonic() - started
+        with self._lock:
+            job['finished_at'] = datetime.utcnow().isoformat()
+            job['wall_time'] = round(wall_time, 2)
+            self._active_attendance.discard(job['attendance_id'])
+            self._wall_time_total += wall_time
+            if job['status'] == DONE:
+                self._completed += 1
+            else:
+                self._failed += 1
+
+        event_logger.info(f"Transcode job {job['id']} {job['status']} in {wall_time:.1f}s")
+
+    def _convert(self, job: dict):
+        """
+        Converts the upload to MP4, stream-copying when the codecs are already
+        acceptable and falling back to a full transcode otherwise.
+        """
+        probe = probe_video(job['source_path'])
+        job['media_duration'] = probe['duration'] if probe else None
+
+        # Convert next to the final path and move into place once complete, so
+        # a half-written file is never mistaken for an existing recording
+        os.makedirs(os.path.dirname(job['output_path']), exist_ok=True)
+        job['work_path'] = f"{job['output_path'][:-len('.mp4')]}.{job['id']}.tmp.mp4"
+
+        started = time.monotonic()
+        if can_remux(probe):
+            try:
+                self.run_ffmpeg(self._remux_cmd(job))
+                job['mode'] = REMUX
+            except RuntimeError as e:
+                event_logger.warning(f"Remux failed for job {job['id']}, transcoding instead: {e}")
+        if job['mode'] is None:
+            started = time.monotonic()
+            self.run_ffmpeg(self._transcode_cmd(job))
+            job['mode'] = TRANSCODE
+        job['convert_time'] = round(time.monotonic() - started, 2)
+        os.replace(job['work_path'], job['output_path'])
+
+        self._record_mode(job)
+        event_logger.info(
+            f"Job {job['id']} used {job['mode']} for a {job['media_duration']}s video "
+            f"in {job['convert_time']}s (estimated time saved: {job['time_saved']}s)"
+        )
+
+    def _remux_cmd(self, job: dict) -> list[str]:
+        return [
+            'ffmpeg', '-y', '-i', job['source_path'],
+            '-map', '0:v:0', '-map', '0:a?',
+            '-c', 'copy', '-movflags', '+faststart', job['work_path']
+        ]
+
+    def _transcode_cmd(self, job: dict) -> list[str]:
+        return build_transcode_cmd(job['source_path'], job['work_path'], self.profile, self.threads)
+
+    def run_ffmpeg(self, cmd: list[str]):
+        """Runs an ffmpeg command once a global transcoding slot is free."""
+        try:
+            with self.slots:
+                subprocess.run(cmd, check=True, capture_output=True, timeout=self.timeout)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError('Video conversion to MP4 failed') from e
+        except subprocess.TimeoutExpired as e:
+            raise RuntimeError(f'Video conversion exceeded {self.timeout}s') from e
+
+    def _record_mode(self, job: dict):
+        duration = job['media_duration']
+        with self._lock:
+            self._modes[job['mode']] += 1
+            if job['mode'] == TRANSCODE:
+                if duration:
+                    self._transcode_seconds += job['convert_time']
+                    self._transcoded_media_seconds += duration
+                job['time_saved'] = 0.0
+            elif duration and self._transcoded_media_seconds:
+                rate = self._transcode_seconds / self._transcoded_media_seconds
+                job['time_saved'] = round(max(0.0, duration * rate - job['convert_time']), 2)
+                self._time_saved_total += job['time_saved']
+
+    def _mark_attendance(self, job: dict):
+        attendance = db.session.get(Attendance, job['attendance_id'])
+        teacher = db.session.get(Teacher, job['teacher_id'])
+        if not attendance or not teacher:
+            raise RuntimeError('Lecture or teacher no longer exists')
+        if attendance.is_present:
+            raise RuntimeError('Lecture was already marked')
+
+        mark_present(attendance, teacher)
+        db.session.add(self._recording_for(job, attendance, teacher))
+        db.session.commit()
+
+    def _derive(self, job: dict):
+        """Produces the HLS renditions and thumbnails for a marked lecture, if enabled."""
+        if not self.derivatives.get('enabled'):
+            return
+        try:
+            duration = job['media_duration']
+            if duration is None:
+                probe = probe_video(job['output_path'])
+                duration = probe['duration'] if probe else None
+            job['derivatives'] = generate_derivatives(
+                job['output_path'], duration, self.derivatives, self.run_ffmpeg, self.threads
+            )
+        except Exception as e:
+            job['derivatives'] = {'error': str(e)}
+            error_logger.error(f"Generating derivatives for job {job['id']} failed: {e}", exc_info=True)
+
+    def _existing_recording(self, content_hash: str) -> Recording | None:
+        """Returns a stored recording with the same content whose file is still on disk."""
+        recording = (
+            Recording.query
+            .filter(Recording.sha256 == content_hash, Recording.status != 'deleted')
+            .first()
+        )
+        if recording and os.path.exists(os.path.join(self.app.config['UPLOAD_FOLDER'], recording.path)):
+            return recording
+        return None
+
+    def _recording_for(self, job: dict, attendance: Attendance, teacher: Teacher) -> Recording:
+        """Builds the catalog row for a finished job, reusing metadata of an identical upload."""
+        existing = self._existing_recording(job['content_hash']) if job['mode'] == DUPLICATE else None
+
+        return Recording(
+            attendance_id=attendance.id,
+            teacher_id=teacher.id,
+            date=attendance.date,
+            grade=attendance.timetable.grade,
+            subject=attendance.timetable.subject,
+            path=os.path.relpath(job['output_path'], self.app.config['UPLOAD_FOLDER']),
+            sha256=job['content_hash'],
+            size=os.path.getsize(job['output_path']),
+            duration=existing.duration if existing else job['media_duration'],
+            codec=existing.codec if existing else 'h264',
+            mode=job['mode'],
+            status=existing.status if existing else 'ready',
+        )
+
+
+transcode_queue = TranscodeQueue()
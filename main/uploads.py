@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+from main.logger import event_logger, error_logger
+
+# ── main/uploads.py ──────────────────────────────────────────────────────────────
+
+SESSION_DIR = '.sessions'
+BUFFER_SIZE = 1024 * 1024
+HEAD_SIZE = 12
+
+# One lock per upload session so concurrent PUTs cannot both pass the offset check
+_session_locks = {}
+_session_locks_guard = threading.Lock()
+# Running SHA-256 of each session's bytes and how many bytes it covers
+_session_digests = {}
+
+
+def util_video_signature_ok(head: bytes) -> bool:
+    """
+    Checks the leading bytes of a file against the containers we accept
+    (MP4/MOV, MKV/WebM and AVI).
+
+    Args:
+        head (bytes): At least the first 12 bytes of the file.
+
+    Returns:
+        bool: True if the bytes look like a supported video container.
+    """
+    if len(head) < HEAD_SIZE:
+        return False
+    if head[4:8] in (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip'):
+        return True
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return True
+    if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return True
+    return False
+
+
+def _session_path(upload_folder: str, upload_id: str) -> str:
+    return os.path.join(upload_folder, SESSION_DIR, secure_filename(upload_id) + '.json')
+
+
+def _session_lock(upload_id: str) -> threading.Lock:
+    with _session_locks_guard:
+        return _session_locks.setdefault(upload_id, threading.Lock())
+
+
+def _data_size(upload: dict) -> int:
+    return os.path.getsize(upload['data_path']) if os.path.exists(upload['data_path']) else 0
+
+
+def _running_digest(upload: dict, offset: int):
+    """
+    Returns the session's running hash, caught up to `offset`. A session resumed
+    in another process, or after a failed write, has no usable state and hashes
+    the bytes already on disk once.
+    """
+    digest, hashed = _session_digests.get(upload['id'], (None, -1))
+    if hashed != offset:
+        digest = hashlib.sha256()
+        if offset:
+            with open(upload['data_path'], 'rb') as f:
+                for block in iter(lambda: f.read(BUFFER_SIZE), b''):
+                    digest.update(block)
+        _session_digests[upload['id']] = (digest, offset)
+    return digest
+
+
+def _save_session(upload_folder: str, upload: dict) -> None:
+    path = _session_path(upload_folder, upload['id'])
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(upload, f)
+    os.replace(tmp_path, path)
+
+
+def create_upload_session(upload_folder: str, attendance_id: int, teacher_id: int,
+                          data_path: str, size: int) -> dict:
+    """
+    Starts a resumable upload whose bytes are written directly to `data_path`.
+
+    Args:
+        upload_folder (str): Root upload folder, sessions are kept under it.
+        attendance_id (int): Lecture the video belongs to.
+        teacher_id (int): Teacher uploading the video.
+        data_path (str): Final location of the uploaded bytes.
+        size (int): Declared total size in bytes.
+
+    Returns:
+        dict: The upload session.
+    """
+    os.makedirs(os.path.join(upload_folder, SESSION_DIR), exist_ok=True)
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+
+    upload = {
+        'id': uuid.uuid4().hex,
+        'attendance_id': attendance_id,
+        'teacher_id': teacher_id,
+        'data_path': data_path,
+        'size': size,
+        'created_at': datetime.utcnow().isoformat(),
+    }
+    # Start from an empty file so the on-disk size is the resume offset
+    open(data_path, 'wb').close()
+    _save_session(upload_folder, upload)
+    event_logger.info(f"Upload session {upload['id']} created for attendance {attendance_id} ({size} bytes)")
+    return upload
+
+
+def get_upload_session(upload_folder: str, upload_id: str) -> dict | None:
+    """Loads an upload session and its current offset, or None if unknown."""
+    path = _session_path(upload_folder, upload_id)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        upload = json.load(f)
+    upload['offset'] = _data_size(upload)
+    return upload
+
+
+def append_chunk(upload: dict, start: int, stream, length: int) -> dict:
+    """
+    Appends one byte range to an upload, reading the request stream in fixed
+    size blocks so memory use does not grow with the chunk size. The container
+    signature is checked once the first 12 bytes have arrived, which may take
+    more than one chunk.
+
+    Args:
+        upload (dict): Session returned by `get_upload_session`.
+        start (int): Offset of the first byte of the chunk.
+        stream: Readable binary stream with the chunk body.
+        length (int): Number of bytes in the chunk.
+
+    Returns:
+        dict: Result status with success flag, the new offset, and an HTTP
+        status code on failure.
+    """
+    with _session_lock(upload['id']):
+        # Re-read under the lock, the offset loaded with the session may be stale
+        offset = upload['offset'] = _data_size(upload)
+        if start != offset:
+            return {'success': False, 'error': 'Chunk does not start at the current offset', 'offset': offset, 'status': 409}
+        if length <= 0 or start + length > upload['size']:
+            return {'success': False, 'error': 'Chunk exceeds the declared upload size', 'offset': offset, 'status': 413}
+
+        remaining = length
+        try:
+            digest = _running_digest(upload, offset)
+            with open(upload['data_path'], 'ab+') as f:
+                if offset < HEAD_SIZE:
+                    block = stream.read(min(HEAD_SIZE - offset, remaining))
+                    f.seek(0)
+                    head = f.read(offset) + block
+                    # Short leading chunks are kept until the signature can be checked
+                    if (len(head) >= HEAD_SIZE or offset + len(block) == upload['size']) \
+                            and not util_video_signature_ok(head):
+                        return {'success': False, 'error': 'File is not a supported video', 'offset': offset, 'status': 415}
+                    f.write(block)
+                    digest.update(block)
+                    remaining -= len(block)
+
+                while remaining > 0:
+                    block = stream.read(min(BUFFER_SIZE, remaining))
+                    if not block:
+                        break
+                    f.write(block)
+                    digest.update(block)
+                    remaining -= len(block)
+        except OSError as e:
+            _session_digests.pop(upload['id'], None)
+            error_logger.error(f"Writing chunk for upload {upload['id']} failed: {e}", exc_info=True)
+            return {'success': False, 'error': 'Could not store chunk', 'offset': offset, 'status': 500}
+
+        upload['offset'] = _data_size(upload)
+        _session_digests[upload['id']] = (digest, upload['offset'])
+    if remaining:
+        # Client disconnected mid-chunk; what was written is kept for resuming
+        return {'success': False, 'error': 'Chunk was truncated', 'offset': upload['offset'], 'status': 400}
+    return {'success': True, 'offset': upload['offset']}
+
+
+def upload_digest(upload: dict) -> str:
+    """Returns the SHA-256 hex digest of an upload's bytes from its running hash."""
+    with _session_lock(upload['id']):
+        return _running_digest(upload, _data_size(upload)).hexdigest()
+
+
+def close_upload_session(upload_folder: str, upload: dict, discard: bool = False) -> None:
+    """Removes an upload session, and its data when `discard` is set."""
+    with _session_locks_guard:
+        _session_locks.pop(upload['id'], None)
+        _session_digests.pop(upload['id'], None)
+    path = _session_path(upload_folder, upload['id'])
+    if os.path.exists(path):
+        os.remove(path)
+    if discard and os.path.exists(upload['data_path']):
+        os.remove(upload['data_path'])
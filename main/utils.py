@@ -2,6 +2,7 @@ import os
 import uuid
 import re
 import imghdr
+from datetime import date
 
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
@@ -15,6 +16,37 @@ from functools import wraps
 # ── main/utils.py ────────────────────────────────────────────────────────────────
 
 
+def util_month_range(year: int, month: int) -> tuple[date, date]:
+    """
+    Returns the half-open date range [start, end) covering a month. Filtering
+    with `column >= start, column < end` lets the database use indexes on the
+    date column, unlike comparing extracted month and year parts.
+    Args:
+        year (int): The year
+        month (int): The month, 1-12
+    Returns:
+        tuple[date, date]: First day of the month and first day of the next month
+    """
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def util_period_range(year: int, month: int = None) -> tuple[date, date]:
+    """
+    Returns the half-open date range [start, end) for a month, or for the whole
+    year when no month is given.
+    Args:
+        year (int): The year
+        month (int, optional): The month, 1-12
+    Returns:
+        tuple[date, date]: First day of the period and first day after it
+    """
+    if month:
+        return util_month_range(year, month)
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
 def generate_password_hash(plain_password: str) -> str:
     """
     Generate a secure password hash using bcrypt.
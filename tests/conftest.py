@@ -0,0 +1,103 @@
+from contextlib import contextmanager
+from datetime import time
+
+import pytest
+from sqlalchemy import event
+
+from config import Config
+from main import create_app
+from main.extensions import db
+from main.models import Teacher, Timetable
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    PDF_CACHE_DIR = ''
+
+
+@pytest.fixture
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def file_app(tmp_path):
+    """An app on a SQLite file, for tests whose threads need connections of their own."""
+    class FileConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}}
+
+    app = create_app(FileConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def count_queries(app):
+    """Context manager collecting the SQL statements run inside it."""
+    @contextmanager
+    def counter():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+    return counter
+
+
+class Factory:
+    """Creates the rows most tests need, with throwaway values for required columns."""
+
+    def __init__(self):
+        self._count = 0
+
+    def teacher(self, name: str = None, pay_per_lecture: float = 100.0) -> Teacher:
+        self._count += 1
+        teacher = Teacher(
+            name=name or f'Teacher {self._count}',
+            email=f'teacher{self._count}@example.com',
+            password='x',
+            role='teacher',
+            address='Street',
+            mobile='9999999999',
+            pan_number='ABCDE1234F',
+            pay_per_lecture=pay_per_lecture,
+        )
+        db.session.add(teacher)
+        db.session.flush()
+        return teacher
+
+    def timetable(self, teacher: Teacher, day_of_week: int, subject: str = 'Maths', grade: str = '10', hour: int = 9) -> Timetable:
+        slot = Timetable(teacher_id=teacher.id, day_of_week=day_of_week, subject=subject, grade=grade, start_time=time(hour, 0))
+        db.session.add(slot)
+        db.session.flush()
+        return slot
+
+    def week(self, teachers: list[Teacher], slots_per_day: int = 1) -> list[Timetable]:
+        """Gives every teacher `slots_per_day` lectures on each weekday."""
+        return [
+            self.timetable(teacher, day, subject=f'Subject {n}', hour=8 + n)
+            for teacher in teachers
+            for day in range(7)
+            for n in range(slots_per_day)
+        ]
+
+
+@pytest.fixture
+def factory(app):
+    return Factory()
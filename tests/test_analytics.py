@@ -0,0 +1,119 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import or_
+
+from main.analytics import teacher_month_analytics
+from main.attendance import materialize_attendance, util_date_window
+from main.columnar import AttendanceColumns
+from main.extensions import db
+from main.models import Attendance, Timetable
+from main.utils import util_month_range
+
+
+MONTH = (2025, 6)
+
+
+def per_teacher_loop(teachers, year, month):
+    """The admin teacher analytics loop from before grouped aggregation, one query per teacher."""
+    analytics = []
+    for teacher in teachers:
+        records = Attendance.query.join(Timetable).filter(
+            or_(Timetable.teacher_id == teacher.id, Attendance.proxy_id == teacher.id),
+            db.extract('month', Attendance.date) == month,
+            db.extract('year', Attendance.date) == year
+        ).all()
+
+        def held(record):
+            return record.is_present and (
+                (record.is_proxy and record.proxy_id == teacher.id) or
+                (not record.is_proxy and record.timetable.teacher_id == teacher.id)
+            )
+
+        subjects, grades, days = {}, {}, {i: 0 for i in range(7)}
+        for record in filter(held, records):
+            subjects[record.timetable.subject] = subjects.get(record.timetable.subject, 0) + 1
+            grades[record.timetable.grade] = grades.get(record.timetable.grade, 0) + 1
+            days[record.timetable.day_of_week] += 1
+        present = sum(1 for record in records if held(record))
+        analytics.append({
+            'id': teacher.id,
+            'name': teacher.name,
+            'email': teacher.email,
+            'total_classes': len(records),
+            'proxy_classes': sum(1 for r in records if r.is_proxy and r.proxy_id == teacher.id),
+            'regular_classes': sum(1 for r in records if not r.is_proxy and r.timetable.teacher_id == teacher.id),
+            'absent_classes': sum(1 for r in records if r.timetable.teacher_id == teacher.id and r.is_proxy and r.proxy_id != teacher.id),
+            'monthly_earnings': teacher.pay_per_lecture * present,
+            'attendance_rate': round(present / len(records) * 100, 2) if records else 0,
+            'subject_distribution': subjects,
+            'grade_distribution': grades,
+            'day_distribution': days,
+            'pay_per_lecture': teacher.pay_per_lecture
+        })
+    return analytics
+
+
+def seed_month(factory, teachers: int):
+    """A month of lectures with a mix of held, missed and proxied ones."""
+    staff = [factory.teacher(pay_per_lecture=100.0 + 10 * i) for i in range(teachers)]
+    for i, teacher in enumerate(staff):
+        for day in range(6):
+            factory.timetable(teacher, day, subject=('Maths', 'Science', 'English')[(i + day) % 3], grade=str(8 + day % 3), hour=8 + i % 8)
+    materialize_attendance(util_date_window(30, date(2025, 6, 30)))
+
+    for n, attendance in enumerate(Attendance.query.order_by(Attendance.id).all()):
+        if n % 7 == 0:
+            continue  # missed
+        attendance.is_present = n % 11 != 0
+        if n % 5 == 0:
+            attendance.is_proxy = True
+            attendance.proxy_id = staff[(n // 5) % len(staff)].id  # sometimes the assigned teacher
+    db.session.commit()
+    return staff
+
+
+@pytest.mark.parametrize('teachers', [3, 12])
+def test_matches_the_per_teacher_loop_in_bounded_queries(factory, count_queries, teachers):
+    staff = seed_month(factory, teachers)
+    expected = per_teacher_loop(staff, *MONTH)
+
+    with count_queries() as statements:
+        result = teacher_month_analytics(*util_month_range(*MONTH), staff)
+
+    assert result == expected
+    assert any(entry['proxy_classes'] for entry in result)
+    assert any(entry['absent_classes'] for entry in result)
+    assert len(statements) == 2
+
+
+def test_columnar_matches_grouped_aggregation_across_refreshes(factory, monkeypatch):
+    staff = seed_month(factory, 4)
+    period = util_month_range(*MONTH)
+    columns = AttendanceColumns(clock_skew=0)
+    assert columns.teacher_analytics(*period, staff) == teacher_month_analytics(*period, staff)
+
+    late = Attendance.query.order_by(Attendance.date.desc(), Attendance.id).first()
+    late.is_present, late.is_proxy, late.proxy_id = True, True, staff[-1].id
+    db.session.commit()
+    assert columns.refresh()['mode'] == 'incremental'
+    assert columns.teacher_analytics(*period, staff) == teacher_month_analytics(*period, staff)
+
+    # A timetable edit reloads everything into new arrays; readers keep seeing the old set until the swap
+    arrays, subjects = columns.arrays, columns.subjects
+    kept = {name: array.copy() for name, array in arrays.items()}
+    visible_during_load = []
+    load = columns._load
+
+    def watched_load(*args, **kwargs):
+        visible_during_load.append(columns.arrays)
+        return load(*args, **kwargs)
+
+    monkeypatch.setattr(columns, '_load', watched_load)
+    Timetable.query.filter_by(teacher_id=staff[0].id).update({'subject': 'History'})
+    db.session.commit()
+    assert columns.refresh()['mode'] == 'full'
+    assert len(visible_during_load) == 1 and visible_during_load[0] is arrays
+    assert columns.arrays is not arrays and 'History' not in subjects
+    assert all((arrays[name] == kept[name]).all() for name in kept)
+    assert columns.teacher_analytics(*period, staff) == teacher_month_analytics(*period, staff)
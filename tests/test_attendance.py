@@ -0,0 +1,48 @@
+from datetime import date
+
+import pytest
+
+from main.attendance import materialize_attendance, pending_lectures, util_date_window
+from main.extensions import db
+from main.models import Attendance
+
+
+TODAY = date(2025, 6, 18)
+
+
+def _seed(factory, teachers: int, slots_per_day: int) -> list[date]:
+    factory.week([factory.teacher() for _ in range(teachers)], slots_per_day)
+    dates = util_date_window(7, TODAY)
+    materialize_attendance(dates)
+    return dates
+
+
+@pytest.mark.parametrize('teachers, slots_per_day', [(2, 1), (20, 4)])
+def test_pending_lectures_query_count_does_not_grow(factory, count_queries, teachers, slots_per_day):
+    dates = _seed(factory, teachers, slots_per_day)
+    # A couple of proxies so the proxy teacher relationship is populated too
+    for attendance in Attendance.query.limit(2).all():
+        attendance.is_proxy = True
+        attendance.proxy_id = factory.teacher().id
+    db.session.commit()
+    db.session.expire_all()
+
+    with count_queries() as statements:
+        lectures = pending_lectures(dates)
+        names = [(lecture['teacher_name'], lecture['proxy_name']) for lecture in lectures]
+
+    assert len(lectures) == teachers * slots_per_day * 7
+    assert len(names) == len(lectures)
+    assert len(statements) == 1
+
+
+def test_pending_lectures_filters_and_orders(factory):
+    first, second = factory.teacher(), factory.teacher()
+    factory.timetable(first, TODAY.weekday(), grade='9', hour=11)
+    factory.timetable(second, TODAY.weekday(), grade='10', hour=9)
+    materialize_attendance([TODAY])
+
+    lectures = pending_lectures([TODAY])
+    assert [lecture['start_time'].hour for lecture in lectures] == [9, 11]
+    assert [lecture['teacher_name'] for lecture in pending_lectures([TODAY], teacher_id=first.id)] == [first.name]
+    assert [lecture['grade'] for lecture in pending_lectures([TODAY], grade='10')] == ['10']
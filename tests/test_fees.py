@@ -0,0 +1,32 @@
+from datetime import date
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from main.extensions import db
+from main.fees import fee_schedules
+from main.models import FeeSchedule
+
+
+def test_open_band_rows_cannot_be_duplicated(app):
+    db.session.add_all([
+        FeeSchedule(academic_year=2025, component='tuition', label='Tuition', share=0.9),
+        FeeSchedule(academic_year=2025, component='tuition', label='Tuition again', share=0.5),
+    ])
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_open_bounds_cover_every_grade(app):
+    db.session.add_all([
+        FeeSchedule(academic_year=2025, component='tuition', label='Tuition', share=0.9, position=0),
+        FeeSchedule(academic_year=2025, component='books', label='Books', share=0.1, position=1),
+        FeeSchedule(academic_year=2025, grade_from=9, component='tuition', label='Senior tuition', share=1.0),
+    ])
+    db.session.commit()
+
+    day = date(2025, 6, 1)
+    assert [line['label'] for line in fee_schedules.breakdown(1000, 'LKG', day)] == ['Tuition', 'Books']
+    assert [line['amount'] for line in fee_schedules.breakdown(1000, '5', day)] == [900.0, 100.0]
+    assert [line['label'] for line in fee_schedules.breakdown(1000, '10', day)] == ['Senior tuition']
@@ -0,0 +1,34 @@
+from sqlalchemy import text
+
+from main.extensions import db
+from main.models import Attendance, StudentInvoice
+from main.utils import util_month_range
+
+
+def _plan(query) -> str:
+    """SQLite's EXPLAIN QUERY PLAN for an ORM query, as one string."""
+    statement = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    return ' | '.join(row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {statement}')))
+
+
+def test_month_range_is_half_open_across_years():
+    start, end = util_month_range(2025, 12)
+    assert (start.isoformat(), end.isoformat()) == ('2025-12-01', '2026-01-01')
+
+
+def test_proxy_lectures_of_a_month_use_the_proxy_date_index(app):
+    start, end = util_month_range(2025, 6)
+    plan = _plan(Attendance.query.filter(Attendance.proxy_id == 3, Attendance.date >= start, Attendance.date < end))
+    assert 'USING INDEX ix_attendance_proxy_id_date (proxy_id=? AND date>? AND date<?)' in plan
+
+
+def test_lectures_of_a_slot_use_the_unique_timetable_date_index(app):
+    start, end = util_month_range(2025, 6)
+    plan = _plan(Attendance.query.filter(Attendance.timetable_id == 3, Attendance.date >= start, Attendance.date < end))
+    assert '(timetable_id=? AND date>? AND date<?)' in plan
+
+
+def test_sales_invoices_of_a_month_use_the_sales_date_index(app):
+    start, end = util_month_range(2025, 6)
+    plan = _plan(StudentInvoice.query.filter(StudentInvoice.sales_id == 3, StudentInvoice.date >= start, StudentInvoice.date < end))
+    assert 'USING INDEX ix_student_invoices_sales_id_date (sales_id=? AND date>? AND date<?)' in plan
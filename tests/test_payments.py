@@ -0,0 +1,152 @@
+import random
+import threading
+import time
+from datetime import date
+
+import pytest
+from flask import template_rendered
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from main import payments
+from main.extensions import db
+from main.models import PaymentRequest, Sales, Student, StudentInvoice
+from main.student_index import student_index
+
+
+@pytest.fixture
+def sales(app):
+    person = Sales(name='Sam', email='sam@example.com', password='x', address='Street', mobile='9999999999', pan_number='ABCDE1234F')
+    db.session.add(person)
+    db.session.commit()
+    return person
+
+
+def test_first_payments_share_one_student_and_invoice(sales):
+    first, _ = payments.record_payment(sales, '10', 'Ravi Kumar', 100.0, 1000.0)
+    second, _ = payments.record_payment(sales, '10', 'Ravi Kumar', 50.0, 1000.0)
+
+    assert first.id == second.id
+    assert Student.query.count() == 1
+    assert db.session.get(Student, first.student_id).fees_paid == 150.0
+    assert db.session.get(StudentInvoice, first.id).fees_paid == 150.0
+
+
+def test_similar_name_is_not_paid_to_another_student(sales):
+    existing, _ = payments.record_payment(sales, '10', 'Ravi Kumar', 100.0, 1000.0)
+    other, _ = payments.record_payment(sales, '10', 'ravi  kumar.', 40.0, 1000.0)
+
+    assert other.student_id != existing.student_id
+    assert db.session.get(Student, existing.student_id).fees_paid == 100.0
+    # The near match is still offered as a suggestion
+    assert existing.student_id in [s['id'] for s in student_index.suggest('ravi kumar', grade='10')]
+
+
+def test_unknown_picked_student_is_rejected(sales):
+    with pytest.raises(payments.PaymentError) as error:
+        payments.record_payment(sales, '10', 'Ravi Kumar', 100.0, 1000.0, student_id=999)
+    assert error.value.status == 404
+    assert Student.query.count() == 0
+
+
+def test_new_student_is_indexed_on_commit(sales):
+    student_index.warm()
+    invoice, _ = payments.record_payment(sales, '9', 'Asha Rao', 10.0, 500.0)
+
+    assert student_index.get(invoice.student_id)['name'] == 'Asha Rao'
+
+
+def test_student_identity_is_unique(app):
+    db.session.add_all([
+        Student(grade='10', fname='Ravi', lname='Kumar', total_fees=1000.0),
+        Student(grade='10', fname='Ravi', lname='Kumar', total_fees=1000.0),
+    ])
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_replayed_key_does_not_pay_twice(sales):
+    first, replayed = payments.record_payment(sales, '10', 'Ravi Kumar', 100.0, 1000.0, idempotency_key='abc')
+    again, replayed_again = payments.record_payment(sales, '10', 'Ravi Kumar', 100.0, 1000.0, idempotency_key='abc')
+
+    assert (replayed, replayed_again) == (False, True)
+    assert again.id == first.id
+    assert db.session.get(Student, first.student_id).fees_paid == 100.0
+
+
+def test_sales_analytics_follow_the_sales_id_not_the_name(app, sales):
+    payments.record_payment(sales, '10', 'Ravi Kumar', 100.0, 1000.0)
+    sales.name = 'Samuel'
+    # A new colleague taking the old name does not inherit the invoices
+    namesake = Sales(name='Sam', email='sam2@example.com', password='x', address='Street', mobile='9999999999', pan_number='ABCDE1234F')
+    db.session.add(namesake)
+    db.session.commit()
+
+    rendered = []
+
+    def record(sender, template, context, **extra):
+        rendered.append(context)
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user'] = {'user_id': 1, 'role': 'admin', 'level': 1}
+    today = date.today()
+    with template_rendered.connected_to(record, app):
+        assert client.get(f'/admin/sales-analytics?month={today.month}&year={today.year}').status_code == 200
+
+    totals = {entry['name']: (entry['total_amount'], len(entry['student_details'])) for entry in rendered[0]['analytics']}
+    assert totals == {'Samuel': (100.0, 1), 'Sam': (0.0, 0)}
+
+
+def test_concurrent_payments_and_replays_pay_each_key_once(file_app):
+    sales = Sales(name='Sam', email='sam@example.com', password='x', address='Street', mobile='9999999999', pan_number='ABCDE1234F')
+    db.session.add(sales)
+    db.session.commit()
+    sales_id = sales.id
+    db.session.remove()
+
+    # Every thread submits every payment, so each key is also replayed by the other threads
+    requests = [(f'key-{n}', ('Ravi Kumar', 'Asha Rao')[n % 2], float(n + 1)) for n in range(12)]
+    errors = []
+
+    def cashier(worker):
+        order = random.Random(worker).sample(requests, len(requests))
+        with file_app.app_context():
+            person = db.session.get(Sales, sales_id)
+            try:
+                for key, name, amount in order:
+                    for attempt in range(50):
+                        try:
+                            payments.record_payment(person, '10', name, amount, 1000.0, idempotency_key=key)
+                            break
+                        except OperationalError:
+                            # SQLite allows one writer; a locked database is retried with the same key
+                            time.sleep(0.01 * (attempt + 1))
+                    else:
+                        errors.append(f'{key} never went through')
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=cashier, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    expected = {
+        name: sum(amount for _, payer, amount in requests if payer == name)
+        for name in ('Ravi Kumar', 'Asha Rao')
+    }
+    students = {f'{student.fname} {student.lname}': student for student in Student.query.all()}
+    assert {name: student.fees_paid for name, student in students.items()} == expected
+    invoices = dict(
+        db.session.query(StudentInvoice.student_id, func.sum(StudentInvoice.fees_paid))
+        .group_by(StudentInvoice.student_id).all()
+    )
+    assert {name: invoices[student.id] for name, student in students.items()} == expected
+    assert StudentInvoice.query.count() == 2
+    assert PaymentRequest.query.count() == len(requests)
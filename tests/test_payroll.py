@@ -0,0 +1,39 @@
+import zipfile
+from concurrent.futures import Future
+from datetime import date
+
+from main.attendance import materialize_attendance
+from main.extensions import db
+from main.models import Attendance, TeacherInvoice
+from main.payroll import run_payroll
+from main.pdf import PdfRenderError, pdf_renderer
+
+
+def test_payroll_records_teachers_whose_render_is_rejected(app, factory, monkeypatch, tmp_path):
+    app.config['PAYROLL_FOLDER'] = str(tmp_path)
+    day = date(2025, 6, 16)
+    first, second = factory.teacher(), factory.teacher()
+    factory.timetable(first, day.weekday())
+    factory.timetable(second, day.weekday(), hour=10)
+    materialize_attendance([day])
+    Attendance.query.update({'is_present': True})
+    db.session.commit()
+
+    def submit(html, options=None, tags=()):
+        if tags == (f'teacher:{first.id}:2025-06',):
+            raise PdfRenderError('PDF service is busy. Please try again shortly.')
+        future = Future()
+        future.set_result(b'%PDF-')
+        return future
+
+    monkeypatch.setattr(pdf_renderer, 'submit', submit)
+    result = run_payroll(2025, 6)
+
+    assert result['success'] is False
+    assert result['failed'] == [first.id]
+    assert result['teachers'] == 2
+    assert TeacherInvoice.query.count() == 2
+    with zipfile.ZipFile(result['archive']) as archive:
+        names = archive.namelist()
+    assert f'invoice_{second.id}_202506.pdf' in names
+    assert f'invoice_{first.id}_202506.pdf' not in names
@@ -0,0 +1,37 @@
+import threading
+import time
+
+import pytest
+
+from main.pdf import PdfBackend, PdfRenderer, PdfRenderError, register_backend
+
+
+class BlockingBackend(PdfBackend):
+    name = 'blocking'
+    release = threading.Event()
+
+    def render(self, html: str, options: dict, timeout: float) -> bytes:
+        self.release.wait(timeout)
+        return b'%PDF-' + html.encode()
+
+
+def test_backend_must_implement_render():
+    with pytest.raises(TypeError):
+        PdfBackend(None)
+
+
+def test_render_waits_at_most_the_request_timeout(app):
+    register_backend(BlockingBackend)
+    app.config.update(PDF_BACKEND='blocking', PDF_WORKERS=1, PDF_REQUEST_TIMEOUT=0.2, PDF_TIMEOUT=5)
+    renderer = PdfRenderer()
+    renderer.init_app(app)
+    BlockingBackend.release.clear()
+
+    started = time.monotonic()
+    with pytest.raises(PdfRenderError, match='busy'):
+        renderer.render('<p>slow</p>')
+    assert time.monotonic() - started < 2
+    assert renderer.stats()['timed_out'] == 1
+
+    BlockingBackend.release.set()
+    assert renderer.render('<p>fast</p>') == b'%PDF-<p>fast</p>'
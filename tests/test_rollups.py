@@ -0,0 +1,99 @@
+from datetime import date
+
+from main.analytics import analytics_cache, teacher_month_analytics, teacher_rollup_analytics
+from main.attendance import materialize_attendance, mark_present, util_date_window
+from main.extensions import db
+from main.models import Attendance
+from main.rollups import backfill_rollups
+from main.utils import util_month_range
+
+
+MONTH = util_month_range(2025, 6)
+
+
+def _seed(factory):
+    first, second = factory.teacher(), factory.teacher()
+    for day in range(7):
+        factory.timetable(first, day, subject='Maths')
+        factory.timetable(second, day, subject='Science', hour=10)
+    db.session.commit()
+    return [first, second]
+
+
+def _mark(teachers, count):
+    """Marks the first `count` lectures, the last one held by the other teacher as proxy."""
+    lectures = Attendance.query.order_by(Attendance.id).limit(count).all()
+    for n, attendance in enumerate(lectures):
+        assigned = next(t for t in teachers if t.id == attendance.timetable.teacher_id)
+        other = next(t for t in teachers if t is not assigned)
+        mark_present(attendance, other if n == count - 1 else assigned)
+    db.session.commit()
+
+
+def test_rollups_match_raw_aggregate_after_materialize_and_mark(factory):
+    teachers = _seed(factory)
+    backfill_rollups(*MONTH)
+    materialize_attendance(util_date_window(10, date(2025, 6, 20)))
+    _mark(teachers, 3)
+
+    expected = teacher_month_analytics(*MONTH, teachers)
+    assert [entry['total_classes'] for entry in expected] == [10, 11]
+    assert teacher_rollup_analytics(*MONTH, teachers) == expected
+
+
+def test_repeated_materialization_does_not_count_twice(factory):
+    teachers = _seed(factory)
+    dates = util_date_window(10, date(2025, 6, 20))
+    assert materialize_attendance(dates) == 20
+    assert materialize_attendance(dates) == 0
+    assert materialize_attendance(util_date_window(12, date(2025, 6, 22))) == 4
+    _mark(teachers, 2)
+
+    assert teacher_rollup_analytics(*MONTH, teachers) == teacher_month_analytics(*MONTH, teachers)
+
+
+def test_materialization_invalidates_cached_months(app, factory):
+    _seed(factory)
+    analytics_cache.ttl = 300
+    try:
+        analytics_cache.get_or_compute(('teachers', MONTH), *MONTH, lambda: 'stale')
+        materialize_attendance([date(2025, 6, 20)])
+        assert analytics_cache.get_or_compute(('teachers', MONTH), *MONTH, lambda: 'fresh') == 'fresh'
+    finally:
+        analytics_cache.invalidate()
+        analytics_cache.ttl = app.config['ANALYTICS_CACHE_TTL']
+
+
+def test_reassigned_slots_move_their_lectures(factory):
+    first, second = factory.teacher(), factory.teacher()
+    slots = [factory.timetable(first, day) for day in range(7)]
+    db.session.commit()
+    materialize_attendance(util_date_window(7, date(2025, 6, 22)))
+    for attendance in Attendance.query.order_by(Attendance.id).limit(3):
+        mark_present(attendance, first)
+    db.session.commit()
+
+    for slot in slots:
+        slot.teacher_id = second.id
+    db.session.commit()
+
+    rollups = teacher_rollup_analytics(*MONTH, [first, second])
+    assert [(entry['total_classes'], entry['regular_classes']) for entry in rollups] == [(0, 0), (7, 7)]
+    assert rollups == teacher_month_analytics(*MONTH, [first, second])
+
+
+def test_edited_and_deleted_slots_keep_rollups_in_step(factory):
+    teachers = _seed(factory)
+    materialize_attendance(util_date_window(10, date(2025, 6, 20)))
+    _mark(teachers, 3)
+
+    slot = Attendance.query.filter_by(is_present=True, is_proxy=False).first().timetable
+    slot.subject, slot.grade, slot.day_of_week = 'Physics', '11', (slot.day_of_week + 1) % 7
+    db.session.commit()
+    assert teacher_rollup_analytics(*MONTH, teachers) == teacher_month_analytics(*MONTH, teachers)
+
+    for attendance in slot.attendances:
+        db.session.delete(attendance)
+    db.session.delete(slot)
+    db.session.commit()
+    assert teacher_rollup_analytics(*MONTH, teachers) == teacher_month_analytics(*MONTH, teachers)
@@ -0,0 +1,50 @@
+from datetime import date
+
+from main.attendance import materialize_attendance, mark_present, util_date_window
+from main.extensions import db
+from main.models import Attendance, Timetable
+from main.snapshots import reconcile_snapshots, teacher_month_snapshot
+
+
+def _marked_week(factory):
+    """Seven slots of one teacher, a week materialized and three lectures held."""
+    first, second = factory.teacher(pay_per_lecture=100.0), factory.teacher(pay_per_lecture=150.0)
+    slots = [factory.timetable(first, day) for day in range(7)]
+    materialize_attendance(util_date_window(7, date(2025, 6, 22)))
+    for attendance in Attendance.query.order_by(Attendance.id).limit(3):
+        mark_present(attendance, first)
+    db.session.commit()
+    return first, second, slots
+
+
+def _lectures(teacher):
+    snapshot = teacher_month_snapshot(teacher.id, 2025, 6)
+    return (snapshot.total_lectures, snapshot.total_amount) if snapshot else (0, 0.0)
+
+
+def test_reassigned_slots_move_their_paid_lectures(factory):
+    first, second, slots = _marked_week(factory)
+    assert _lectures(first) == (3, 300.0)
+
+    for slot in slots:
+        slot.teacher_id = second.id
+    db.session.commit()
+
+    assert _lectures(first) == (0, 0.0)
+    assert _lectures(second) == (3, 450.0)
+    assert reconcile_snapshots(dry_run=True) == []
+
+
+def test_deleted_slot_drops_its_paid_lectures(factory):
+    first, _, _ = _marked_week(factory)
+    held = Attendance.query.filter_by(is_present=True).first()
+
+    # Attendance must go with the slot, as the timetable view requires
+    slot = db.session.get(Timetable, held.timetable_id)
+    for attendance in slot.attendances:
+        db.session.delete(attendance)
+    db.session.delete(slot)
+    db.session.commit()
+
+    assert _lectures(first) == (2, 200.0)
+    assert reconcile_snapshots(dry_run=True) == []
@@ -0,0 +1,132 @@
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+
+from main import uploads
+from main.uploads import create_upload_session, get_upload_session, append_chunk, upload_digest
+
+MP4_HEAD = b'\x00\x00\x00\x18ftypmp42'
+
+
+@pytest.fixture
+def upload_folder(app, tmp_path):
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    return str(tmp_path)
+
+
+def _login(client, role, user_id):
+    with client.session_transaction() as sess:
+        sess['user'] = {'id': user_id, 'role': role, 'email': f'{role}{user_id}@example.com'}
+
+
+def _upload(upload_folder, teacher_id, size=100):
+    return create_upload_session(upload_folder, 1, teacher_id, f'{upload_folder}/incoming/clip.mp4', size)
+
+
+def test_upload_is_only_visible_to_its_teacher(app, upload_folder):
+    upload = _upload(upload_folder, teacher_id=7)
+    client = app.test_client()
+
+    _login(client, 'teacher', 7)
+    assert client.get(f"/teacher/uploads/{upload['id']}").status_code == 200
+
+    # A sales or admin account whose id happens to match is not the owner
+    for role in ('sales', 'admin'):
+        _login(client, role, 7)
+        assert client.get(f"/teacher/uploads/{upload['id']}").status_code == 404
+        assert client.put(f"/teacher/uploads/{upload['id']}", data=b'x').status_code == 404
+        assert client.post(f"/teacher/uploads/{upload['id']}/finalize").status_code == 404
+
+
+def _append(upload_folder, upload, data):
+    current = get_upload_session(upload_folder, upload['id'])
+    return append_chunk(current, current['offset'], io.BytesIO(data), len(data))
+
+
+def test_short_first_chunks_are_buffered_until_the_signature_is_known(upload_folder):
+    body = MP4_HEAD + b'rest of the video'
+    upload = _upload(upload_folder, teacher_id=7, size=len(body))
+
+    assert _append(upload_folder, upload, body[:5]) == {'success': True, 'offset': 5}
+    assert _append(upload_folder, upload, body[5:9])['offset'] == 9
+    assert _append(upload_folder, upload, body[9:])['offset'] == len(body)
+    with open(upload['data_path'], 'rb') as f:
+        assert f.read() == body
+
+
+def test_signature_is_rejected_once_enough_bytes_arrive(upload_folder):
+    upload = _upload(upload_folder, teacher_id=7)
+
+    assert _append(upload_folder, upload, b'GIF8')['success']
+    result = _append(upload_folder, upload, b'9a not a video')
+    assert result['status'] == 415
+    assert result['offset'] == 4
+
+
+def test_upload_smaller_than_the_signature_is_rejected(upload_folder):
+    upload = _upload(upload_folder, teacher_id=7, size=6)
+
+    assert _append(upload_folder, upload, b'\x00\x00\x00')['success']
+    assert _append(upload_folder, upload, b'\x18ft')['status'] == 415
+
+
+def test_zero_size_upload_is_a_bad_request(app, factory, upload_folder):
+    teacher = factory.teacher()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user'] = {'id': teacher.id, 'role': 'teacher', 'email': teacher.email}
+    response = client.post('/teacher/uploads', json={'filename': 'clip.mp4', 'size': 0})
+    assert response.status_code == 400
+    assert 'greater than zero' in response.get_json()['error']
+
+
+class _SlowStream(io.BytesIO):
+    """Yields between blocks so competing writers get a chance to interleave."""
+
+    def read(self, size=-1):
+        threading.Event().wait(0.01)
+        return super().read(min(size, 4))
+
+
+def test_concurrent_chunks_for_the_same_offset_write_once(upload_folder):
+    body = MP4_HEAD + b'x' * 20
+    upload = _upload(upload_folder, teacher_id=7, size=len(body))
+    results = []
+
+    def put():
+        current = get_upload_session(upload_folder, upload['id'])
+        results.append(append_chunk(current, 0, _SlowStream(body), len(body)))
+
+    threads = [threading.Thread(target=put) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(result.get('status', 200) for result in results) == [200, 409, 409, 409]
+    assert os.path.getsize(upload['data_path']) == len(body)
+
+
+def test_digest_is_built_while_chunks_are_written(upload_folder, monkeypatch):
+    body = MP4_HEAD + os.urandom(3 * 1024)
+    upload = _upload(upload_folder, teacher_id=7, size=len(body))
+    for start in range(0, len(body), 1000):
+        assert _append(upload_folder, upload, body[start:start + 1000])['success']
+
+    # Finalizing must not read the data file back
+    monkeypatch.setattr(uploads, 'open', lambda *args, **kwargs: pytest.fail('file re-read'), raising=False)
+    assert upload_digest(upload) == hashlib.sha256(body).hexdigest()
+
+
+def test_digest_catches_up_when_a_session_is_resumed_elsewhere(upload_folder):
+    body = MP4_HEAD + os.urandom(2048)
+    upload = _upload(upload_folder, teacher_id=7, size=len(body))
+    assert _append(upload_folder, upload, body[:1000])['success']
+
+    # Another worker process has no running hash for this session
+    uploads._session_digests.clear()
+    assert _append(upload_folder, upload, body[1000:])['success']
+    assert upload_digest(upload) == hashlib.sha256(body).hexdigest()